@@ -0,0 +1,433 @@
+# benchmarks/load.py
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from typing import Callable, NamedTuple
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw
+
+from .synthetic import build_synthetic_database, write_empty_csv
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(REPO_DIR, "benchmarks", "data") # Synthetic databases, reused across runs (git-ignored)
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+
+class RequestSpec(NamedTuple):
+    """One HTTP request of a scenario. With 'stream' the body is read chunk by chunk and time to first byte is recorded."""
+    method: str
+    path: str
+    params: dict | None = None
+    json: dict | None = None
+    headers: dict | None = None
+    stream: bool = False
+
+
+class BenchContext(NamedTuple):
+    """What scenarios know about the data being served, fetched from /api/symbols before the run."""
+    first_day: date
+    last_day: date
+    etag: str | None # Of the 'stock_data_revalidate' request, for If-None-Match
+
+
+# --- Scenarios ---
+# Each scenario builds the next request from a per-worker RNG, so runs with the same seed send the same traffic.
+LLM_QUESTIONS = [
+    "which {n} days had the widest range between high and low in {year}",
+    "list the {n} biggest gap ups after a SHORT signal in {year}",
+    "how often did the close finish above the resistance upper band in {year}",
+    "what were the {n} quietest trading days by volume in {year}",
+]
+
+GENERAL_QUESTIONS = [
+    "explain what drove the trend in {year}",
+    "why did volatility change during {year}",
+    "explain how support and resistance levels are used",
+]
+
+
+def _random_day(rng: random.Random, context: BenchContext, span_days: int = 0) -> date:
+    days = max((context.last_day - context.first_day).days - span_days, 0)
+    return context.first_day + timedelta(days=rng.randint(0, days))
+
+
+def _random_year(rng: random.Random, context: BenchContext) -> int:
+    return rng.randint(context.first_day.year, context.last_day.year)
+
+
+def _chart_png(rng: random.Random) -> str:
+    """A small random line chart, base64 encoded; every image is new, so the analysis cache never answers."""
+    image = Image.new("RGB", (480, 270), "white")
+    draw = ImageDraw.Draw(image)
+    points = [(x, 135 + rng.randint(-120, 120)) for x in range(0, 480, 12)]
+    draw.line(points, fill=(38, 166, 154), width=2)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def stock_data_range(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """A random year of daily bars: mostly cache misses, so this measures the query and encoding path."""
+    start = _random_day(rng, context, span_days=365)
+    params = {"format": "columnar", "from": start.isoformat(), "to": (start + timedelta(days=365)).isoformat()}
+    return RequestSpec("GET", "/api/stock_data", params=params, headers={"Accept-Encoding": "gzip, br"})
+
+
+def stock_data_latest(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """The dashboard's initial load of the latest bars: served from the response cache after the first request."""
+    return RequestSpec("GET", "/api/stock_data", params={"format": "columnar", "limit": 2000}, headers={"Accept-Encoding": "gzip, br"})
+
+
+def stock_data_revalidate(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """A browser revalidating an unchanged chart: should be a 304."""
+    headers = {"Accept-Encoding": "gzip, br", "If-None-Match": context.etag or ""}
+    return RequestSpec("GET", "/api/stock_data", params={"format": "columnar", "limit": 2000}, headers=headers)
+
+
+def chat_fast_path(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """Template questions answered by the intent router without an LLM call."""
+    question = rng.choice(["highest close in {year}", "average volume in {year}", "how many LONG signals in {year}"])
+    return RequestSpec("POST", "/api/chat", json={"message": question.format(year=_random_year(rng, context))})
+
+
+def chat_llm(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """Questions that need Text-to-SQL, so they go through the (fake) Gemini backend unless the SQL cache knows them."""
+    question = rng.choice(LLM_QUESTIONS).format(n=rng.randint(3, 20), year=_random_year(rng, context))
+    return RequestSpec("POST", "/api/chat", json={"message": question})
+
+
+def chat_stream(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """
+    A general question over SSE: Text-to-SQL answers N/A (see FAKE_NON_SQL_PREFIXES), then the chat answer
+    is streamed, so this covers two LLM calls. Records time to first byte as well.
+    """
+    question = rng.choice(GENERAL_QUESTIONS).format(year=_random_year(rng, context))
+    return RequestSpec("POST", "/api/chat/stream", json={"message": question}, stream=True)
+
+
+def analyze_chart(rng: random.Random, context: BenchContext) -> RequestSpec:
+    """A fresh chart image through /api/analyze_chart: Base64 decode, image store and a vision call."""
+    return RequestSpec("POST", "/api/analyze_chart", json={"image_data": _chart_png(rng)})
+
+
+SCENARIOS: dict[str, Callable[[random.Random, BenchContext], RequestSpec]] = {
+    "stock_data_range": stock_data_range,
+    "stock_data_latest": stock_data_latest,
+    "stock_data_revalidate": stock_data_revalidate,
+    "chat_fast_path": chat_fast_path,
+    "chat_llm": chat_llm,
+    "chat_stream": chat_stream,
+    "analyze_chart": analyze_chart,
+}
+
+# Traffic mix of the 'mixed' scenario: mostly chart loads, some chat
+MIXED_WEIGHTS = {
+    "stock_data_range": 3, "stock_data_latest": 3, "stock_data_revalidate": 2,
+    "chat_fast_path": 2, "chat_llm": 1, "chat_stream": 1, "analyze_chart": 1,
+}
+
+
+def mixed(rng: random.Random, context: BenchContext) -> RequestSpec:
+    name = rng.choices(list(MIXED_WEIGHTS), weights=list(MIXED_WEIGHTS.values()))[0]
+    return SCENARIOS[name](rng, context)
+
+
+SCENARIOS["mixed"] = mixed
+
+
+# --- Load generation ---
+def _send(session: requests.Session, base_url: str, spec: RequestSpec) -> tuple[int, float, float]:
+    """Sends one request and reads the whole body. Returns (status, seconds to first byte, total seconds)."""
+    start = time.perf_counter()
+    with session.request(spec.method, base_url + spec.path, params=spec.params, json=spec.json,
+                         headers=spec.headers, stream=True, timeout=120) as response:
+        first_byte = None
+        for _ in response.iter_content(chunk_size=None if spec.stream else 64 * 1024):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+        total = time.perf_counter() - start
+    return response.status_code, first_byte if first_byte is not None else total, total
+
+
+def _percentiles(seconds: list[float]) -> dict:
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    values = np.array(seconds) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+            "mean_ms": round(float(values.mean()), 3), "max_ms": round(float(values.max()), 3)}
+
+
+def run_scenario(base_url: str, name: str, context: BenchContext, concurrency: int = 8, duration: float = 10.0,
+                 warmup: float = 2.0, seed: int = 0) -> dict:
+    """
+    Runs 'concurrency' closed-loop clients (each sends its next request as soon as the previous one finished)
+    for 'warmup' + 'duration' seconds; only requests started after the warmup are measured.
+    Non-2xx/304 responses and exceptions count as errors and are left out of the latency figures.
+    """
+    build_request = SCENARIOS[name]
+    lock = threading.Lock()
+    latencies, first_bytes, status_counts = [], [], {}
+    errors = 0
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+
+    def client(slot: int):
+        nonlocal errors
+        rng = random.Random(f"{seed}-{name}-{slot}")
+        with requests.Session() as session:
+            while True:
+                started = time.perf_counter()
+                if started >= deadline:
+                    return
+                spec = build_request(rng, context)
+                try:
+                    status, first_byte, total = _send(session, base_url, spec)
+                except requests.RequestException:
+                    status, first_byte, total = "exception", None, None
+                if started < measure_from:
+                    continue
+                with lock:
+                    status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+                    if status in (200, 304):
+                        latencies.append(total)
+                        if spec.stream:
+                            first_bytes.append(first_byte)
+                    else:
+                        errors += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+
+    result = {
+        "scenario": name, "concurrency": concurrency, "duration_s": duration,
+        "requests": len(latencies) + errors, "errors": errors, "status_counts": status_counts,
+        "requests_per_sec": round(len(latencies) / duration, 2),
+        **_percentiles(latencies),
+    }
+    if first_bytes:
+        result["ttfb"] = _percentiles(first_bytes)
+    return result
+
+
+# --- Server under test ---
+class BenchServer:
+    """
+    Runs main.py under uvicorn in a subprocess, serving 'database_file' with the fake Gemini backend.
+    Everything the server writes (SQL cache, ingest checkpoint) goes next to the database, not into the repo.
+    """
+
+    def __init__(self, database_file: str, port: int = 8765, workers: int = 1, env: dict | None = None):
+        self.database_file = database_file
+        self.port = port
+        self.workers = workers
+        self.env = env or {}
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.process = None
+
+    def __enter__(self):
+        scratch_prefix = os.path.splitext(self.database_file)[0]
+        csv_file = scratch_prefix + ".csv"
+        write_empty_csv(csv_file)
+        env = {
+            **os.environ,
+            "DATABASE_FILE": self.database_file,
+            "CSV_FILE": csv_file,
+            "INGEST_CHECKPOINT_FILE": scratch_prefix + "_checkpoint.json",
+            "SQL_CACHE_FILE": scratch_prefix + "_sql_cache.db",
+            "GEMINI_BACKEND": "fake",
+            "LIVE_SYNC_INTERVAL_SECONDS": "0",
+            # Several workers share sessions and key cooldowns through a scratch SQLite state file
+            **({"SHARED_STATE_URL": f"sqlite:///{scratch_prefix}_shared_state.db"} if self.workers > 1 else {}),
+            **self.env,
+        }
+        if os.path.exists(env["SQL_CACHE_FILE"]):
+            os.remove(env["SQL_CACHE_FILE"]) # Every run starts with a cold NL->SQL cache
+        if self.workers > 1 and os.path.exists(f"{scratch_prefix}_shared_state.db"):
+            os.remove(f"{scratch_prefix}_shared_state.db")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--workers", str(self.workers), "--log-level", "warning", "--no-access-log"],
+            cwd=REPO_DIR, env=env,
+        )
+        wait_until_ready(self.base_url, timeout=600, process=self.process)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def wait_until_ready(base_url: str, timeout: float, process: subprocess.Popen | None = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup with code {process.returncode}.")
+        try:
+            if requests.get(base_url + "/api/symbols", timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Server at {base_url} did not become ready within {timeout:.0f}s.")
+
+
+def fetch_context(base_url: str) -> BenchContext:
+    default = requests.get(base_url + "/api/symbols", timeout=30).json()["symbols"][0]
+    etag = requests.get(base_url + "/api/stock_data", params={"format": "columnar", "limit": 2000},
+                        headers={"Accept-Encoding": "gzip, br"}, timeout=120).headers.get("ETag")
+    return BenchContext(date.fromisoformat(default["first"]), date.fromisoformat(default["last"]), etag)
+
+
+def synthetic_database(rows: int, seed: int) -> str:
+    """Path of the synthetic database for (rows, seed), built on first use."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    database_file = os.path.join(DATA_DIR, f"synthetic_{rows}_{seed}.db")
+    if not os.path.exists(database_file):
+        print(f"Building synthetic database with {rows:,} bars...")
+        build = build_synthetic_database(database_file + ".tmp", rows, seed=seed)
+        os.replace(database_file + ".tmp", database_file)
+        print(f"Built '{database_file}' in {build['seconds']:.1f}s.")
+    return database_file
+
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+# --- Command Line Interface ---
+def _run(args):
+    scenario_names = list(SCENARIOS) if args.scenarios == "all" else args.scenarios.split(",")
+    unknown = [name for name in scenario_names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}. Use any of: {', '.join(SCENARIOS)}.")
+
+    config = {
+        "rows": args.rows, "seed": args.seed, "concurrency": args.concurrency, "duration_s": args.duration,
+        "warmup_s": args.warmup, "workers": args.workers, "url": args.url,
+        "fake_gemini": {"latency_ms": args.llm_latency_ms, "jitter_ms": args.llm_jitter_ms,
+                        "rate_limit_rate": args.rate_limit_rate, "stream_chunks": args.stream_chunks,
+                        "key_cooldown_s": args.key_cooldown},
+    }
+    if args.url:
+        server = nullcontext() # An already running server; --rows and the fake backend settings don't apply
+        base_url = args.url.rstrip("/")
+    else:
+        server = BenchServer(synthetic_database(args.rows, args.seed), port=args.port, workers=args.workers, env={
+            "FAKE_GEMINI_LATENCY_MS": str(args.llm_latency_ms),
+            "FAKE_GEMINI_JITTER_MS": str(args.llm_jitter_ms),
+            "FAKE_GEMINI_RATE_LIMIT_RATE": str(args.rate_limit_rate),
+            "FAKE_GEMINI_STREAM_CHUNKS": str(args.stream_chunks),
+            **({"GEMINI_RATE_LIMIT_COOLDOWN": str(args.key_cooldown)} if args.key_cooldown is not None else {}),
+        })
+        base_url = server.base_url
+
+    with server:
+        context = fetch_context(base_url)
+        results = []
+        print(f"{'scenario':<24}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for name in scenario_names:
+            result = run_scenario(base_url, name, context, concurrency=args.concurrency, duration=args.duration,
+                                  warmup=args.warmup, seed=args.seed)
+            results.append(result)
+            print(f"{name:<24}{result['requests_per_sec']:>10,.1f}{result['p50_ms'] or 0:>10.1f}"
+                  f"{result['p95_ms'] or 0:>10.1f}{result['p99_ms'] or 0:>10.1f}{result['errors']:>8}")
+        server_stats = requests.get(base_url + "/api/stats", timeout=30).json()
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        **git_revision(),
+        "python": platform.python_version(),
+        "config": config,
+        "results": results,
+        "server_stats": server_stats,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        revision = (report["commit"] or "nogit")[:8] + ("-dirty" if report["dirty"] else "")
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to '{output}'.")
+
+
+def _compare(args):
+    """Side-by-side throughput and latency of two saved runs, per scenario."""
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    print(f"baseline:  {(baseline.get('commit') or '?')[:8]}  {args.baseline}")
+    print(f"candidate: {(candidate.get('commit') or '?')[:8]}  {args.candidate}")
+
+    def change(old, new) -> str:
+        if not old or new is None:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    baseline_results = {result["scenario"]: result for result in baseline["results"]}
+    print(f"{'scenario':<24}{'req/s':>20}{'p50 ms':>20}{'p95 ms':>20}{'p99 ms':>20}")
+    for result in candidate["results"]:
+        old = baseline_results.get(result["scenario"])
+        if old is None:
+            continue
+        columns = []
+        for key in ("requests_per_sec", "p50_ms", "p95_ms", "p99_ms"):
+            columns.append(f"{result[key] or 0:,.1f} ({change(old[key], result[key])})")
+        print(f"{result['scenario']:<24}" + "".join(f"{column:>20}" for column in columns))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load benchmarks for the dashboard and chat APIs.")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run scenarios against a server on a synthetic database and save the results as JSON.")
+    run_parser.add_argument("--scenarios", default="all", help=f"Comma-separated, from: {', '.join(SCENARIOS)} (default: all)")
+    run_parser.add_argument("--rows", type=int, default=100_000, help="Synthetic daily bars in the database (661 real TSLA bars for scale)")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data and the request streams")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per scenario")
+    run_parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each scenario")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    run_parser.add_argument("--port", type=int, default=8765, help="Port for the server under test")
+    run_parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    run_parser.add_argument("--llm-latency-ms", type=float, default=500, help="Fake Gemini latency (time to first token)")
+    run_parser.add_argument("--llm-jitter-ms", type=float, default=200, help="Random extra fake Gemini latency, up to this much")
+    run_parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of fake Gemini calls that fail with a 429")
+    run_parser.add_argument("--key-cooldown", type=float, help="Seconds a key sits out after a 429 (default: the server's GEMINI_RATE_LIMIT_COOLDOWN)")
+    run_parser.add_argument("--stream-chunks", type=int, default=8, help="Chunks per fake streamed answer")
+    run_parser.add_argument("--output", help="Results file (default: benchmarks/results/<time>-<commit>.json)")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved result files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+
+    cli_args = arg_parser.parse_args()
+    if cli_args.command == "compare":
+        _compare(cli_args)
+    else:
+        _run(cli_args)
@@ -0,0 +1,109 @@
+# benchmarks/synthetic.py
+
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+import models
+from models import Base, StockData, StockLevel
+
+# Bars are one per calendar day from here, so up to ~2.9 million fit before year 9999
+SYNTHETIC_FIRST_DAY = date(1900, 1, 1)
+MAX_SYNTHETIC_ROWS = (date(9999, 12, 31) - SYNTHETIC_FIRST_DAY).days + 1
+
+# Rows generated and inserted per transaction chunk; memory use is bounded by this, not by 'rows'
+SYNTHETIC_BATCH_ROWS = 100_000
+
+SYNTHETIC_BASE_PRICE = 250.0
+
+
+def synthetic_batch(rng: np.random.Generator, first_day: date, count: int, last_close: float) -> tuple[list[dict], list[dict], float]:
+    """
+    'count' random-walk daily bars starting at 'first_day' and continuing from 'last_close', shaped like the
+    TSLA data (prices in the hundreds, 1-5 support and resistance levels per day).
+    Returns (tesla_stock rows, tesla_stock_levels rows, close of the last bar).
+    """
+    # Mean-reverting log price (AR(1) around SYNTHETIC_BASE_PRICE), so millions of steps can't drift off to 0 or inf
+    log_prices = np.empty(count)
+    level = np.log(last_close / SYNTHETIC_BASE_PRICE)
+    for i, shock in enumerate(rng.normal(0, 0.03, count).tolist()):
+        level = 0.999 * level + shock
+        log_prices[i] = level
+    closes = SYNTHETIC_BASE_PRICE * np.exp(log_prices)
+    opens = np.concatenate([[last_close], closes[:-1]]) * (1 + rng.normal(0, 0.01, count))
+    highs = np.maximum(opens, closes) * (1 + rng.random(count) * 0.03)
+    lows = np.minimum(opens, closes) * (1 - rng.random(count) * 0.03)
+    volumes = np.round(rng.lognormal(4, 1.2, count), 4)
+    directions = np.where(closes >= opens, "LONG", "SHORT")
+    days = [first_day + timedelta(days=i) for i in range(count)]
+
+    # Level prices for all days at once; each day's levels are a contiguous run of 'owners'
+    levels = []
+    level_ranges = {}
+    for kind, anchor, sign in (("support", lows, -1), ("resistance", highs, 1)):
+        per_day = rng.integers(1, 6, count)
+        owners = np.repeat(np.arange(count), per_day)
+        prices = np.round(anchor[owners] * (1 + sign * rng.random(len(owners)) * 0.1), 2)
+        starts = np.concatenate([[0], np.cumsum(per_day)[:-1]])
+        level_ranges[kind] = (np.minimum.reduceat(prices, starts), np.maximum.reduceat(prices, starts))
+        positions = np.arange(len(owners)) - starts[owners]
+        levels.extend(
+            {"timestamp": days[owner], "kind": kind, "position": position, "price": price}
+            for owner, position, price in zip(owners.tolist(), positions.tolist(), prices.tolist())
+        )
+
+    bars = [
+        {
+            "timestamp": days[i], "direction": str(directions[i]),
+            "open_price": float(opens[i]), "high_price": float(highs[i]), "low_price": float(lows[i]),
+            "close_price": float(closes[i]), "volume": float(volumes[i]),
+            "support_lower": float(level_ranges["support"][0][i]), "support_upper": float(level_ranges["support"][1][i]),
+            "resistance_lower": float(level_ranges["resistance"][0][i]), "resistance_upper": float(level_ranges["resistance"][1][i]),
+        }
+        for i in range(count)
+    ]
+    return bars, levels, float(closes[-1])
+
+
+def build_synthetic_database(database_file: str, rows: int, seed: int = 0) -> dict:
+    """
+    Creates 'database_file' with 'rows' synthetic daily bars plus their levels, rollups and indicators,
+    ready to be served by main.py (DATABASE_FILE=<database_file>). Bars are written straight into the tables
+    rather than through a CSV, because pandas dates stop at 2262 and millions of daily bars need the full calendar.
+    """
+    if not 0 < rows <= MAX_SYNTHETIC_ROWS:
+        raise ValueError(f"rows must be between 1 and {MAX_SYNTHETIC_ROWS:,}.")
+    if os.path.exists(database_file):
+        raise FileExistsError(f"'{database_file}' already exists.")
+
+    start_time = time.perf_counter()
+    engine = models.create_db_engine(database_file)
+    try:
+        Base.metadata.create_all(engine)
+        rng = np.random.default_rng(seed)
+        last_close = SYNTHETIC_BASE_PRICE
+        with engine.begin() as conn:
+            for offset in range(0, rows, SYNTHETIC_BATCH_ROWS):
+                count = min(SYNTHETIC_BATCH_ROWS, rows - offset)
+                bars, levels, last_close = synthetic_batch(rng, SYNTHETIC_FIRST_DAY + timedelta(days=offset), count, last_close)
+                conn.execute(StockData.__table__.insert(), bars)
+                conn.execute(StockLevel.__table__.insert(), levels)
+            models.refresh_rollups(conn)
+            models.refresh_indicators(conn)
+            models.refresh_symbol_bars_view(conn)
+            models.bump_data_version(conn)
+            conn.exec_driver_sql("ANALYZE")
+        with engine.connect() as conn:
+            conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+    finally:
+        engine.dispose()
+    return {"database_file": database_file, "rows": rows, "seed": seed, "seconds": time.perf_counter() - start_time}
+
+
+def write_empty_csv(csv_file: str):
+    """A header-only CSV in models.CSV_FILE's format, so the server's startup sync finds nothing to add."""
+    with open(csv_file, "w", encoding="utf-8") as f:
+        f.write(",".join(models.EXPECTED_CSV_COLUMNS) + "\n")
@@ -1,93 +1,224 @@
 # chatbot_service/chatbot.py
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 import os
 import io
+import hashlib
+import threading
 from PIL import Image
 import time
-import random
+import asyncio
+from typing import Callable
+
+import metrics
+from chatbot_service.conversation import ConversationStore, DEFAULT_SESSION_ID
+from chatbot_service.key_pool import APIKeyPool, KeyState
+from chatbot_service.response_cache import LLMResponseCache
+
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """True if the exception looks like a rate limit / quota error from the Gemini API."""
+    error_message = str(error).lower()
+    return "rate limit" in error_message or "quota" in error_message or "429" in error_message or "resource exhausted" in error_message
+
+
+def _observe_llm_call(call_type: str, key: KeyState, start_time: float, error: Exception | None = None):
+    """Records one attempt on one key as an "llm_call" stage; failed attempts also count as retries."""
+    if error is None:
+        outcome = "ok"
+    elif _is_rate_limit_error(error):
+        outcome = "rate_limited"
+    elif isinstance(error, TimeoutError):
+        outcome = "timeout"
+    else:
+        outcome = "error"
+    metrics.observe_stage("llm_call", time.perf_counter() - start_time, call_type=call_type, key=key.index, outcome=outcome)
+    if error is not None:
+        metrics.LLM_FAILED_ATTEMPTS.inc(call_type=call_type, key=key.index, outcome=outcome)
+
+
+def _response_token_count(response) -> int:
+    """Total tokens billed for a response, or 0 if the SDK didn't report usage."""
+    usage = getattr(response, "usage_metadata", None)
+    return (getattr(usage, "total_token_count", 0) or 0) if usage is not None else 0
+
+
+class KeyModels:
+    """The text and vision models for one API key, bound to that key's own persistent clients."""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.model_text = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        self.model_vision = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        # Give each model a client for this key instead of the process-wide one from genai.configure()
+        client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        self.model_text._client = client
+        self.model_vision._client = client
+
+    def ensure_async_client(self):
+        """The async (grpc.aio) client has to be created inside the running event loop, so it is built on first use."""
+        if self.model_text._async_client is None:
+            async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": self.api_key})
+            self.model_text._async_client = async_client
+            self.model_vision._async_client = async_client
+
 
 class GeminiChatbot:
-    def __init__(self, api_keys: list[str]): # Accept a list of API keys
+    """
+    Gemini text/vision client spread over several API keys.
+
+    Each call is served by the least-loaded healthy key from an APIKeyPool; a key that fails
+    (e.g. 429 / resource exhausted) is put into cooldown and the call moves straight on to the next key.
+    Models and clients are built once per key. Chat history is kept per session in a ConversationStore
+    (bounded by a token budget, older turns summarized) rather than in a per-key chat session,
+    so it carries over whichever key answers the next turn.
+    'model_factory' builds the models for a key; pass FakeGeminiBackend.models_for_key (chatbot_service/fake_gemini.py)
+    to run without the Gemini API.
+    """
+
+    def __init__(self, api_keys: list[str], key_pool: APIKeyPool | None = None, max_wait_for_key: float = 30.0,
+                 model_factory: Callable[[str], KeyModels] = KeyModels,
+                 conversations: ConversationStore | None = None): # Accept a list of API keys
         if not api_keys:
             raise ValueError("No API keys provided for GeminiChatbot.")
         self.api_keys = api_keys
-        self.current_key_index = 0
+        self.key_pool = key_pool or APIKeyPool(api_keys)
         self.max_retries_per_call = len(self.api_keys) # Try all keys if one fails
-        self.model_text = None
-        self.model_vision = None
-        self.chat = None
-        self._configure_gemini() # Initial configuration with the first key
+        self.max_wait_for_key = max_wait_for_key # Longest we wait for a key to come out of cooldown
+        self.conversations = conversations or ConversationStore() # Per-session history, as protos.Content turns
+        self.model_factory = model_factory
+
+        self._key_models: dict[int, KeyModels] = {}
+        self._models_lock = threading.Lock()
 
         print("GeminiChatbot initialized successfully with multiple API keys.")
 
-    def _configure_gemini(self):
-        """Configures genai with the current API key."""
-        if not self.api_keys:
-            raise ValueError("No API keys available to configure GeminiChatbot.")
+    def _models_for_key(self, key: KeyState) -> KeyModels:
+        with self._models_lock:
+            models = self._key_models.get(key.index)
+            if models is None:
+                models = self.model_factory(key.api_key)
+                self._key_models[key.index] = models
+                print(f"Gemini models created for key index: {key.index}")
+            return models
 
-        current_api_key = self.api_keys[self.current_key_index]
-        genai.configure(api_key=current_api_key)
-        
-        # Re-initialize models and chat history when switching keys
-        # This is important to ensure the new configuration takes effect.
-        self.model_text = genai.GenerativeModel('gemini-1.5-flash')
-        self.model_vision = genai.GenerativeModel('gemini-1.5-flash')
-        self.chat = self.model_text.start_chat(history=[])
-        print(f"Gemini configured with key from index: {self.current_key_index}")
+    def _start_chat(self, models: KeyModels, session_id: str, history: list | None = None) -> tuple:
+        """
+        A chat session on this key's model seeded with the session's history, and the length of that history.
+        Async callers pass the 'history' they already read in a worker thread.
+        """
+        if history is None:
+            history = self.conversations.history(session_id)
+        return models.model_text.start_chat(history=history), len(history)
 
+    def _commit_chat_turn(self, chat, history_length: int, session_id: str) -> bool:
+        """
+        Stores the turn a finished chat session added on top of the 'history_length' turns it started with.
+        Returns True if older turns should now be summarized.
+        """
+        return self.conversations.append(session_id, chat.history[history_length:])
+
+    def _summarize(self, session_id: str):
+        """Folds the session's turns that left the history window into its rolling summary (blocking)."""
+        while (claim := self.conversations.take_pending(session_id)) is not None:
+            summary, turns = claim
+            try:
+                with metrics.stage("chat_summary"):
+                    new_summary = self.generate_text(self.conversations.summary_prompt(summary, turns))
+            except Exception as e:
+                print(f"Summarizing older chat turns failed, dropping them instead: {e}")
+                new_summary = None
+            self.conversations.apply_summary(session_id, new_summary, len(turns))
+            if new_summary is None:
+                break
+
+    def _wait_for_key(self, tried: set) -> float | None:
+        """
+        How long to wait before a key could be available for this call, or None to give up.
+        Only the first attempt waits: once a call has failed on some key, cooling keys aren't worth waiting for.
+        """
+        if tried:
+            return None
+        wait = self.key_pool.seconds_until_available()
+        return wait if wait <= self.max_wait_for_key else None
 
-    def _rotate_api_key(self):
-        """Rotates to the next API key in the list."""
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        print(f"Rotating to next API key. New index: {self.current_key_index}")
-        self._configure_gemini() # Re-configure with the new key
+    def _acquire_key(self, tried: set) -> KeyState | None:
+        while True:
+            key = self.key_pool.acquire(exclude=tried)
+            if key is not None:
+                return key
+            wait = self._wait_for_key(tried)
+            if wait is None:
+                return None
+            print(f"All Gemini API keys are cooling down, waiting {wait:.1f}s.")
+            with metrics.stage("llm_key_wait"):
+                time.sleep(max(wait, 0.05))
 
-    def _make_gemini_call(self, call_type: str, *args, **kwargs):
+    def _make_gemini_call(self, call_type: str, *args, session_id: str = DEFAULT_SESSION_ID, **kwargs):
         """
-        Generic method to handle Gemini API calls with key rotation and retries.
+        Generic method to handle Gemini API calls on the least-loaded healthy key, moving on to the next key on failure.
+        'session_id' picks the conversation a "text_query" continues.
         """
+        tried = set()
+        last_error = None
         for attempt in range(self.max_retries_per_call):
+            key = self._acquire_key(tried)
+            if key is None:
+                break
+            tried.add(key.index)
+            models = self._models_for_key(key)
+            start_time = time.perf_counter()
             try:
                 if call_type == "text_query":
-                    # Use the configured chat instance
-                    response = self.chat.send_message(*args, **kwargs)
+                    # Chat turn on this key's model, carrying the session's history
+                    chat, history_length = self._start_chat(models, session_id)
+                    response = chat.send_message(*args, **kwargs)
+                    if self._commit_chat_turn(chat, history_length, session_id):
+                        self._summarize(session_id)
+                elif call_type == "generate_text":
+                    # One-off prompt without chat history (e.g. Text-to-SQL)
+                    response = models.model_text.generate_content(*args, **kwargs)
                 elif call_type == "vision_analysis":
-                    # Use the configured vision model
-                    response = self.model_vision.generate_content(*args, **kwargs)
+                    response = models.model_vision.generate_content(*args, **kwargs)
                 else:
                     raise ValueError(f"Unknown call_type: {call_type}")
-                return response # If successful, return response
 
+            except ValueError:
+                self.key_pool.release(key)
+                raise # Programming error (bad call_type), retrying won't help
             except Exception as e:
-                error_message = str(e).lower()
-                print(f"Attempt {attempt + 1} with API key index {self.current_key_index} failed: {e}")
-
-                # Check for rate limit specific errors or common API errors
-                if "rate limit" in error_message or "quota" in error_message or "429" in error_message or "resource exhausted" in error_message:
-                    print("Rate limit likely hit. Rotating API key...")
-                    self._rotate_api_key()
-                    # A small delay before retrying with the new key
-                    time.sleep(1 + random.random() * 0.5) # Add some randomness
-                else:
-                    # For other types of errors, still rotate to see if it's key-related,
-                    # but maybe raise immediately or after fewer retries.
-                    print("Non-rate limit error encountered. Rotating API key for next attempt.")
-                    self._rotate_api_key()
-                    time.sleep(0.5 + random.random() * 0.2) # Shorter delay for non-rate limit errors
-                    # If this is the last attempt and it's not a rate limit, re-raise the error.
-                    if attempt == self.max_retries_per_call - 1:
-                        raise # Re-raise the original error if all keys fail
+                print(f"Attempt {attempt + 1} with API key index {key.index} failed: {e}")
+                self.key_pool.release(key, error=e, rate_limited=_is_rate_limit_error(e))
+                _observe_llm_call(call_type, key, start_time, e)
+                last_error = e
+                continue
+
+            _observe_llm_call(call_type, key, start_time)
+            self.key_pool.release(key, tokens=_response_token_count(response))
+            return response # If successful, return response
 
+        if last_error is not None:
+            raise last_error
         raise Exception("All API keys failed after multiple attempts.")
 
 
-    def send_text_query(self, user_query: str) -> str:
+    def generate_text(self, prompt: str) -> str:
         """
-        Sends a text query to the Gemini text model, utilizing chat history,
-        with API key rotation and retries.
+        Sends a one-off prompt (no chat history) to the text model, using the key pool.
+        Raises if every key fails, so callers can decide how to degrade.
+        """
+        response = self._make_gemini_call("generate_text", prompt)
+        return response.text
+
+    def send_text_query(self, user_query: str, session_id: str = DEFAULT_SESSION_ID) -> str:
+        """
+        Sends a text query to the Gemini text model, utilizing the session's chat history,
+        on whichever pooled key is healthy.
         """
         try:
-            response = self._make_gemini_call("text_query", user_query)
+            response = self._make_gemini_call("text_query", user_query, session_id=session_id)
             return response.text
         except Exception as e:
             print(f"Error getting text response from Gemini after all retries: {e}")
@@ -95,7 +226,7 @@ class GeminiChatbot:
 
     def analyze_chart_image(self, image: Image.Image, user_query: str) -> str:
         """
-        Analyzes a chart image using the Gemini Vision model, with API key rotation and retries.
+        Analyzes a chart image using the Gemini Vision model, using the key pool.
         """
         if not image:
             raise ValueError("No PIL Image object provided for analysis.")
@@ -113,4 +244,328 @@ class GeminiChatbot:
             print(f"ERROR in analyze_chart_image (GeminiChatbot) after all retries: {e}")
             import traceback
             traceback.print_exc()
-            raise ValueError(f"Failed to analyze image with AI: {e}")
\ No newline at end of file
+            raise ValueError(f"Failed to analyze image with AI: {e}")
+
+
+class AsyncGeminiChatbot(GeminiChatbot):
+    """
+    Awaitable variant of GeminiChatbot for use inside the FastAPI event loop.
+
+    Uses the SDK's *_async calls so a slow Gemini response never blocks other requests,
+    caps concurrent calls per API key with a semaphore, and gives up on a single attempt
+    after 'request_timeout' seconds. A failed attempt moves straight on to the next healthy key;
+    the only sleep is when every key is cooling down.
+
+    With a 'response_cache', text calls that pass a 'data_version' are deduplicated while in flight
+    and their answers reused until the TTL expires or the data version changes.
+    """
+
+    def __init__(self, api_keys: list[str], max_concurrent_per_key: int = 4, request_timeout: float = 60.0,
+                 key_pool: APIKeyPool | None = None, max_wait_for_key: float = 30.0,
+                 response_cache: LLMResponseCache | None = None, model_factory: Callable[[str], KeyModels] = KeyModels,
+                 conversations: ConversationStore | None = None):
+        super().__init__(api_keys, key_pool=key_pool, max_wait_for_key=max_wait_for_key, model_factory=model_factory,
+                         conversations=conversations)
+        self.request_timeout = request_timeout
+        self.response_cache = response_cache
+        self._key_semaphores = [asyncio.Semaphore(max_concurrent_per_key) for _ in self.api_keys]
+        self._summary_tasks = set() # Keeps background summaries referenced until they finish
+
+    @staticmethod
+    def _history_fingerprint(history: list) -> str:
+        """Hash of a chat history, so cached chat answers are only reused in the same conversational context."""
+        digest = hashlib.sha256()
+        for content in history:
+            digest.update(type(content).serialize(content))
+        return digest.hexdigest()
+
+    def _response_cache_key(self, call_type: str, prompt: str, data_version: int | None,
+                            history: list | None = None) -> str | None:
+        if self.response_cache is None or data_version is None:
+            return None
+        context = self._history_fingerprint(history or []) if call_type == "text_query" else ""
+        return LLMResponseCache.make_key(GEMINI_MODEL_NAME, call_type, prompt, data_version, context)
+
+    async def _read_history(self, session_id: str) -> list:
+        """The session's history, read in a worker thread (shared state backends do blocking I/O)."""
+        return await asyncio.to_thread(self.conversations.history, session_id)
+
+    async def _call_text_async(self, call_type: str, prompt: str, session_id: str = DEFAULT_SESSION_ID,
+                               history: list | None = None) -> str:
+        response = await self._make_gemini_call_async(call_type, prompt, session_id=session_id, history=history)
+        return response.text
+
+    async def _commit_chat_turn_async(self, chat, history_length: int, session_id: str):
+        """Async version of _commit_chat_turn that also starts the summary when one is due."""
+        if await asyncio.to_thread(self._commit_chat_turn, chat, history_length, session_id):
+            self._schedule_summary(session_id)
+
+    async def _remember_exchange(self, session_id: str, user_query: str, answer: str):
+        """
+        Adds a question and answer to the session's history when the answer didn't come from this session's own chat
+        call (a response cache hit, or an identical call another session had in flight), so the next turn has it too.
+        """
+        turns = [glm.Content(role="user", parts=[glm.Part(text=user_query)]),
+                 glm.Content(role="model", parts=[glm.Part(text=answer)])]
+        if await asyncio.to_thread(self.conversations.append, session_id, turns):
+            self._schedule_summary(session_id)
+
+    def _schedule_summary(self, session_id: str):
+        """Summarizes older turns in the background, so the answer that pushed them out isn't held up by it."""
+        task = asyncio.create_task(self._summarize_async(session_id))
+        self._summary_tasks.add(task)
+        task.add_done_callback(self._summary_tasks.discard)
+
+    async def _summarize_async(self, session_id: str):
+        """Async version of _summarize."""
+        while (claim := await asyncio.to_thread(self.conversations.take_pending, session_id)) is not None:
+            summary, turns = claim
+            try:
+                with metrics.stage("chat_summary"):
+                    new_summary = await self._call_text_async("generate_text", self.conversations.summary_prompt(summary, turns))
+            except Exception as e:
+                print(f"Summarizing older chat turns failed, dropping them instead: {e}")
+                new_summary = None
+            await asyncio.to_thread(self.conversations.apply_summary, session_id, new_summary, len(turns))
+            if new_summary is None:
+                break
+
+    async def _acquire_key_async(self, tried: set) -> KeyState | None:
+        while True:
+            key = self.key_pool.acquire(exclude=tried)
+            if key is not None:
+                return key
+            wait = self._wait_for_key(tried)
+            if wait is None:
+                return None
+            print(f"All Gemini API keys are cooling down, waiting {wait:.1f}s.")
+            with metrics.stage("llm_key_wait"):
+                await asyncio.sleep(max(wait, 0.05))
+
+    def _release_failed_key(self, key: KeyState, attempt: int, error: Exception) -> Exception:
+        if isinstance(error, asyncio.TimeoutError):
+            error = TimeoutError(f"Gemini call timed out after {self.request_timeout}s")
+        print(f"Attempt {attempt + 1} with API key index {key.index} failed: {error}")
+        self.key_pool.release(key, error=error, rate_limited=_is_rate_limit_error(error))
+        return error
+
+    async def _make_gemini_call_async(self, call_type: str, *args, session_id: str = DEFAULT_SESSION_ID,
+                                      history: list | None = None, **kwargs):
+        """
+        Async counterpart of _make_gemini_call: same key selection and failover, but non-blocking.
+        'history' is the session's history if the caller already read it (see _read_history).
+        """
+        if call_type == "text_query" and history is None:
+            history = await self._read_history(session_id)
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_retries_per_call):
+            key = await self._acquire_key_async(tried)
+            if key is None:
+                break
+            tried.add(key.index)
+            models = self._models_for_key(key)
+            start_time = time.perf_counter()
+            try:
+                async with self._key_semaphores[key.index]:
+                    models.ensure_async_client()
+                    chat = None
+                    if call_type == "text_query":
+                        chat, history_length = self._start_chat(models, session_id, history)
+                        call = chat.send_message_async(*args, **kwargs)
+                    elif call_type == "generate_text":
+                        call = models.model_text.generate_content_async(*args, **kwargs)
+                    elif call_type == "vision_analysis":
+                        call = models.model_vision.generate_content_async(*args, **kwargs)
+                    else:
+                        raise ValueError(f"Unknown call_type: {call_type}")
+                    response = await asyncio.wait_for(call, timeout=self.request_timeout)
+
+            except ValueError:
+                self.key_pool.release(key)
+                raise # Programming error (bad call_type), retrying won't help
+            except Exception as e:
+                last_error = self._release_failed_key(key, attempt, e)
+                _observe_llm_call(call_type, key, start_time, last_error)
+                continue
+
+            _observe_llm_call(call_type, key, start_time)
+            self.key_pool.release(key, tokens=_response_token_count(response))
+            if chat is not None:
+                await self._commit_chat_turn_async(chat, history_length, session_id)
+            return response
+
+        if last_error is not None:
+            raise last_error
+        raise Exception("All API keys failed after multiple attempts.")
+
+    async def generate_text_async(self, prompt: str, data_version: int | None = None) -> str:
+        """Async version of generate_text. Raises if every key fails."""
+        cache_key = self._response_cache_key("generate_text", prompt, data_version)
+        if cache_key is None:
+            return await self._call_text_async("generate_text", prompt)
+        return await self.response_cache.get_or_call(cache_key, lambda: self._call_text_async("generate_text", prompt))
+
+    async def send_text_query_async(self, user_query: str, data_version: int | None = None,
+                                    session_id: str = DEFAULT_SESSION_ID) -> str:
+        """Async version of send_text_query."""
+        try:
+            history = await self._read_history(session_id) # Read once, for the cache key and the chat
+            cache_key = self._response_cache_key("text_query", user_query, data_version, history)
+            if cache_key is None:
+                return await self._call_text_async("text_query", user_query, session_id, history)
+
+            own_call = False
+
+            async def call():
+                nonlocal own_call
+                own_call = True # The chat call commits the turn to this session's history itself
+                return await self._call_text_async("text_query", user_query, session_id, history)
+
+            answer = await self.response_cache.get_or_call(cache_key, call)
+            if not own_call:
+                await self._remember_exchange(session_id, user_query, answer)
+            return answer
+        except Exception as e:
+            print(f"Error getting text response from Gemini after all retries: {e}")
+            return f"Sorry, I couldn't process your text request. Error: {e}"
+
+    async def analyze_chart_image_async(self, image: Image.Image, user_query: str) -> str:
+        """Async version of analyze_chart_image."""
+        if not image:
+            raise ValueError("No PIL Image object provided for analysis.")
+
+        try:
+            contents = [user_query, image]
+            response = await self._make_gemini_call_async("vision_analysis", contents)
+
+            if response and response.text:
+                return response.text
+            else:
+                return "AI analysis could not generate a response. Please try again or with a clearer chart."
+
+        except Exception as e:
+            print(f"ERROR in analyze_chart_image_async (AsyncGeminiChatbot) after all retries: {e}")
+            raise ValueError(f"Failed to analyze image with AI: {e}")
+
+    # --- Streaming ---
+    async def _stream_gemini_call_async(self, call_type: str, *args, session_id: str = DEFAULT_SESSION_ID,
+                                        history: list | None = None, **kwargs):
+        """
+        Streaming counterpart of _make_gemini_call_async: yields text chunks as Gemini produces them.
+
+        Failover to another key only applies until the first chunk arrives; after that the caller has
+        already forwarded partial text, so a mid-stream failure is raised instead of silently restarting.
+        Each chunk must arrive within 'request_timeout' seconds.
+        If the consumer stops early (e.g. the client disconnected), closing this generator cancels
+        the underlying Gemini stream, and the unfinished turn is never added to the chat history.
+        """
+        if call_type == "text_query" and history is None:
+            history = await self._read_history(session_id)
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_retries_per_call):
+            key = await self._acquire_key_async(tried)
+            if key is None:
+                break
+            tried.add(key.index)
+            models = self._models_for_key(key)
+            start_time = time.perf_counter()
+            try:
+                async with self._key_semaphores[key.index]:
+                    models.ensure_async_client()
+                    chat = None
+                    if call_type == "text_query":
+                        chat, history_length = self._start_chat(models, session_id, history)
+                        call = chat.send_message_async(*args, stream=True, **kwargs)
+                    elif call_type == "generate_text":
+                        call = models.model_text.generate_content_async(*args, stream=True, **kwargs)
+                    elif call_type == "vision_analysis":
+                        call = models.model_vision.generate_content_async(*args, stream=True, **kwargs)
+                    else:
+                        raise ValueError(f"Unknown call_type: {call_type}")
+                    # Resolves once the first chunk is in, so this covers time-to-first-token
+                    response = await asyncio.wait_for(call, timeout=self.request_timeout)
+                    chunks = aiter(response)
+                    first_chunk = await asyncio.wait_for(anext(chunks), timeout=self.request_timeout)
+
+            except ValueError:
+                self.key_pool.release(key)
+                raise
+            except Exception as e:
+                last_error = self._release_failed_key(key, attempt, e)
+                _observe_llm_call(call_type, key, start_time, last_error)
+                continue
+
+            # For streams "llm_call" is the time to the first chunk; "llm_stream" below covers the rest
+            _observe_llm_call(call_type, key, start_time)
+            stream_start_time = time.perf_counter()
+
+            # Past this point we're committed to this stream. The semaphore is released above:
+            # it limits concurrent request starts per key, not how long a client takes to read.
+            # The key itself stays reserved in the pool until the stream ends.
+            completed = False
+            stream_error = None
+            try:
+                if first_chunk.parts:
+                    yield first_chunk.text
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(chunks), timeout=self.request_timeout)
+                    except StopAsyncIteration:
+                        break
+                    if chunk.parts:
+                        yield chunk.text
+                completed = True
+            except Exception as e:
+                stream_error = e
+                raise
+            finally:
+                stream_outcome = "ok" if completed else ("error" if stream_error is not None else "cancelled")
+                metrics.observe_stage("llm_stream", time.perf_counter() - stream_start_time, call_type=call_type, key=key.index, outcome=stream_outcome)
+                if completed:
+                    self.key_pool.release(key, tokens=_response_token_count(response))
+                    if chat is not None:
+                        await self._commit_chat_turn_async(chat, history_length, session_id)
+                else:
+                    await chunks.aclose()
+                    if stream_error is not None:
+                        self.key_pool.release(key, error=stream_error, rate_limited=_is_rate_limit_error(stream_error))
+                    else:
+                        self.key_pool.release(key) # Cancelled by the consumer, the key did nothing wrong
+            return
+
+        if last_error is not None:
+            raise last_error
+        raise Exception("All API keys failed after multiple attempts.")
+
+    async def stream_text_query_async(self, user_query: str, data_version: int | None = None,
+                                      session_id: str = DEFAULT_SESSION_ID):
+        """Streaming version of send_text_query_async. Yields text chunks; raises if no key can start a stream."""
+        history = await self._read_history(session_id) # Read once, for the cache key and the chat
+        cache_key = self._response_cache_key("text_query", user_query, data_version, history)
+        if cache_key is None:
+            async for text in self._stream_gemini_call_async("text_query", user_query, session_id=session_id, history=history):
+                yield text
+            return
+
+        own_call = False
+
+        def stream():
+            nonlocal own_call
+            own_call = True # The chat stream commits the turn to this session's history itself
+            return self._stream_gemini_call_async("text_query", user_query, session_id=session_id, history=history)
+
+        parts = []
+        async for text in self.response_cache.get_or_stream(cache_key, stream):
+            parts.append(text)
+            yield text
+        if not own_call:
+            await self._remember_exchange(session_id, user_query, "".join(parts))
+
+    async def stream_chart_analysis_async(self, image: Image.Image, user_query: str):
+        """Streaming version of analyze_chart_image_async. Yields text chunks."""
+        if not image:
+            raise ValueError("No PIL Image object provided for analysis.")
+        async for text in self._stream_gemini_call_async("vision_analysis", [user_query, image]):
+            yield text
@@ -0,0 +1,260 @@
+# chatbot_service/conversation.py
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+import google.ai.generativelanguage as glm
+
+from shared_state import StateBackend
+
+# Session used by callers that don't pass one (e.g. scripts using GeminiChatbot directly)
+DEFAULT_SESSION_ID = "default"
+
+# When the window goes over its budget, the oldest turns are moved out until it is back under this share of it,
+# so summarization runs once every few turns instead of on every turn
+SUMMARY_LOW_WATERMARK = 0.5
+
+# A summary claim older than this is assumed abandoned (e.g. its worker was restarted) and can be taken over
+SUMMARY_CLAIM_SECONDS = 120.0
+
+SUMMARY_PROMPT_TEMPLATE = """
+Below is a summary of the earlier part of a conversation between a user and a TSLA stock data assistant,
+followed by more turns of that conversation. Write an updated summary in at most {max_words} words.
+Keep the facts, numbers, dates and open questions the assistant may need later; drop pleasantries.
+
+Summary so far:
+{summary}
+
+More turns:
+{turns}
+
+Updated summary:
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English), good enough for budgeting without an API call."""
+    return len(text) // 4 + 1
+
+
+def content_text(content: glm.Content) -> str:
+    return "".join(part.text for part in content.parts)
+
+
+@dataclass
+class ConversationMemory:
+    """
+    One session's chat state: a rolling summary of older turns, then the most recent turns verbatim.
+    Turns are kept as plain [role, text] pairs, so a session can be serialized to a shared state backend.
+    """
+    summary: str = ""
+    pending: list = field(default_factory=list) # [role, text] moved out of the window, waiting to be summarized
+    window: list = field(default_factory=list) # [role, text, estimated tokens], oldest first
+    window_tokens: int = 0
+    summarizing_since: float = 0.0 # When a summary of 'pending' was claimed, 0 if none is being written
+    last_used: float = field(default_factory=time.time)
+
+
+class ConversationStore:
+    """
+    Per-session conversation history with a token budget, replacing the single unbounded history shared by all users.
+
+    Each session keeps its latest turns verbatim up to 'max_history_tokens'. Older turns are moved out in whole
+    user/model pairs and folded into a rolling summary of at most 'summary_max_words' words by whoever owns the
+    model (see GeminiChatbot._summarize_async); until that lands they are still sent as they are. So the history
+    sent with a turn stays around the budget however long a conversation runs.
+
+    Sessions idle for 'idle_seconds' are dropped, and at most 'max_sessions' are kept (least recently used go first).
+    The history lives here rather than in a per-key chat session, so it carries over whichever key answers next.
+
+    With a 'backend' (shared_state.py) sessions are stored there as JSON instead of in this process, so every
+    uvicorn worker sees the same conversations; idle expiry is then the backend's TTL and 'max_sessions' doesn't apply.
+    """
+
+    def __init__(self, max_history_tokens: int = 2000, summary_max_words: int = 150, idle_seconds: float = 30 * 60,
+                 max_sessions: int = 10_000, backend: StateBackend | None = None):
+        self.max_history_tokens = max_history_tokens
+        self.summary_max_words = summary_max_words
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.backend = backend
+
+        self._sessions: OrderedDict[str, ConversationMemory] = OrderedDict() # least recently used first
+        self._lock = threading.Lock()
+
+        self.evicted = 0
+        self.summaries = 0
+        self.summary_failures = 0
+
+    # --- Session access ---
+    def _modify(self, session_id: str, change: Callable[[ConversationMemory], object], create: bool = True):
+        """
+        Runs change(memory) on the session's memory as one atomic step and returns its result.
+        Without 'create', a session that doesn't exist (or has expired) is left alone and change() isn't called.
+        """
+        if self.backend is None:
+            with self._lock:
+                now = time.time()
+                self._evict(now)
+                memory = self._sessions.get(session_id)
+                if memory is None:
+                    if not create:
+                        return None
+                    memory = self._sessions[session_id] = ConversationMemory()
+                memory.last_used = now
+                self._sessions.move_to_end(session_id)
+                return change(memory)
+
+        result = None
+
+        def apply(raw: bytes | None) -> bytes | None:
+            nonlocal result
+            if raw is None and not create:
+                return None
+            memory = ConversationMemory(**json.loads(raw)) if raw is not None else ConversationMemory()
+            memory.last_used = time.time()
+            result = change(memory)
+            return json.dumps(asdict(memory), separators=(",", ":")).encode("utf-8")
+
+        self.backend.update(f"conversation:{session_id}", apply, ttl=self.idle_seconds)
+        return result
+
+    def _read(self, session_id: str, read: Callable[[ConversationMemory], object]):
+        """
+        Runs read(memory) on the session's memory without writing it back, and keeps the session alive.
+        Returns None for a session that doesn't exist (or has expired); it isn't created.
+        """
+        if self.backend is None:
+            with self._lock:
+                now = time.time()
+                self._evict(now)
+                memory = self._sessions.get(session_id)
+                if memory is None:
+                    return None
+                memory.last_used = now
+                self._sessions.move_to_end(session_id)
+                return read(memory)
+
+        key = f"conversation:{session_id}"
+        raw = self.backend.get(key)
+        if raw is None:
+            return None
+        self.backend.touch(key, self.idle_seconds)
+        return read(ConversationMemory(**json.loads(raw)))
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, memory = next(iter(self._sessions.items()))
+            if now - memory.last_used <= self.idle_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            self.evicted += 1
+
+    # --- History ---
+    def history(self, session_id: str) -> list:
+        """The turns to start this session's next chat with: the summary (as one exchange), pending turns, the window."""
+        def read(memory: ConversationMemory) -> list:
+            history = []
+            if memory.summary:
+                history.append(glm.Content(role="user", parts=[glm.Part(text=f"Summary of our conversation so far: {memory.summary}")]))
+                history.append(glm.Content(role="model", parts=[glm.Part(text="Understood, I'll keep that in mind.")]))
+            for role, text in memory.pending:
+                history.append(glm.Content(role=role, parts=[glm.Part(text=text)]))
+            for role, text, _ in memory.window:
+                history.append(glm.Content(role=role, parts=[glm.Part(text=text)]))
+            return history
+
+        return self._read(session_id, read) or []
+
+    def append(self, session_id: str, turns: list) -> bool:
+        """
+        Adds a finished exchange (the user turn and the model's answer, as glm.Content). Returns True if older turns
+        were moved out of the window and the caller should start summarizing them (see take_pending).
+        """
+        new_turns = []
+        for content in turns:
+            text = content_text(content)
+            new_turns.append([content.role, text, estimate_tokens(text)])
+
+        def add(memory: ConversationMemory) -> bool:
+            memory.window.extend(new_turns)
+            memory.window_tokens += sum(tokens for _, _, tokens in new_turns)
+            if memory.window_tokens > self.max_history_tokens:
+                # Keep at least the latest exchange, however long it was
+                while len(memory.window) > 2 and memory.window_tokens > self.max_history_tokens * SUMMARY_LOW_WATERMARK:
+                    for role, text, tokens in memory.window[:2]:
+                        memory.pending.append([role, text])
+                        memory.window_tokens -= tokens
+                    del memory.window[:2]
+            return bool(memory.pending) and not self._summary_claimed(memory)
+
+        return self._modify(session_id, add)
+
+    # --- Summaries ---
+    @staticmethod
+    def _summary_claimed(memory: ConversationMemory) -> bool:
+        return memory.summarizing_since > 0 and time.time() - memory.summarizing_since < SUMMARY_CLAIM_SECONDS
+
+    def take_pending(self, session_id: str) -> tuple[str, list] | None:
+        """
+        Claims the session's pending turns for summarization: returns (current summary, [role, text] turns), or None
+        if there is nothing to do or a summary is already being written. Finish with apply_summary.
+        """
+        def claim(memory: ConversationMemory):
+            if self._summary_claimed(memory) or not memory.pending:
+                return None
+            memory.summarizing_since = time.time()
+            return memory.summary, list(memory.pending)
+
+        return self._modify(session_id, claim, create=False)
+
+    def apply_summary(self, session_id: str, summary: str | None, consumed: int):
+        """
+        Replaces the summary with one that covers the first 'consumed' pending turns, and drops those turns.
+        With summary=None (summarization failed) the turns are dropped without a summary, so the history stays bounded.
+        """
+        def apply(memory: ConversationMemory):
+            memory.summarizing_since = 0.0
+            del memory.pending[:consumed]
+            if summary is not None:
+                # Hard cap in case the model ignored the word limit
+                memory.summary = " ".join(summary.split()[:self.summary_max_words * 2])
+
+        self._modify(session_id, apply, create=False)
+        with self._lock:
+            if summary is None:
+                self.summary_failures += 1
+            else:
+                self.summaries += 1
+
+    def summary_prompt(self, summary: str, turns: list) -> str:
+        lines = [f"{'User' if role == 'user' else 'Assistant'}: {text}" for role, text in turns]
+        return SUMMARY_PROMPT_TEMPLATE.format(max_words=self.summary_max_words, summary=summary or "(none yet)",
+                                              turns="\n".join(lines))
+
+    def clear(self, session_id: str):
+        if self.backend is not None:
+            self.backend.delete(f"conversation:{session_id}")
+            return
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "backend": self.backend.name if self.backend is not None else "process",
+                "evicted": self.evicted,
+                "summaries": self.summaries,
+                "summary_failures": self.summary_failures,
+                "max_history_tokens": self.max_history_tokens,
+            }
+            if self.backend is None:
+                sessions = list(self._sessions.values())
+                stats["sessions"] = len(sessions)
+                stats["avg_window_tokens"] = (sum(memory.window_tokens for memory in sessions) / len(sessions)) if sessions else 0.0
+                stats["pending_turns"] = sum(len(memory.pending) for memory in sessions)
+            return stats
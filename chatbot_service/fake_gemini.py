@@ -0,0 +1,195 @@
+# chatbot_service/fake_gemini.py
+
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import google.ai.generativelanguage as glm
+from google.api_core.exceptions import ResourceExhausted
+
+# Valid SQL handed back for Text-to-SQL prompts, so /api/chat exercises the sandbox, execution and formatting
+# exactly as with real answers. Picked by a hash of the question, so the same question always gets the same SQL.
+FAKE_SQL_ANSWERS = [
+    "SELECT MAX(close_price) FROM tesla_stock",
+    "SELECT AVG(volume) FROM tesla_stock WHERE direction = 'LONG'",
+    "SELECT timestamp, close_price, volume FROM tesla_stock ORDER BY volume DESC LIMIT 5",
+    "SELECT timestamp, open_price, close_price FROM tesla_stock ORDER BY timestamp DESC LIMIT 10",
+    "SELECT period_start, close_price, avg_volume FROM tesla_stock_yearly ORDER BY period_start",
+    "SELECT COUNT(*) FROM tesla_stock WHERE close_price > open_price",
+]
+
+# Questions starting like this get "N/A" from Text-to-SQL, so they take the conversational (chat) path
+FAKE_NON_SQL_PREFIXES = ("explain", "why")
+
+FAKE_ANALYSIS_WORDS = (
+    "the chart shows a steady uptrend with higher lows while volume fades into resistance near the recent "
+    "swing high a break above it would confirm the trend whereas a close below support suggests a pullback"
+).split()
+
+_USER_QUERY_RE = re.compile(r'User query: "(.*)"')
+
+
+def _prompt_text(contents) -> str:
+    """The text parts of a generate_content/send_message argument (a string or a list of strings and images)."""
+    if isinstance(contents, str):
+        return contents
+    return " ".join(part for part in contents if isinstance(part, str))
+
+
+class FakeResponse:
+    """Quacks like a (non-streaming) GenerateContentResponse: .text, .parts and .usage_metadata."""
+
+    def __init__(self, text: str, prompt_tokens: int):
+        self.text = text
+        self.parts = [SimpleNamespace(text=text)] if text else []
+        self.usage_metadata = SimpleNamespace(total_token_count=prompt_tokens + len(text.split()))
+
+
+class FakeStreamResponse:
+    """Quacks like the async streaming response: iterate it for chunks; 'on_complete' runs after the last one."""
+
+    def __init__(self, backend: "FakeGeminiBackend", text: str, prompt_tokens: int, on_complete=None):
+        self.backend = backend
+        self.text = text
+        self.usage_metadata = SimpleNamespace(total_token_count=prompt_tokens + len(text.split()))
+        self._on_complete = on_complete
+
+    async def __aiter__(self):
+        words = self.text.split(" ")
+        chunk_count = max(1, min(self.backend.stream_chunks, len(words)))
+        for index in range(chunk_count):
+            if index:
+                await asyncio.sleep(self.backend.chunk_delay)
+            chunk_words = words[index * len(words) // chunk_count:(index + 1) * len(words) // chunk_count]
+            yield FakeResponse(" ".join(chunk_words) + ("" if index == chunk_count - 1 else " "), 0)
+        if self._on_complete is not None:
+            self._on_complete()
+
+
+class FakeChatSession:
+    """Quacks like ChatSession: starts from a copy of the given history and appends each completed turn."""
+
+    def __init__(self, model: "FakeModel", history: list):
+        self.model = model
+        self.history = list(history)
+
+    def _record_turn(self, user_text: str, model_text: str):
+        self.history.append(glm.Content(role="user", parts=[glm.Part(text=user_text)]))
+        self.history.append(glm.Content(role="model", parts=[glm.Part(text=model_text)]))
+
+    def send_message(self, content, **kwargs):
+        response = self.model.generate_content(content, **kwargs)
+        self._record_turn(_prompt_text(content), response.text)
+        return response
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs):
+        response = await self.model.generate_content_async(content, stream=stream, **kwargs)
+        if stream:
+            response._on_complete = lambda: self._record_turn(_prompt_text(content), response.text)
+        else:
+            self._record_turn(_prompt_text(content), response.text)
+        return response
+
+
+class FakeModel:
+    """Quacks like GenerativeModel for the calls GeminiChatbot makes."""
+
+    def __init__(self, backend: "FakeGeminiBackend"):
+        self.backend = backend
+
+    def start_chat(self, history: list | None = None) -> FakeChatSession:
+        return FakeChatSession(self, history or [])
+
+    def generate_content(self, contents, **kwargs) -> FakeResponse:
+        prompt = _prompt_text(contents)
+        delay, rate_limited = self.backend.begin_call(contents)
+        time.sleep(delay)
+        if rate_limited:
+            raise self.backend.rate_limit_error()
+        return FakeResponse(self.backend.respond(prompt), len(prompt.split()))
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        prompt = _prompt_text(contents)
+        delay, rate_limited = self.backend.begin_call(contents)
+        await asyncio.sleep(delay)
+        if rate_limited:
+            raise self.backend.rate_limit_error()
+        if stream:
+            return FakeStreamResponse(self.backend, self.backend.respond(prompt), len(prompt.split()))
+        return FakeResponse(self.backend.respond(prompt), len(prompt.split()))
+
+
+class FakeKeyModels:
+    """Drop-in for chatbot.KeyModels backed by a FakeGeminiBackend."""
+
+    def __init__(self, api_key: str, backend: "FakeGeminiBackend"):
+        self.api_key = api_key
+        self.model_text = FakeModel(backend)
+        self.model_vision = FakeModel(backend)
+
+    def ensure_async_client(self):
+        pass
+
+
+class FakeGeminiBackend:
+    """
+    Local stand-in for the Gemini API, for benchmarks and offline development.
+
+    Every call waits 'latency' seconds (plus up to 'jitter') before answering, the time to first token when streaming;
+    streams then deliver 'stream_chunks' chunks 'chunk_delay' seconds apart. A 'rate_limit_rate' share of calls
+    fails with a 429 (ResourceExhausted) after 'rate_limit_latency' seconds instead, so key rotation and cooldowns
+    get exercised too. Text-to-SQL prompts are answered with valid SQL from FAKE_SQL_ANSWERS (or "N/A" for questions
+    starting with FAKE_NON_SQL_PREFIXES), everything else with 'response_words' words of canned analysis.
+
+    Plug it in with GeminiChatbot(..., model_factory=backend.models_for_key).
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, rate_limit_rate: float = 0.0,
+                 rate_limit_latency: float = 0.02, stream_chunks: int = 8, chunk_delay: float = 0.05,
+                 response_words: int = 60, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_latency = rate_limit_latency
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.response_words = response_words
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.rate_limited = 0
+
+    def models_for_key(self, api_key: str) -> FakeKeyModels:
+        return FakeKeyModels(api_key, self)
+
+    def begin_call(self, contents) -> tuple[float, bool]:
+        """Counts a call and returns (seconds it should take, whether it ends in a 429)."""
+        kind = "vision" if not isinstance(contents, str) and any(not isinstance(part, str) for part in contents) else "text"
+        with self._lock:
+            self.calls[kind] += 1
+            if self.rate_limit_rate and self._rng.random() < self.rate_limit_rate:
+                self.rate_limited += 1
+                return self.rate_limit_latency, True
+            return self.latency + self._rng.random() * self.jitter, False
+
+    def rate_limit_error(self) -> Exception:
+        return ResourceExhausted("Resource has been exhausted (fake backend, e.g. check quota).")
+
+    def respond(self, prompt: str) -> str:
+        match = _USER_QUERY_RE.search(prompt)
+        if match and "SQL Query:" in prompt:
+            if match.group(1).lower().startswith(FAKE_NON_SQL_PREFIXES):
+                return "N/A"
+            digest = hashlib.sha256(match.group(1).encode("utf-8")).digest()
+            return FAKE_SQL_ANSWERS[digest[0] % len(FAKE_SQL_ANSWERS)]
+        return " ".join(FAKE_ANALYSIS_WORDS[i % len(FAKE_ANALYSIS_WORDS)] for i in range(self.response_words)).capitalize() + "."
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "rate_limited": self.rate_limited}
@@ -0,0 +1,184 @@
+# chatbot_service/image_store.py
+
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from PIL import Image
+
+from shared_state import StateBackend
+
+# Longest side we send to the vision model. Larger screenshots cost upload time and tokens without helping the analysis.
+VISION_MAX_DIMENSION = 1536
+
+# How long cached analyses are kept in a shared state backend (they stay valid for as long as the image is the same)
+SHARED_ANALYSIS_TTL_SECONDS = 24 * 60 * 60
+
+# Stored images in a shared backend are the hex content hash followed by the upload bytes
+HASH_HEX_LENGTH = 64
+
+
+class StoredImage(NamedTuple):
+    data: bytes # Compressed bytes exactly as uploaded (PNG/JPEG/...)
+    content_hash: str
+    stored_at: float
+
+
+def hash_image_bytes(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def decode_for_vision(image_bytes: bytes, max_dimension: int = VISION_MAX_DIMENSION) -> Image.Image:
+    """
+    Decodes compressed image bytes into an RGB image no larger than 'max_dimension' on its longest side.
+    For JPEGs, draft() lets the decoder skip straight to a reduced scale instead of decoding every pixel.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("RGB", (max_dimension, max_dimension))
+    image = image.convert("RGB")
+    image.thumbnail((max_dimension, max_dimension))
+    return image
+
+
+class SessionImageStore:
+    """
+    Keeps the last uploaded chart per session, replacing the old single global PIL image.
+
+    Only the compressed upload bytes are held; they are decoded (and downscaled) on demand.
+    The total size of stored uploads is capped at 'max_bytes', with least-recently-used sessions evicted first,
+    and a session's image expires 'ttl_seconds' after it was last used.
+
+    It also caches vision analyses by (image content hash, prompt), so re-uploading the same chart
+    returns the earlier answer instead of calling Gemini again.
+
+    With a 'backend' (shared_state.py) uploads and analyses are kept there instead, so a chart uploaded through one
+    uvicorn worker can be analyzed by another. Expiry is then the backend's TTL; 'max_bytes' still caps a single upload.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 30 * 60,
+                 max_analyses: int = 256, max_dimension: int = VISION_MAX_DIMENSION, backend: StateBackend | None = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_analyses = max_analyses
+        self.max_dimension = max_dimension
+        self.backend = backend
+
+        self._images: OrderedDict = OrderedDict() # session_id -> StoredImage, least recently used first
+        self._analyses: OrderedDict = OrderedDict() # (content_hash, prompt hash) -> analysis text
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.analysis_hits = 0
+        self.analysis_misses = 0
+
+    # --- Images ---
+    def put(self, session_id: str, image_bytes: bytes, content_hash: str | None = None) -> str:
+        """
+        Stores the upload for this session (replacing any previous one) and returns its content hash.
+        Pass 'content_hash' if it was already computed while receiving the upload.
+        Raises ValueError if the bytes are not an image Pillow can read. Only the header is parsed here.
+        """
+        try:
+            Image.open(io.BytesIO(image_bytes))
+        except Exception as e:
+            raise ValueError(f"Unsupported or corrupt image: {e}")
+        if len(image_bytes) > self.max_bytes:
+            raise ValueError(f"Image is larger than the {self.max_bytes} byte store budget.")
+
+        content_hash = content_hash or hash_image_bytes(image_bytes)
+        if self.backend is not None:
+            self.backend.set(f"image:{session_id}", content_hash.encode("ascii") + image_bytes, ttl=self.ttl_seconds)
+            return content_hash
+        with self._lock:
+            self._remove(session_id)
+            self._images[session_id] = StoredImage(image_bytes, content_hash, time.time())
+            self._total_bytes += len(image_bytes)
+            self._evict()
+        return content_hash
+
+    def get(self, session_id: str) -> StoredImage | None:
+        """Returns the session's stored upload (and refreshes its TTL), or None if there is none."""
+        if self.backend is not None:
+            value = self.backend.get(f"image:{session_id}")
+            if value is None:
+                return None
+            self.backend.touch(f"image:{session_id}", self.ttl_seconds)
+            return StoredImage(value[HASH_HEX_LENGTH:], value[:HASH_HEX_LENGTH].decode("ascii"), time.time())
+        with self._lock:
+            stored = self._images.get(session_id)
+            if stored is None:
+                return None
+            if time.time() - stored.stored_at > self.ttl_seconds:
+                self._remove(session_id)
+                return None
+            stored = stored._replace(stored_at=time.time())
+            self._images[session_id] = stored
+            self._images.move_to_end(session_id)
+            return stored
+
+    def load_image(self, stored: StoredImage) -> Image.Image:
+        """Decodes a stored upload at the resolution the vision model needs. CPU-bound, call it off the event loop."""
+        return decode_for_vision(stored.data, self.max_dimension)
+
+    def _remove(self, session_id: str):
+        stored = self._images.pop(session_id, None)
+        if stored is not None:
+            self._total_bytes -= len(stored.data)
+
+    def _evict(self):
+        now = time.time()
+        for session_id in [sid for sid, stored in self._images.items() if now - stored.stored_at > self.ttl_seconds]:
+            self._remove(session_id)
+        while self._total_bytes > self.max_bytes and self._images:
+            session_id = next(iter(self._images))
+            self._remove(session_id)
+
+    # --- Cached analyses ---
+    @staticmethod
+    def _analysis_key(content_hash: str, prompt: str) -> tuple:
+        return (content_hash, hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+    def get_analysis(self, content_hash: str, prompt: str) -> str | None:
+        key = self._analysis_key(content_hash, prompt)
+        if self.backend is not None:
+            value = self.backend.get("image_analysis:" + ":".join(key))
+            with self._lock:
+                if value is None:
+                    self.analysis_misses += 1
+                    return None
+                self.analysis_hits += 1
+            return value.decode("utf-8")
+        with self._lock:
+            analysis = self._analyses.get(key)
+            if analysis is None:
+                self.analysis_misses += 1
+                return None
+            self._analyses.move_to_end(key)
+            self.analysis_hits += 1
+            return analysis
+
+    def put_analysis(self, content_hash: str, prompt: str, analysis: str):
+        key = self._analysis_key(content_hash, prompt)
+        if self.backend is not None:
+            self.backend.set("image_analysis:" + ":".join(key), analysis.encode("utf-8"), ttl=SHARED_ANALYSIS_TTL_SECONDS)
+            return
+        with self._lock:
+            self._analyses[key] = analysis
+            self._analyses.move_to_end(key)
+            while len(self._analyses) > self.max_analyses:
+                self._analyses.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": self.backend.name if self.backend is not None else "process",
+                "sessions": len(self._images),
+                "stored_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "cached_analyses": len(self._analyses),
+                "analysis_hits": self.analysis_hits,
+                "analysis_misses": self.analysis_misses,
+            }
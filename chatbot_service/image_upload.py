@@ -0,0 +1,90 @@
+# chatbot_service/image_upload.py
+
+import hashlib
+import time
+from typing import NamedTuple
+
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartParser
+from starlette.requests import Request
+
+# Uploads above this size are refused while streaming, before the rest of the body is read
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+
+class ReceivedUpload(NamedTuple):
+    data: bytes # Compressed image bytes as uploaded
+    content_hash: str # sha256 of 'data', computed while streaming
+    size: int
+    seconds: float # Time spent receiving the body
+
+
+async def _limited_stream(request: Request, max_bytes: int):
+    """Yields the request body chunk by chunk, failing as soon as it grows past 'max_bytes'."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit.")
+        yield chunk
+
+
+async def _read_upload_file(upload: UploadFile, max_bytes: int, content_hash) -> bytes:
+    parts = []
+    size = 0
+    while True:
+        chunk = await upload.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit.")
+        content_hash.update(chunk)
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+async def receive_image_upload(request: Request, max_bytes: int = MAX_UPLOAD_BYTES) -> ReceivedUpload:
+    """
+    Streams an image upload without ever holding a Base64 copy of it.
+
+    Accepts either multipart/form-data with a 'file' field (what browsers send with FormData)
+    or a raw image body (Content-Type: image/png, image/jpeg, application/octet-stream).
+    The size limit is checked against Content-Length up front and again while the body streams in.
+    Raises UploadTooLargeError or ValueError for bad uploads.
+    """
+    start_time = time.perf_counter()
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit.")
+
+    content_type = request.headers.get("content-type", "")
+    content_hash = hashlib.sha256()
+
+    if content_type.startswith("multipart/form-data"):
+        # Starlette spools the file part to a SpooledTemporaryFile as it parses
+        form = await MultiPartParser(request.headers, _limited_stream(request, max_bytes), max_files=1, max_fields=10).parse()
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            raise ValueError("Multipart upload must contain a 'file' field.")
+        try:
+            data = await _read_upload_file(upload, max_bytes, content_hash)
+        finally:
+            await upload.close()
+    else:
+        # The body is capped at max_bytes, so collecting the chunks and joining once is the cheapest option
+        parts = []
+        async for chunk in _limited_stream(request, max_bytes):
+            content_hash.update(chunk)
+            parts.append(chunk)
+        data = b"".join(parts)
+
+    if not data:
+        raise ValueError("Empty upload.")
+    return ReceivedUpload(data, content_hash.hexdigest(), len(data), time.perf_counter() - start_time)
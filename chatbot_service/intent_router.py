@@ -0,0 +1,269 @@
+# chatbot_service/intent_router.py
+
+import calendar
+import datetime
+import re
+import threading
+import time
+from collections import Counter
+from typing import Callable, NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import metrics
+import models
+
+# Natural language -> table column
+COLUMN_WORDS = {
+    "close": "close_price", "closing": "close_price",
+    "open": "open_price", "opening": "open_price",
+    "high": "high_price", "low": "low_price",
+    "volume": "volume", "vol": "volume",
+}
+COLUMN_LABELS = {
+    "close_price": "closing price", "open_price": "opening price",
+    "high_price": "high price", "low_price": "low price", "volume": "volume",
+}
+
+AGGREGATE_WORDS = {
+    "highest": "MAX", "max": "MAX", "maximum": "MAX", "peak": "MAX",
+    "lowest": "MIN", "min": "MIN", "minimum": "MIN",
+    "average": "AVG", "avg": "AVG", "mean": "AVG",
+}
+AGGREGATE_LABELS = {"MAX": "highest", "MIN": "lowest", "AVG": "average"}
+# Column to use when the question names an aggregate but no column ("highest price in 2023")
+DEFAULT_AGGREGATE_COLUMN = {"MAX": "high_price", "MIN": "low_price", "AVG": "close_price"}
+
+SIGNAL_WORDS = {"long": "LONG", "longs": "LONG", "short": "SHORT", "shorts": "SHORT"}
+COUNT_WORDS = {"count", "many", "number", "total"}
+
+MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_NUMBERS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+MONTH_NUMBERS["sept"] = 9
+_MONTH_PATTERN = "|".join(sorted(MONTH_NUMBERS, key=len, reverse=True))
+
+# Filler words that may appear around a template without changing its meaning.
+# Any other leftover word means the question has extra conditions, so it goes to the LLM instead.
+# Range connectors ("between", "from", "until", ...) are not filler: they are only accepted as part of a full
+# date range consumed by _DATE_RANGE_RE, so open-ended ranges ("until 2024-06-01") go to the LLM.
+FILLER_WORDS = {
+    "what", "whats", "was", "is", "were", "are", "the", "of", "in", "for", "during", "on", "at", "a",
+    "tsla", "tesla", "stock", "stocks", "share", "shares", "price", "prices", "value", "me", "show", "tell",
+    "give", "did", "does", "how", "there", "overall", "all", "time", "ever", "please", "s", "trading",
+    "daily", "day", "days", "signal", "signals", "direction", "directions", "year", "month", "total",
+    "it", "its", "have", "we", "had", "get",
+}
+
+_ISO_DATE = r"\d{4}-\d{2}-\d{2}"
+_DATE_RANGE_RE = re.compile(rf"\b(?:between|from)\s+({_ISO_DATE})\s+(?:and|to|through|until)\s+({_ISO_DATE})\b")
+_ISO_DATE_RE = re.compile(rf"\b({_ISO_DATE})\b")
+_MONTH_DAY_YEAR_RE = re.compile(rf"\b({_MONTH_PATTERN})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?,?\s+(\d{{4}})\b")
+_DAY_MONTH_YEAR_RE = re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+({_MONTH_PATTERN})\.?,?\s+(\d{{4}})\b")
+_MONTH_YEAR_RE = re.compile(rf"\b({_MONTH_PATTERN})\.?,?\s+(\d{{4}})\b")
+_YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+
+
+class RoutedQuery(NamedTuple):
+    """A question matched to a template: prepared SQL, its bind parameters and how to phrase the answer."""
+    intent: str
+    sql: str
+    params: dict
+    format_answer: Callable[[object], str]
+    no_data_answer: str = "I couldn't find any data matching your query."
+
+
+def _format_value(column: str, value) -> str:
+    if column == "volume":
+        return f"{value:,.0f}"
+    return f"${value:,.2f}"
+
+
+class IntentRouter:
+    """
+    Rule-based fast path for the most common chat questions, tried before any Gemini call:
+
+    - MIN/MAX/AVG of a price column or volume, overall or over a year, a month of a year, or a date range
+    - the price/volume of a single day ("close on 2024-03-05", "closing price on March 5, 2024")
+    - the number of LONG/SHORT signals, optionally over a period
+
+    Matched questions run as fixed, parameterized SQL on the indexed 'timestamp' column
+    (the fixed SQL text also lets SQLite reuse its prepared statements). Questions about another symbol
+    than models.DEFAULT_SYMBOL read the stock_bars view, filtered on the symbol.
+    Anything the grammar can't fully account for returns None so the caller falls back to the LLM.
+
+    'avg_fast_path_ms' in the stats is routing plus SQL for the questions answered here: about 0.3-1 ms per question
+    on a warm connection to the sample database, while the first queries on a new connection take a few ms (so a
+    short run averages several ms). Waiting for a worker thread under load is not included.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total_queries = 0
+        self.fast_path_queries = 0
+        self.fast_path_failures = 0 # Matched a template, but the SQL failed and the question went to the LLM
+        self.fast_path_seconds = 0.0
+        self.intent_counts = Counter()
+
+    # --- Parsing ---
+    def _extract_period(self, query: str) -> tuple[str, tuple | None, str | None]:
+        """
+        Pulls the time period out of the query text.
+        Returns (remaining_text, (start_date, end_date) or None, label) where the dates are inclusive ISO strings.
+        The single-day case is returned with start == end.
+        """
+        match = _DATE_RANGE_RE.search(query)
+        if match:
+            start, end = match.group(1), match.group(2)
+            return query[:match.start()] + query[match.end():], (start, end), f"between {start} and {end}"
+
+        for pattern, order in ((_MONTH_DAY_YEAR_RE, "mdy"), (_DAY_MONTH_YEAR_RE, "dmy")):
+            match = pattern.search(query)
+            if match:
+                if order == "mdy":
+                    month, day, year = MONTH_NUMBERS[match.group(1)], int(match.group(2)), int(match.group(3))
+                else:
+                    day, month, year = int(match.group(1)), MONTH_NUMBERS[match.group(2)], int(match.group(3))
+                day_iso = datetime.date(year, month, day).isoformat()
+                return query[:match.start()] + query[match.end():], (day_iso, day_iso), f"on {day_iso}"
+
+        match = _ISO_DATE_RE.search(query)
+        if match:
+            day_iso = datetime.date.fromisoformat(match.group(1)).isoformat()
+            return query[:match.start()] + query[match.end():], (day_iso, day_iso), f"on {day_iso}"
+
+        match = _MONTH_YEAR_RE.search(query)
+        if match:
+            month, year = MONTH_NUMBERS[match.group(1)], int(match.group(2))
+            last_day = calendar.monthrange(year, month)[1]
+            period = (f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}")
+            return query[:match.start()] + query[match.end():], period, f"in {calendar.month_name[month]} {year}"
+
+        match = _YEAR_RE.search(query)
+        if match:
+            year = int(match.group(1))
+            return query[:match.start()] + query[match.end():], (f"{year}-01-01", f"{year}-12-31"), f"in {year}"
+
+        return query, None, None
+
+    def route(self, user_query: str, symbol: str = models.DEFAULT_SYMBOL) -> RoutedQuery | None:
+        """Matches the question against the templates. Returns None if it should go to the LLM."""
+        query = user_query.lower().replace("'", "")
+        try:
+            query, period, period_label = self._extract_period(query)
+        except ValueError:
+            return None # e.g. "February 30, 2024"
+
+        words = re.findall(r"[a-z]+|\d+", query)
+        if any(word.isdigit() for word in words):
+            return None # Leftover numbers ("last 30 days", two years, ...) are beyond the templates
+
+        columns = {COLUMN_WORDS[word] for word in words if word in COLUMN_WORDS}
+        aggregates = {AGGREGATE_WORDS[word] for word in words if word in AGGREGATE_WORDS}
+        signals = {SIGNAL_WORDS[word] for word in words if word in SIGNAL_WORDS}
+        has_count = any(word in COUNT_WORDS for word in words)
+
+        known_words = COLUMN_WORDS.keys() | AGGREGATE_WORDS.keys() | SIGNAL_WORDS.keys() | COUNT_WORDS | FILLER_WORDS | {symbol.lower()}
+        if any(word not in known_words for word in words):
+            return None
+        if len(columns) > 1 or len(aggregates) > 1 or len(signals) > 1:
+            return None # Comparisons and multi-column questions are left to the LLM
+
+        if symbol == models.DEFAULT_SYMBOL:
+            source_sql, symbol_condition, symbol_params = "tesla_stock", None, {}
+        else:
+            source_sql, symbol_condition, symbol_params = models.SYMBOL_BARS_VIEW, "symbol = :symbol", {"symbol": symbol}
+        period_condition = "timestamp BETWEEN :start AND :end" if period else None
+        period_params = {"start": period[0], "end": period[1]} if period else {}
+        period_text = f" {period_label}" if period else " across all available data"
+        is_single_day = period is not None and period[0] == period[1]
+
+        def where_sql(*conditions) -> str:
+            conditions = [condition for condition in (symbol_condition, *conditions) if condition]
+            return f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # --- Count of LONG/SHORT signals ---
+        if signals and has_count and not columns and not aggregates:
+            direction = signals.pop()
+            sql = f"SELECT COUNT(*) FROM {source_sql}{where_sql('direction = :direction', period_condition)}"
+            return RoutedQuery(
+                "signal_count", sql, {"direction": direction, **period_params, **symbol_params},
+                lambda value: f"There were {value:,} {direction} signals{period_text}.",
+            )
+        if signals or has_count:
+            return None
+
+        # --- Value on a single day ---
+        if is_single_day and not aggregates:
+            column = columns.pop() if columns else "close_price"
+            label = COLUMN_LABELS[column]
+            day_iso = period[0]
+            sql = f"SELECT {column} FROM {source_sql}{where_sql('timestamp = :day')}"
+            return RoutedQuery(
+                "value_on_date", sql, {"day": day_iso, **symbol_params},
+                lambda value: f"The {label} on {day_iso} was {_format_value(column, value)}.",
+                f"There is no trading data for {day_iso}.",
+            )
+
+        # --- MIN/MAX/AVG over a period ---
+        if aggregates:
+            aggregate = aggregates.pop()
+            column = columns.pop() if columns else DEFAULT_AGGREGATE_COLUMN[aggregate]
+            label = f"{AGGREGATE_LABELS[aggregate]} {COLUMN_LABELS[column]}"
+            sql = f"SELECT {aggregate}({column}) FROM {source_sql}{where_sql(period_condition)}"
+            return RoutedQuery(
+                "aggregate", sql, {**period_params, **symbol_params},
+                lambda value: f"The {label}{period_text} was {_format_value(column, value)}.",
+            )
+
+        return None
+
+    # --- Execution ---
+    def execute(self, db: Session, routed: RoutedQuery) -> str:
+        """Runs the prepared SQL for a routed question and phrases the answer."""
+        with metrics.stage("sql_fast_path", intent=routed.intent):
+            value = db.execute(text(routed.sql), routed.params).scalar()
+            if value is None:
+                return routed.no_data_answer
+            return routed.format_answer(value)
+
+    def answer(self, db: Session, user_query: str, symbol: str = models.DEFAULT_SYMBOL) -> str | None:
+        """
+        Routes and executes the question, or returns None if it should go to the LLM: no template matched,
+        or the SQL failed. Blocks on SQLite, so async callers run it in a worker thread.
+        """
+        start_time = time.perf_counter()
+        routed = self.route(user_query, symbol=symbol)
+        if routed is None:
+            self._record()
+            return None
+        try:
+            answer = self.execute(db, routed)
+        except Exception as e:
+            print(f"Fast-path query failed, falling back to Gemini: {e}")
+            self._record(failed=True)
+            return None
+        self._record(routed, time.perf_counter() - start_time)
+        return answer
+
+    def _record(self, routed: RoutedQuery | None = None, seconds: float = 0.0, failed: bool = False):
+        """Counts one question, so the stats can report the fast-path share of traffic and its cost."""
+        with self._lock:
+            self.total_queries += 1
+            if failed:
+                self.fast_path_failures += 1
+            elif routed is not None:
+                self.fast_path_queries += 1
+                self.fast_path_seconds += seconds
+                self.intent_counts[routed.intent] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "total_queries": self.total_queries,
+                "fast_path_queries": self.fast_path_queries,
+                "fast_path_failures": self.fast_path_failures,
+                "fast_path_ratio": self.fast_path_queries / self.total_queries if self.total_queries else 0.0,
+                "avg_fast_path_ms": (self.fast_path_seconds / self.fast_path_queries * 1000) if self.fast_path_queries else 0.0,
+                "by_intent": dict(self.intent_counts),
+            }
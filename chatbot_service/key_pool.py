@@ -0,0 +1,232 @@
+# chatbot_service/key_pool.py
+
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+
+from shared_state import StateBackend
+
+# Window used for the per-key request/token rates
+RATE_WINDOW_SECONDS = 60.0
+
+# How often cooldowns set by other workers are read back from the shared state backend
+SHARED_COOLDOWN_SYNC_SECONDS = 0.5
+
+
+class KeyState:
+    """Usage and health of one API key. Only touched under APIKeyPool's lock."""
+
+    def __init__(self, index: int, api_key: str):
+        self.index = index
+        self.api_key = api_key
+        self.fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] # Names the key in shared state
+        self.in_flight = 0
+        self.request_times = deque() # Start times of recent requests (within RATE_WINDOW_SECONDS)
+        self.token_usage = deque() # (time, tokens) of recent responses
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.consecutive_failures = 0
+        self.rate_limit_streak = 0 # 429s in a row, drives the cooldown backoff
+        self.cooldown_until = 0.0
+        self.last_error = None
+
+    def prune(self, now: float):
+        cutoff = now - RATE_WINDOW_SECONDS
+        while self.request_times and self.request_times[0] < cutoff:
+            self.request_times.popleft()
+        while self.token_usage and self.token_usage[0][0] < cutoff:
+            self.token_usage.popleft()
+
+    def recent_tokens(self) -> int:
+        return sum(tokens for _, tokens in self.token_usage)
+
+    def is_available(self, now: float, requests_per_minute: int | None, tokens_per_minute: int | None) -> bool:
+        if now < self.cooldown_until:
+            return False
+        if requests_per_minute and len(self.request_times) >= requests_per_minute:
+            return False
+        if tokens_per_minute and self.recent_tokens() >= tokens_per_minute:
+            return False
+        return True
+
+    def load(self) -> tuple:
+        # Fewest requests in flight first, then the least used over the last window
+        return (self.in_flight, len(self.request_times), self.recent_tokens(), self.index)
+
+
+class APIKeyPool:
+    """
+    Tracks request rate, token usage and failures per Gemini API key and hands out
+    the least-loaded healthy key for each call (instead of round-robin rotation).
+
+    A key that returns a rate limit / quota error is cooled down for 'rate_limit_cooldown' seconds,
+    doubling on repeated 429s up to 'max_cooldown'. Other errors may just be a bad request, so a key is only
+    cooled down for 'error_cooldown' after 'error_threshold' of them in a row.
+    Optional 'requests_per_minute' / 'tokens_per_minute' budgets keep a key out of rotation
+    before Google starts rejecting it.
+
+    With a 'shared_state' backend (shared_state.py) cooldowns are published there and picked up by the pools of
+    all other uvicorn workers within SHARED_COOLDOWN_SYNC_SECONDS, so a key that hit its quota in one worker isn't
+    hammered by the rest. Usage counts and the per-minute budgets stay per worker (divide budgets by the worker count).
+    """
+
+    def __init__(self, api_keys: list[str], rate_limit_cooldown: float = 30.0, error_cooldown: float = 5.0,
+                 error_threshold: int = 3, max_cooldown: float = 300.0, requests_per_minute: int | None = None, tokens_per_minute: int | None = None,
+                 shared_state: StateBackend | None = None):
+        if not api_keys:
+            raise ValueError("No API keys provided for APIKeyPool.")
+        self.keys = [KeyState(index, api_key) for index, api_key in enumerate(api_keys)]
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.error_cooldown = error_cooldown
+        self.error_threshold = error_threshold
+        self.max_cooldown = max_cooldown
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.shared_state = shared_state
+        self._lock = threading.Lock()
+        self._last_shared_sync = 0.0
+        self.shared_cooldowns_seen = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # --- Shared cooldowns ---
+    def _sync_shared_cooldowns(self, now: float):
+        """Adopts cooldowns other workers published, at most every SHARED_COOLDOWN_SYNC_SECONDS."""
+        if self.shared_state is None or now - self._last_shared_sync < SHARED_COOLDOWN_SYNC_SECONDS:
+            return
+        self._last_shared_sync = now
+        try:
+            published = [self.shared_state.get(f"key_cooldown:{key.fingerprint}") for key in self.keys]
+        except Exception as e:
+            print(f"Could not read shared API key cooldowns: {e}")
+            return
+        with self._lock:
+            for key, value in zip(self.keys, published):
+                if value is None:
+                    continue
+                cooldown = json.loads(value)
+                if cooldown["until"] > key.cooldown_until:
+                    key.cooldown_until = cooldown["until"]
+                    self.shared_cooldowns_seen += 1
+                key.rate_limit_streak = max(key.rate_limit_streak, cooldown["streak"])
+
+    def _publish_cooldown(self, key: KeyState, until: float, streak: int, now: float):
+        def merge(value: bytes | None) -> bytes:
+            if value is not None:
+                published = json.loads(value)
+                until_merged, streak_merged = max(until, published["until"]), max(streak, published["streak"])
+            else:
+                until_merged, streak_merged = until, streak
+            return json.dumps({"until": until_merged, "streak": streak_merged}).encode("utf-8")
+
+        # Outlives the cooldown by one base period, so a 429 right after it still escalates the backoff everywhere
+        self.shared_state.update(f"key_cooldown:{key.fingerprint}", merge, ttl=until - now + self.rate_limit_cooldown)
+
+    def acquire(self, exclude: set | None = None) -> KeyState | None:
+        """
+        Reserves the least-loaded available key, skipping indexes in 'exclude' (keys already tried for this call).
+        Returns None if every key is cooling down or over budget; see seconds_until_available().
+        Every successful acquire() must be paired with release().
+        """
+        now = time.time()
+        self._sync_shared_cooldowns(now)
+        with self._lock:
+            candidates = []
+            for key in self.keys:
+                key.prune(now)
+                if exclude and key.index in exclude:
+                    continue
+                if key.is_available(now, self.requests_per_minute, self.tokens_per_minute):
+                    candidates.append(key)
+            if not candidates:
+                return None
+            key = min(candidates, key=KeyState.load)
+            key.in_flight += 1
+            key.total_requests += 1
+            key.request_times.append(now)
+            return key
+
+    def release(self, key: KeyState, tokens: int = 0, error: Exception | None = None, rate_limited: bool = False):
+        """Returns a key after a call, recording its token usage or putting it into cooldown after an error."""
+        now = time.time()
+        with self._lock:
+            key.in_flight -= 1
+            if tokens:
+                key.total_tokens += tokens
+                key.token_usage.append((now, tokens))
+            if error is None:
+                key.consecutive_failures = 0
+                key.rate_limit_streak = 0
+                return
+
+            key.failures += 1
+            key.rate_limited += int(rate_limited)
+            key.last_error = str(error)[:200]
+            if now < key.cooldown_until:
+                return # Requests that were already in flight when the key went into cooldown, don't escalate again
+            key.consecutive_failures += 1
+            if rate_limited:
+                key.rate_limit_streak += 1
+                cooldown = min(self.rate_limit_cooldown * 2 ** (key.rate_limit_streak - 1), self.max_cooldown)
+            elif key.consecutive_failures >= self.error_threshold:
+                cooldown = self.error_cooldown
+            else:
+                return
+            key.cooldown_until = max(key.cooldown_until, now + cooldown)
+            until, streak = key.cooldown_until, key.rate_limit_streak
+        if self.shared_state is not None:
+            try:
+                self._publish_cooldown(key, until, streak, now)
+            except Exception as e:
+                print(f"Could not publish the cooldown of API key index {key.index}: {e}")
+
+    def seconds_until_available(self) -> float:
+        """How long until some key comes out of cooldown or falls back under its rate budget."""
+        now = time.time()
+        self._sync_shared_cooldowns(now)
+        with self._lock:
+            waits = []
+            for key in self.keys:
+                key.prune(now)
+                wait = max(key.cooldown_until - now, 0.0)
+                if self.requests_per_minute and len(key.request_times) >= self.requests_per_minute:
+                    wait = max(wait, key.request_times[0] + RATE_WINDOW_SECONDS - now)
+                if self.tokens_per_minute and key.recent_tokens() >= self.tokens_per_minute:
+                    wait = max(wait, key.token_usage[0][0] + RATE_WINDOW_SECONDS - now)
+                waits.append(wait)
+            return min(waits)
+
+    def stats(self) -> dict:
+        now = time.time()
+        self._sync_shared_cooldowns(now)
+        with self._lock:
+            keys = []
+            for key in self.keys:
+                key.prune(now)
+                keys.append({
+                    "index": key.index,
+                    "key_suffix": key.api_key[-4:], # Enough to tell keys apart without exposing them
+                    "healthy": now >= key.cooldown_until,
+                    "cooldown_remaining": round(max(key.cooldown_until - now, 0.0), 1),
+                    "in_flight": key.in_flight,
+                    "requests_last_minute": len(key.request_times),
+                    "tokens_last_minute": key.recent_tokens(),
+                    "total_requests": key.total_requests,
+                    "total_tokens": key.total_tokens,
+                    "failures": key.failures,
+                    "rate_limited": key.rate_limited,
+                    "last_error": key.last_error,
+                })
+            return {
+                "keys": keys,
+                "healthy_keys": sum(1 for key in keys if key["healthy"]),
+                "requests_per_minute_budget": self.requests_per_minute,
+                "tokens_per_minute_budget": self.tokens_per_minute,
+                "shared_state": self.shared_state.name if self.shared_state is not None else None,
+                "shared_cooldowns_seen": self.shared_cooldowns_seen,
+            }
@@ -2,20 +2,35 @@
 
 from sqlalchemy.orm import Session
 from sqlalchemy import text 
+import asyncio
 import calendar 
+import hashlib
+import time
 import datetime # Keep this global import for other uses like parsing dates if needed
 
+import metrics
+import models
 from models import StockData 
-from .chatbot import GeminiChatbot # This import remains the same
+from .chatbot import AsyncGeminiChatbot
+from .sql_cache import SQLTranslationCache
+from .intent_router import IntentRouter
+from .sql_sandbox import SQLSandbox, SQLRejectedError, SQLBudgetExceededError
 
 class QueryParser:
-    def __init__(self, db: Session, gemini_chatbot: GeminiChatbot):
+    def __init__(self, db: Session, gemini_chatbot: AsyncGeminiChatbot, sql_cache: SQLTranslationCache | None = None,
+                 intent_router: IntentRouter | None = None, read_only_db: Session | None = None,
+                 sql_sandbox: SQLSandbox | None = None, symbol: str = models.DEFAULT_SYMBOL):
         self.db = db
+        self.read_only_db = read_only_db # Generated SQL runs here when given, so it can never write
         self.gemini_chatbot = gemini_chatbot 
+        self.sql_cache = sql_cache # Optional NL->SQL cache shared across requests
+        self.intent_router = intent_router # Optional rule-based fast path tried before the LLM
+        self.sql_sandbox = sql_sandbox # Optional plan check, row cap and time budget for generated SQL
+        self.symbol = symbol # Ticker the questions are about
 
         self.db_schema = """
         You are interacting with a SQLite database named 'tesla_stock.db'.
-        The database contains a single table named 'tesla_stock'.
+        The main table is 'tesla_stock' (one row per trading day).
         The schema for the 'tesla_stock' table is as follows:
 
         CREATE TABLE tesla_stock (
@@ -33,10 +48,76 @@ class QueryParser:
             resistance_upper REAL
         );
 
-        When referencing dates, use the 'timestamp' column. SQLite date comparisons work directly on 'YYYY-MM-DD' strings.
-        For example, to filter by year, use `strftime('%Y', timestamp) = '2023'`.
-        To filter by month, use `strftime('%m', timestamp) = '01'` (for January).
-        To filter by date range, use `timestamp BETWEEN 'YYYY-MM-DD' AND 'YYYY-MM-DD'`.
+        There are also three small pre-aggregated rollup tables with one row per week, month and year:
+        'tesla_stock_weekly', 'tesla_stock_monthly' and 'tesla_stock_yearly'. They all share this schema:
+
+        CREATE TABLE tesla_stock_monthly (
+            period_start DATE PRIMARY KEY, -- Monday of the week, 1st of the month ('YYYY-MM-01') or Jan 1st ('YYYY-01-01')
+            period_end DATE, -- date of the last trading day in the period
+            bar_count INTEGER, -- number of trading days in the period
+            open_price REAL, -- open of the first day
+            high_price REAL, -- highest high
+            low_price REAL, -- lowest low
+            close_price REAL, -- close of the last day
+            volume REAL, -- total volume
+            avg_close REAL, min_close REAL, max_close REAL,
+            avg_volume REAL, min_volume REAL, max_volume REAL,
+            long_count INTEGER, -- number of 'LONG' signals
+            short_count INTEGER -- number of 'SHORT' signals
+        );
+
+        PREFER THE ROLLUP TABLES for whole-year, whole-month or whole-week statistics; they are much faster than scanning 'tesla_stock'.
+        For example, the average closing price in 2023 is `SELECT avg_close FROM tesla_stock_yearly WHERE period_start = '2023-01-01'`,
+        the highest close in March 2024 is `SELECT max_close FROM tesla_stock_monthly WHERE period_start = '2024-03-01'`,
+        and the number of LONG signals in 2022 is `SELECT long_count FROM tesla_stock_yearly WHERE period_start = '2022-01-01'`.
+        Note that avg_close/avg_volume are per-day averages, so only use them for a single period; to average over several periods,
+        query 'tesla_stock' instead.
+
+        Technical indicators are precomputed in 'tesla_stock_indicators', one row per trading day, joined to 'tesla_stock' on 'timestamp':
+
+        CREATE TABLE tesla_stock_indicators (
+            timestamp DATE PRIMARY KEY,
+            sma_20 REAL, sma_50 REAL, sma_200 REAL, -- simple moving averages of the close over 20/50/200 days
+            ema_12 REAL, ema_26 REAL, -- exponential moving averages of the close
+            rsi_14 REAL, -- 14-day Wilder RSI (0-100; above 70 overbought, below 30 oversold)
+            atr_14 REAL, -- 14-day average true range
+            bb_middle REAL, bb_upper REAL, bb_lower REAL, -- 20-day Bollinger bands (2 standard deviations)
+            vwap_20 REAL -- 20-day volume-weighted average price
+        );
+
+        ALWAYS READ INDICATORS FROM THIS TABLE instead of computing moving averages or RSI with window functions.
+        Values are NULL for the first days of the series, until each indicator's window is full.
+        For example, the RSI on the latest day is `SELECT timestamp, rsi_14 FROM tesla_stock_indicators ORDER BY timestamp DESC LIMIT 1`,
+        and the days in 2024 that closed above their 200-day average are
+        `SELECT s.timestamp, s.close_price, i.sma_200 FROM tesla_stock s JOIN tesla_stock_indicators i ON i.timestamp = s.timestamp WHERE s.timestamp BETWEEN '2024-01-01' AND '2024-12-31' AND s.close_price > i.sma_200`.
+
+        support_lower/support_upper and resistance_lower/resistance_upper are only the lowest and highest level of each day.
+        Every individual level is in 'tesla_stock_levels', joined to 'tesla_stock' on 'timestamp':
+
+        CREATE TABLE tesla_stock_levels (
+            timestamp DATE,
+            kind TEXT, -- 'support' or 'resistance'
+            position INTEGER, -- order of the level in that day's list
+            price REAL,
+            PRIMARY KEY (timestamp, kind, position)
+        ); -- indexed on (kind, price, timestamp)
+
+        For questions about specific levels, ALWAYS filter 'tesla_stock_levels' on kind and a price range so the index is used.
+        For example, the days with a support level within 1% of 850 are
+        `SELECT DISTINCT timestamp FROM tesla_stock_levels WHERE kind = 'support' AND price BETWEEN 841.5 AND 858.5 ORDER BY timestamp`.
+
+        'tesla_stock' and all of the tables above only hold TSLA. Bars of every stored symbol, TSLA included, are in the
+        'stock_bars' view (its columns are those of 'tesla_stock' without 'id', plus 'symbol TEXT'); the stored symbols are
+        listed in 'stock_symbols (symbol TEXT PRIMARY KEY, first_timestamp DATE, last_timestamp DATE, bar_count INTEGER)'.
+        ALWAYS filter 'stock_bars' on symbol, e.g. `SELECT MAX(close_price) FROM stock_bars WHERE symbol = 'AAPL' AND timestamp BETWEEN '2024-01-01' AND '2024-12-31'`.
+        For TSLA-only questions keep using 'tesla_stock' and its rollup, indicator and level tables.
+
+        When referencing dates in 'tesla_stock', use the 'timestamp' column. SQLite date comparisons work directly on 'YYYY-MM-DD' strings.
+        Always filter dates with ranges so the timestamp index can be used:
+        to filter by year, use `timestamp BETWEEN '2023-01-01' AND '2023-12-31'`;
+        to filter by month, use `timestamp BETWEEN '2024-01-01' AND '2024-01-31'` (for January 2024);
+        to filter by date range, use `timestamp BETWEEN 'YYYY-MM-DD' AND 'YYYY-MM-DD'`.
+        Only use `strftime('%m', timestamp) = '01'` when the question is about a month across all years.
         """
         
         self.forbidden_keywords = [
@@ -45,7 +126,18 @@ class QueryParser:
             ";" # Keep this to prevent multi-statement SQL unless you explicitly want to allow it later
         ]
 
-    def _get_sql_from_gemini(self, user_query: str) -> str | None:
+        # Questions about another symbol must be answered from 'stock_bars' (rollups, indicators and levels are TSLA-only)
+        self.symbol_instructions = ""
+        if symbol != models.DEFAULT_SYMBOL:
+            self.symbol_instructions = (
+                f"- The user is asking about the symbol '{symbol}', NOT TSLA (unless they name other symbols). "
+                f"Read its bars from the 'stock_bars' view with `symbol = '{symbol}'`; the other tables only hold TSLA."
+            )
+
+        # Cached SQL is only reused while the schema prompt (and symbol) it was generated from is unchanged
+        self.schema_fingerprint = hashlib.sha256((self.db_schema + self.symbol_instructions).encode("utf-8")).hexdigest()[:16]
+
+    async def _get_sql_from_gemini(self, user_query: str, data_version: int | None = None) -> str | None:
         prompt = f"""
         You are an AI assistant that converts natural language questions into SQL queries for a stock database.
         Use the provided database schema to write accurate and efficient SQL queries.
@@ -60,17 +152,19 @@ class QueryParser:
         - For queries that might return many rows (e.g., "all closing prices"), include a LIMIT clause (e.g., LIMIT 10).
         - For aggregate functions, use appropriate SQLite functions like MIN, MAX, AVG, COUNT, SUM.
         - When a comparison is requested (e.g., "compare X vs Y"), strive to generate a single SELECT query that returns both X and Y as separate columns, possibly using subqueries or conditional aggregation. For example:
-          `SELECT (SELECT AVG(volume) FROM tesla_stock WHERE strftime('%Y', timestamp) = '2022') AS avg_2022_volume, (SELECT AVG(volume) FROM tesla_stock WHERE strftime('%Y', timestamp) = '2023') AS avg_2023_volume;`
+          `SELECT (SELECT avg_volume FROM tesla_stock_yearly WHERE period_start = '2022-01-01') AS avg_2022_volume, (SELECT avg_volume FROM tesla_stock_yearly WHERE period_start = '2023-01-01') AS avg_2023_volume;`
         - For month names in natural language, convert them to their corresponding 'MM' number (e.g., January -> '01').
+        {self.symbol_instructions}
 
         User query: "{user_query}"
 
         SQL Query:
         """
         try:
-            # This call will now automatically handle key rotation and retries
-            response = self.gemini_chatbot.model_text.generate_content(prompt) 
-            sql_query = response.text.strip()
+            # This call automatically handles key selection and failover, without blocking the event loop.
+            # Identical prompts in flight at the same time share one Gemini call.
+            response_text = await self.gemini_chatbot.generate_text_async(prompt, data_version=data_version)
+            sql_query = response_text.strip()
             
             if sql_query.startswith("```sql"):
                 sql_query = sql_query[len("```sql"):].strip()
@@ -103,25 +197,63 @@ class QueryParser:
             print(f"Error generating SQL from Gemini: {e}")
             return None
 
-    def parse_and_execute(self, user_query: str) -> dict:
-        # No hardcoded logic here for now, we rely solely on Gemini's SQL generation
-        generated_sql = self._get_sql_from_gemini(user_query)
+    async def parse_and_execute(self, user_query: str) -> dict:
+        # Common template questions (min/max/avg over a period, value on a date, signal counts)
+        # are answered with prepared SQL without touching the LLM at all.
+        if self.intent_router:
+            answer = await asyncio.to_thread(self.intent_router.answer, self.db, user_query, self.symbol)
+            if answer is not None:
+                return {"type": "db_response", "content": answer}
+
+        # Everything else goes through Gemini's SQL generation.
+        # Questions that were answered before (or phrased almost the same way) skip the Gemini round trip.
+        with metrics.stage("sql_cache_lookup") as labels:
+            cached_sql = await asyncio.to_thread(self.sql_cache.lookup, user_query, self.schema_fingerprint) if self.sql_cache else None
+            labels["outcome"] = "hit" if cached_sql else "miss"
+        if cached_sql:
+            generated_sql = cached_sql
+        else:
+            data_version = await asyncio.to_thread(models.get_data_version, self.db)
+            # Includes key waits and retries, on top of the individual "llm_call" stages
+            with metrics.stage("text_to_sql"):
+                generated_sql = await self._get_sql_from_gemini(user_query, data_version)
 
         if not generated_sql or "N/A" in generated_sql.upper():
             print(f"Gemini did not generate valid SQL for: {user_query}")
             return {"type": "gemini_response", "content": "I apologize, but I couldn't generate a valid SQL query to answer that. Could you please rephrase or ask a simpler question about the stock data?"}
 
+        # SQLite calls block, so run them in a worker thread instead of on the event loop
+        result = await asyncio.to_thread(self._execute_sql, generated_sql, user_query)
+
+        # Only remember SQL that actually ran successfully
+        if self.sql_cache and cached_sql is None and result["type"] == "db_response":
+            await asyncio.to_thread(self.sql_cache.store, user_query, generated_sql, self.schema_fingerprint)
+        return result
+
+    def _execute_sql(self, generated_sql: str, user_query: str) -> dict:
+        """
+        Runs the generated SQL and formats the rows into a chat response.
+        """
         try:
-            result = self.db.execute(text(generated_sql))
-            rows = result.fetchall()
+            db = self.read_only_db or self.db
+            truncated = False
+            if self.sql_sandbox:
+                sandbox_result = self.sql_sandbox.execute(db, generated_sql)
+                rows, column_names_list, truncated = sandbox_result.rows, sandbox_result.columns, sandbox_result.truncated
+            else:
+                with metrics.stage("sql_exec"):
+                    result = db.execute(text(generated_sql))
+                    rows = result.fetchall()
+                column_names_list = result.keys()
             
             if not rows:
                 return {"type": "db_response", "content": "I couldn't find any data matching your query."}
 
+            format_start_time = time.perf_counter()
+
             response_parts = []
             
             # Check if the query returned specific column names for a comparison, e.g., 'avg_2022_volume', 'avg_2023_volume'
-            column_names_list = result.keys() 
             if len(rows) == 1 and all(col.startswith('avg_') and col.endswith('_volume') for col in column_names_list):
                     # This is a specific handler for the 'compare average volume' type of query
                 avg_2022 = rows[0]._mapping.get('avg_2022_volume')
@@ -157,7 +289,8 @@ class QueryParser:
                 max_display_rows = 10
                 for i, row in enumerate(rows):
                     if i >= max_display_rows:
-                        response_parts.append(f"... (and {len(rows) - max_display_rows} more results. Please refine your query for specific data.)")
+                        more_rows = f"{len(rows) - max_display_rows}{'+' if truncated else ''}" # The sandbox stops fetching at its row cap
+                        response_parts.append(f"... (and {more_rows} more results. Please refine your query for specific data.)")
                         break
                     
                     row_str_parts = []
@@ -194,8 +327,17 @@ class QueryParser:
 
                     response_parts.append(" - " + ", ".join(row_str_parts))
                 
+            metrics.observe_stage("format", time.perf_counter() - format_start_time)
             return {"type": "db_response", "content": "\n".join(response_parts)}
 
+        except SQLRejectedError as e:
+            print(f"Generated SQL rejected by the sandbox: {e}")
+            print(f"Rejected SQL Query: {generated_sql}")
+            return {"type": "gemini_response", "content": "That question would need a very expensive database query. Please narrow it down, e.g. to a date range or a single metric."}
+        except SQLBudgetExceededError as e:
+            print(f"Generated SQL stopped: {e}")
+            print(f"Slow SQL Query: {generated_sql}")
+            return {"type": "gemini_response", "content": "That query took too long to run, so I stopped it. Please try a narrower question."}
         except Exception as e:
             print(f"Error executing generated SQL or formatting results: {e}")
             print(f"Failed SQL Query: {generated_sql}")
@@ -0,0 +1,160 @@
+# chatbot_service/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class LLMResponseCache:
+    """
+    Single-flight deduplication plus a small TTL cache for Gemini text responses.
+
+    Concurrent calls with the same key share one in-flight API call: the first caller makes it,
+    the others wait for its result. Completed responses are kept for 'ttl_seconds' (at most 'max_entries',
+    least-recently-used evicted first). Keys include the data version, so an ingest that bumps it
+    makes every earlier answer unreachable.
+
+    The in-flight futures belong to the running event loop, so use one instance per loop (i.e. per process).
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict() # key -> (created_at, text)
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(model: str, call_type: str, prompt: str, data_version: int, context: str = "") -> str:
+        """'context' covers anything else the answer depends on, e.g. a fingerprint of the chat history."""
+        key_parts = json.dumps([model, call_type, data_version, context, prompt])
+        return hashlib.sha256(key_parts.encode("utf-8")).hexdigest()
+
+    # --- Completed responses ---
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._entries[key] = (time.time(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # --- Single flight ---
+    async def _join(self, key: str) -> str | None:
+        """
+        Waits for an identical in-flight call, if there is one.
+        Returns its text, or None if there was none or the leader gave up (e.g. its client disconnected).
+        """
+        future = self._in_flight.get(key)
+        if future is None:
+            return None
+        self.coalesced += 1
+        # shield: one waiter being cancelled must not cancel the shared result for everyone else
+        return await asyncio.shield(future)
+
+    def _lead(self, key: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        return future
+
+    def _finish(self, key: str, future: asyncio.Future, text: str | None = None, error: Exception | None = None):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            future.exception() # Mark as retrieved; nobody may be waiting on it
+        else:
+            future.set_result(text)
+
+    async def get_or_call(self, key: str, call) -> str:
+        """Returns the cached text for 'key', joins an identical in-flight call, or runs 'call()' (an async function)."""
+        while True:
+            text = self.get(key)
+            if text is not None:
+                return text
+            text = await self._join(key)
+            if text is not None:
+                return text
+            if key not in self._in_flight:
+                break
+
+        future = self._lead(key)
+        try:
+            text = await call()
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        except BaseException:
+            self._finish(key, future) # Cancelled: waiters get None and make their own call
+            raise
+        self.put(key, text)
+        self._finish(key, future, text)
+        return text
+
+    async def get_or_stream(self, key: str, stream):
+        """
+        Streaming version of get_or_call. 'stream()' returns an async iterator of text chunks.
+        Cached or coalesced answers are yielded as a single chunk; the full text is only cached if the stream completed.
+        """
+        while True:
+            text = self.get(key)
+            if text is None:
+                text = await self._join(key)
+            if text is not None:
+                yield text
+                return
+            if key not in self._in_flight:
+                break
+
+        future = self._lead(key)
+        parts = []
+        completed = False
+        try:
+            async for chunk in stream():
+                parts.append(chunk)
+                yield chunk
+            completed = True
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        finally:
+            if completed:
+                text = "".join(parts)
+                self.put(key, text)
+                self._finish(key, future, text)
+            else:
+                # Cancelled or closed early by the consumer: waiters get None and make their own call
+                self._finish(key, future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
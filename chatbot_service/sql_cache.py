@@ -0,0 +1,239 @@
+# chatbot_service/sql_cache.py
+
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+SQL_CACHE_FILE = "sql_cache.db"
+
+# Words that carry no meaning for the SQL we'd generate
+STOP_WORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "during", "at", "to", "and", "by", "from",
+    "what", "whats", "was", "were", "is", "are", "be", "been", "did", "does", "do",
+    "me", "show", "tell", "give", "please", "can", "you", "i", "want", "know", "find",
+    "tesla", "tsla", "stock", "stocks", "value", "values", "data", "get", "price", "prices",
+}
+
+# Different ways users spell the same thing. Everything is mapped onto one canonical token.
+SYNONYMS = {
+    "avg": "average", "mean": "average",
+    "vol": "volume", "volumes": "volume",
+    "max": "max", "maximum": "max", "highest": "max", "peak": "max", "largest": "max", "biggest": "max",
+    "min": "min", "minimum": "min", "lowest": "min", "smallest": "min",
+    "closing": "close", "closed": "close", "closes": "close",
+    "opening": "open", "opened": "open", "opens": "open",
+    "highs": "high", "lows": "low",
+    "number": "count", "many": "count", "total": "count",
+    "days": "day", "signals": "signal", "longs": "long", "shorts": "short",
+    "jan": "january", "feb": "february", "mar": "march", "apr": "april", "jun": "june", "jul": "july",
+    "aug": "august", "sep": "september", "sept": "september", "oct": "october", "nov": "november", "dec": "december",
+}
+
+MONTHS = {
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+}
+
+# Tokens that change the meaning of the SQL. Two questions only count as "similar"
+# if they agree on all of these (otherwise "average volume 2022" would answer "average volume 2023").
+AGGREGATES = {"average", "max", "min", "count", "sum"}
+COLUMN_WORDS = {"open", "high", "low", "close", "volume", "long", "short", "support", "resistance"}
+# Negations and comparisons flip or bound a filter ("close not above 200", "between X and Y")
+CONDITION_WORDS = {"not", "no", "above", "below", "before", "after", "between", "over", "under", "than"}
+
+# ISO dates stay one token, so "2024-05-01" and "2024-01-05" can't look alike
+_TOKEN_RE = re.compile(r"\d{4}-\d{2}-\d{2}|[a-z]+|\d+(?:\.\d+)?")
+
+
+def normalize_query(user_query: str) -> list[str]:
+    """Lowercases, strips punctuation and stop words, and canonicalizes synonyms."""
+    tokens = _TOKEN_RE.findall(user_query.lower())
+    return [SYNONYMS.get(token, token) for token in tokens if token not in STOP_WORDS]
+
+
+def _critical_tokens(tokens: list[str]) -> tuple:
+    """
+    What two questions must agree on to share SQL: the dates, numbers, months and condition words in the order they
+    appear (so swapped range bounds or a moved "not" differ), and the set of aggregates and columns.
+    """
+    ordered = tuple(token for token in tokens if token[0].isdigit() or token in MONTHS or token in CONDITION_WORDS)
+    unordered = frozenset(token for token in tokens if token in AGGREGATES or token in COLUMN_WORDS)
+    return ordered, unordered
+
+
+class SQLTranslationCache:
+    """
+    Persistent natural language -> SQL cache that sits in front of the Text-to-SQL Gemini call.
+
+    Lookups try an exact match on the normalized question first, then a TF-IDF cosine similarity
+    search over previously answered questions (only accepted above 'similarity_threshold' and when
+    dates, numbers, months and condition words match in order, and aggregates and column words match exactly).
+    Entries are evicted least-recently-used beyond 'max_entries' and expire after 'ttl_seconds'.
+    Each entry is tagged with a schema fingerprint so a changed schema prompt never reuses old SQL.
+    Hits only update the LRU order in memory; their 'last_used' times are written with the next store() or flush()
+    (call it on shutdown), so a lookup never writes to disk.
+    """
+
+    def __init__(self, db_file: str = SQL_CACHE_FILE, max_entries: int = 1000,
+                 ttl_seconds: float = 7 * 24 * 3600, similarity_threshold: float = 0.9):
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        # normalized key -> {"tokens", "sql", "schema", "created_at"}; order = least recently used first
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._index = None # Lazily (re)built TF-IDF index, see _build_index
+        self._unsaved_last_used: dict[str, float] = {} # query_key -> last hit not yet written to disk
+
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS nl_sql_cache ("
+            " query_key TEXT PRIMARY KEY, sql TEXT NOT NULL, schema_fingerprint TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        """Loads unexpired entries from disk, oldest use first so the LRU order survives restarts."""
+        cutoff = time.time() - self.ttl_seconds
+        self._conn.execute("DELETE FROM nl_sql_cache WHERE created_at < ?", (cutoff,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT query_key, sql, schema_fingerprint, created_at FROM nl_sql_cache ORDER BY last_used"
+        ).fetchall()
+        for query_key, sql, schema_fingerprint, created_at in rows[-self.max_entries:]:
+            self._entries[query_key] = {
+                "tokens": query_key.split(), "sql": sql, "schema": schema_fingerprint, "created_at": created_at,
+            }
+
+    def _build_index(self):
+        """Builds a TF-IDF matrix (rows L2-normalized) over all cached questions."""
+        keys = list(self._entries.keys())
+        document_frequency = Counter()
+        for key in keys:
+            document_frequency.update(set(self._entries[key]["tokens"]))
+
+        vocabulary = {token: i for i, token in enumerate(document_frequency)}
+        idf = np.zeros(len(vocabulary))
+        for token, i in vocabulary.items():
+            idf[i] = math.log((1 + len(keys)) / (1 + document_frequency[token])) + 1
+
+        matrix = np.zeros((len(keys), len(vocabulary)))
+        for row, key in enumerate(keys):
+            for token, count in Counter(self._entries[key]["tokens"]).items():
+                matrix[row, vocabulary[token]] = count * idf[vocabulary[token]]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        self._index = (keys, vocabulary, idf, matrix)
+
+    def _vectorize(self, tokens: list[str]) -> np.ndarray:
+        _, vocabulary, idf, _ = self._index
+        vector = np.zeros(len(vocabulary))
+        for token, count in Counter(tokens).items():
+            if token in vocabulary:
+                vector[vocabulary[token]] = count * idf[vocabulary[token]]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _is_live(self, entry: dict, schema_fingerprint: str) -> bool:
+        return entry["schema"] == schema_fingerprint and time.time() - entry["created_at"] <= self.ttl_seconds
+
+    def _touch(self, query_key: str):
+        self._entries.move_to_end(query_key)
+        self._unsaved_last_used[query_key] = time.time()
+
+    def _write_last_used(self):
+        """Writes the pending hit times; the caller commits. Must hold the lock."""
+        if self._unsaved_last_used:
+            self._conn.executemany("UPDATE nl_sql_cache SET last_used = ? WHERE query_key = ?",
+                                   [(last_used, query_key) for query_key, last_used in self._unsaved_last_used.items()])
+            self._unsaved_last_used.clear()
+
+    def flush(self):
+        """Persists the LRU order of recent hits, so it survives a restart."""
+        with self._lock:
+            if self._unsaved_last_used:
+                self._write_last_used()
+                self._conn.commit()
+
+    def lookup(self, user_query: str, schema_fingerprint: str) -> str | None:
+        """Returns cached SQL for this question (or a sufficiently similar one), or None on a miss."""
+        tokens = normalize_query(user_query)
+        query_key = " ".join(tokens)
+        if not query_key:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(query_key)
+            if entry is not None and self._is_live(entry, schema_fingerprint):
+                self._touch(query_key)
+                self.exact_hits += 1
+                return entry["sql"]
+
+            if self._entries:
+                if self._index is None:
+                    self._build_index()
+                keys, _, _, matrix = self._index
+                scores = matrix @ self._vectorize(tokens)
+                critical = _critical_tokens(tokens)
+                # Best candidates first; stop at the first one that passes every check
+                for row in np.argsort(scores)[::-1]:
+                    if scores[row] < self.similarity_threshold:
+                        break
+                    candidate = self._entries.get(keys[row])
+                    if candidate is None or not self._is_live(candidate, schema_fingerprint):
+                        continue
+                    if _critical_tokens(candidate["tokens"]) != critical:
+                        continue
+                    self._touch(keys[row])
+                    self.similar_hits += 1
+                    return candidate["sql"]
+
+            self.misses += 1
+            return None
+
+    def store(self, user_query: str, sql: str, schema_fingerprint: str):
+        """Remembers the SQL that successfully answered this question."""
+        tokens = normalize_query(user_query)
+        query_key = " ".join(tokens)
+        if not query_key:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._entries[query_key] = {"tokens": tokens, "sql": sql, "schema": schema_fingerprint, "created_at": now}
+            self._entries.move_to_end(query_key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO nl_sql_cache (query_key, sql, schema_fingerprint, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (query_key, sql, schema_fingerprint, now, now),
+            )
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._unsaved_last_used.pop(evicted_key, None)
+                self._conn.execute("DELETE FROM nl_sql_cache WHERE query_key = ?", (evicted_key,))
+            self._write_last_used()
+            self._conn.commit()
+            self._index = None # Rebuilt on the next similarity lookup
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,208 @@
+# chatbot_service/sql_sandbox.py
+
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from sqlalchemy.orm import Session
+
+import metrics
+
+
+class SQLRejectedError(ValueError):
+    """Generated SQL failed a static or query-plan check and was not run."""
+
+
+class SQLBudgetExceededError(RuntimeError):
+    """Generated SQL was interrupted because it ran past its time budget."""
+
+
+class SandboxResult(NamedTuple):
+    columns: list[str]
+    rows: list # SQLAlchemy Row objects, at most max_rows of them
+    truncated: bool # True if the query had more rows than max_rows
+    seconds: float
+
+
+# Full scans of these are fine on their own, they are not real tables
+_NON_TABLE_SCANS = ("CONSTANT ROW", "(", "SUBQUERY")
+
+
+def _is_full_table_scan(detail: str) -> bool:
+    """
+    SQLite reports a walk over every row as 'SCAN t' (possibly 'USING COVERING INDEX', which is still every row),
+    and an indexed lookup as 'SEARCH t USING ...'.
+    """
+    return detail.startswith("SCAN ") and not detail[len("SCAN "):].startswith(_NON_TABLE_SCANS)
+
+
+class SQLSandbox:
+    """
+    Bounded execution of SQL we didn't write (Text-to-SQL output).
+
+    Before running, the statement must be a single SELECT/WITH, and its EXPLAIN QUERY PLAN is checked for
+    shapes whose cost grows multiplicatively with the table size: two full table scans joined in the same
+    loop (e.g. a cross join without a usable index), or a full scan inside a correlated subquery.
+    Verdicts are cached per SQL text (cached SQL from the NL->SQL cache repeats exactly, and SQLite's
+    per-connection statement cache then also reuses the compiled statement).
+
+    While running, SQLite's progress handler aborts the statement once it exceeds 'time_budget_seconds',
+    and rows are pulled with fetchmany() up to 'max_rows', so neither a slow query nor a huge result
+    can tie up a worker thread or its memory for long.
+    """
+
+    def __init__(self, max_rows: int = 100, time_budget_seconds: float = 2.0, fetch_batch: int = 50,
+                 progress_interval: int = 1000, plan_cache_size: int = 256):
+        self.max_rows = max_rows
+        self.time_budget_seconds = time_budget_seconds
+        self.fetch_batch = fetch_batch
+        self.progress_interval = progress_interval # SQLite VM instructions between deadline checks
+        self.plan_cache_size = plan_cache_size
+
+        self._plan_verdicts: OrderedDict = OrderedDict() # sql -> None (ok) or rejection reason
+        self._lock = threading.Lock()
+
+        self.executed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.truncated = 0
+        self.plan_cache_hits = 0
+
+    # --- Checks ---
+    @staticmethod
+    def _normalize(sql: str) -> str:
+        sql = sql.strip()
+        while sql.endswith(";"):
+            sql = sql[:-1].rstrip()
+        return sql
+
+    @staticmethod
+    def _static_check(sql: str) -> str | None:
+        if not re.match(r"(?is)^\s*(SELECT|WITH)\b", sql):
+            return "only SELECT statements are allowed"
+        if ";" in sql:
+            return "multiple statements are not allowed"
+        return None
+
+    @staticmethod
+    def _plan_check(plan_rows: list[tuple]) -> str | None:
+        """
+        plan_rows are EXPLAIN QUERY PLAN rows: (id, parent, notused, detail).
+        Loops that are siblings under one parent are nested in the join, so two full scans there multiply.
+        """
+        full_scans_by_parent = {}
+        details_by_id = {}
+        parents_by_id = {}
+        for node_id, parent_id, _, detail in plan_rows:
+            details_by_id[node_id] = detail
+            parents_by_id[node_id] = parent_id
+            if _is_full_table_scan(detail):
+                full_scans_by_parent.setdefault(parent_id, []).append(detail)
+
+        for parent_id, scans in full_scans_by_parent.items():
+            if len(scans) > 1:
+                return f"the query would join full table scans ({'; '.join(scans)})"
+            # Walk up: a full scan under a correlated subquery runs once per outer row
+            ancestor = parent_id
+            while ancestor in details_by_id:
+                if details_by_id[ancestor].startswith("CORRELATED"):
+                    return f"the query would run a full table scan per row ({scans[0]})"
+                ancestor = parents_by_id[ancestor]
+        return None
+
+    def check(self, conn, sql: str) -> str | None:
+        """
+        Returns why 'sql' may not run, or None if it may. 'conn' is a SQLAlchemy Connection.
+        SQL that SQLite can't even plan (e.g. an unknown column) raises the database error as-is.
+        """
+        with self._lock:
+            if sql in self._plan_verdicts:
+                self._plan_verdicts.move_to_end(sql)
+                self.plan_cache_hits += 1
+                return self._plan_verdicts[sql]
+
+        reason = self._static_check(sql)
+        if reason is None:
+            plan_rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            reason = self._plan_check(plan_rows)
+
+        with self._lock:
+            self._plan_verdicts[sql] = reason
+            while len(self._plan_verdicts) > self.plan_cache_size:
+                self._plan_verdicts.popitem(last=False)
+        return reason
+
+    # --- Execution ---
+    def execute(self, db: Session, sql: str) -> SandboxResult:
+        """
+        Checks and runs 'sql' on the session's connection.
+        Raises SQLRejectedError or SQLBudgetExceededError; other database errors propagate unchanged.
+        """
+        sql = self._normalize(sql)
+        conn = db.connection()
+        with metrics.stage("sql_plan"):
+            reason = self.check(conn, sql)
+        if reason is not None:
+            with self._lock:
+                self.rejected += 1
+            raise SQLRejectedError(reason)
+
+        raw_connection = conn.connection.dbapi_connection
+        start_time = time.perf_counter()
+        deadline = start_time + self.time_budget_seconds
+
+        def over_budget():
+            return 1 if time.perf_counter() > deadline else 0 # Non-zero makes SQLite abort with "interrupted"
+
+        raw_connection.set_progress_handler(over_budget, self.progress_interval)
+        try:
+            # SQLite runs the statement up to its first row on execute; fetching steps through the rest
+            with metrics.stage("sql_exec"):
+                result = conn.exec_driver_sql(sql)
+            columns = list(result.keys())
+            rows = []
+            with metrics.stage("sql_fetch"):
+                while len(rows) <= self.max_rows:
+                    batch = result.fetchmany(min(self.fetch_batch, self.max_rows + 1 - len(rows)))
+                    if not batch:
+                        break
+                    rows.extend(batch)
+                result.close()
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e).lower():
+                with self._lock:
+                    self.timed_out += 1
+                raise SQLBudgetExceededError(f"query exceeded its {self.time_budget_seconds}s budget") from e
+            raise
+        except Exception as e:
+            # SQLAlchemy wraps DBAPI errors; unwrap the interrupt case the same way
+            if "interrupted" in str(getattr(e, "orig", "")).lower():
+                with self._lock:
+                    self.timed_out += 1
+                raise SQLBudgetExceededError(f"query exceeded its {self.time_budget_seconds}s budget") from e
+            raise
+        finally:
+            raw_connection.set_progress_handler(None, 0)
+
+        truncated = len(rows) > self.max_rows
+        with self._lock:
+            self.executed += 1
+            if truncated:
+                self.truncated += 1
+        return SandboxResult(columns, rows[:self.max_rows], truncated, time.perf_counter() - start_time)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "truncated": self.truncated,
+                "plan_cache_entries": len(self._plan_verdicts),
+                "plan_cache_hits": self.plan_cache_hits,
+                "max_rows": self.max_rows,
+                "time_budget_seconds": self.time_budget_seconds,
+            }
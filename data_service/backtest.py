@@ -0,0 +1,288 @@
+# data_service/backtest.py
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import NamedTuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sqlalchemy.orm import Session
+
+import models
+from .stock_query import fetch_stock_rows
+
+ENTRY_MODES = ("next_open", "close")
+SWEEP_SORT_KEYS = ("total_return", "hit_rate", "max_drawdown", "profit_factor", "trades")
+# Parameter combinations per task sent to a sweep worker process
+SWEEP_CHUNK_SIZE = 250
+
+
+class BacktestParams(NamedTuple):
+    """
+    Rules for trading the 'direction' signals. Percentages are in percent (1.5 means 1.5%).
+    A signal on bar t enters at the open of bar t+1 ('next_open') or at the close of bar t ('close').
+    A trade exits at the first of: stop-loss, take-profit (both checked against each bar's low/high),
+    an opposite signal (at that bar's close, if 'exit_on_opposite') or the close of its 'hold_bars'-th bar.
+    Only one position is open at a time; signals during an open trade are ignored.
+    """
+    entry: str = "next_open"
+    hold_bars: int = 10
+    stop_loss_pct: float | None = None
+    take_profit_pct: float | None = None
+    fee_pct: float = 0.0 # Charged on entry and on exit
+    allow_short: bool = True # False: SHORT signals are ignored instead of opening short trades
+    exit_on_opposite: bool = True
+
+    def validate(self):
+        if self.entry not in ENTRY_MODES:
+            raise ValueError(f"entry must be one of {', '.join(ENTRY_MODES)}.")
+        if self.hold_bars < 1:
+            raise ValueError("hold_bars must be at least 1.")
+        for name in ("stop_loss_pct", "take_profit_pct", "fee_pct"):
+            value = getattr(self, name)
+            if value is not None and not 0 <= value < 100:
+                raise ValueError(f"{name} must be between 0 and 100.")
+
+
+class Bars(NamedTuple):
+    time: list[str] # ISO dates
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    signal: np.ndarray # 1 = LONG, -1 = SHORT, 0 = no signal
+
+
+def load_bars(db: Session, start: date | None = None, end: date | None = None, symbol: str = models.DEFAULT_SYMBOL) -> Bars:
+    """Daily OHLC and signals of 'symbol' for [start, end], ordered by date."""
+    rows = fetch_stock_rows(db, start=start, end=end, symbol=symbol)
+    if not rows:
+        return Bars([], *[np.empty(0) for _ in range(4)], np.empty(0, dtype=np.int8))
+    columns = list(zip(*rows))
+    signal = np.array([1 if d == "LONG" else -1 if d == "SHORT" else 0 for d in columns[6]], dtype=np.int8)
+    return Bars(list(columns[0]), *[np.asarray(columns[i], dtype=float) for i in (1, 2, 3, 4)], signal)
+
+
+# --- Simulation ---
+def _first_true(mask: np.ndarray) -> np.ndarray:
+    """Column of the first True in each row, or the row length if there is none."""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def simulate_trades(bars: Bars, params: BacktestParams) -> dict[str, np.ndarray]:
+    """
+    Evaluates the trade every signal would produce in one vectorized pass over (signal x holding window) arrays,
+    then keeps the trades that don't overlap an earlier one (a short loop over trades, not bars).
+    Returns per-trade arrays: entry_index, exit_index, side, entry_price, exit_price, exit_reason, net_return.
+    """
+    n = len(bars.close)
+    hold = params.hold_bars
+    tradable = bars.signal != 0 if params.allow_short else bars.signal == 1
+    signal_index = np.flatnonzero(tradable)
+
+    if params.entry == "next_open":
+        entry_index = signal_index + 1
+        first_bar = entry_index # The entry bar's own range happens after the open
+    else:
+        entry_index = signal_index
+        first_bar = entry_index + 1
+    valid = first_bar < n
+    signal_index, entry_index, first_bar = signal_index[valid], entry_index[valid], first_bar[valid]
+    side = bars.signal[signal_index].astype(float)
+    entry_price = bars.open[entry_index] if params.entry == "next_open" else bars.close[entry_index]
+
+    # Holding windows: row i = bars first_bar[i] .. first_bar[i] + hold - 1, NaN past the end of the data
+    def windows(values):
+        padded = np.concatenate([values.astype(float), np.full(hold, np.nan)])
+        return sliding_window_view(padded, hold)[first_bar]
+
+    open_w, high_w, low_w, close_w, signal_w = (windows(a) for a in (bars.open, bars.high, bars.low, bars.close, bars.signal))
+    side_col = side[:, None]
+    adverse = np.where(side_col > 0, low_w, high_w) # The side of each bar that moves against the position
+    favorable = np.where(side_col > 0, high_w, low_w)
+
+    no_hit = np.full(len(side), hold)
+    stop_offset = take_offset = opposite_offset = no_hit
+    if params.stop_loss_pct is not None:
+        stop_price = entry_price * (1 - side * params.stop_loss_pct / 100)
+        stop_offset = _first_true(side_col * (adverse - stop_price[:, None]) <= 0)
+    if params.take_profit_pct is not None:
+        take_price = entry_price * (1 + side * params.take_profit_pct / 100)
+        take_offset = _first_true(side_col * (favorable - take_price[:, None]) >= 0)
+    if params.exit_on_opposite:
+        opposite_offset = _first_true(signal_w == -side_col)
+    time_offset = np.minimum(hold, n - first_bar) - 1 # Last bar of the window that exists
+
+    # Earliest exit wins; on the same bar the stop is assumed to fill first (conservative)
+    exit_offset = np.minimum.reduce([stop_offset, take_offset, opposite_offset, time_offset])
+    exit_reason = np.select(
+        [stop_offset == exit_offset, take_offset == exit_offset, opposite_offset == exit_offset],
+        ["stop_loss", "take_profit", "opposite_signal"], default="time",
+    )
+    rows = np.arange(len(side))
+    bar_open = open_w[rows, exit_offset] if len(side) else np.empty(0)
+    exit_price = close_w[rows, exit_offset] if len(side) else np.empty(0)
+    if params.stop_loss_pct is not None:
+        # A gap through the stop fills at the open, not at the stop price
+        stop_fill = np.where(side > 0, np.minimum(bar_open, stop_price), np.maximum(bar_open, stop_price))
+        exit_price = np.where(exit_reason == "stop_loss", stop_fill, exit_price)
+    if params.take_profit_pct is not None:
+        take_fill = np.where(side > 0, np.maximum(bar_open, take_price), np.minimum(bar_open, take_price))
+        exit_price = np.where(exit_reason == "take_profit", take_fill, exit_price)
+    exit_index = first_bar + exit_offset
+
+    fee = params.fee_pct / 100
+    net_return = (1 + side * (exit_price / entry_price - 1)) * (1 - fee) ** 2 - 1
+
+    # One position at a time. Entries at a close may reuse the bar a trade just exited on (a reversal).
+    entry_moment = entry_index * 2 + (1 if params.entry == "close" else 0)
+    exit_moment = exit_index * 2 + 1
+    taken = []
+    busy_until = -1
+    for i in range(len(side)):
+        if entry_moment[i] >= busy_until:
+            taken.append(i)
+            busy_until = exit_moment[i]
+    taken = np.asarray(taken, dtype=int)
+
+    return {
+        "entry_index": entry_index[taken], "exit_index": exit_index[taken], "side": side[taken].astype(int),
+        "entry_price": entry_price[taken], "exit_price": exit_price[taken],
+        "exit_reason": exit_reason[taken], "net_return": net_return[taken],
+    }
+
+
+def summarize(n_bars: int, trades: dict[str, np.ndarray]) -> tuple[dict, np.ndarray, np.ndarray]:
+    """Summary statistics plus the per-bar equity curve (compounded at each exit) and its drawdown."""
+    returns = trades["net_return"]
+    growth = np.ones(n_bars)
+    np.multiply.at(growth, trades["exit_index"], 1 + returns)
+    equity = np.cumprod(growth)
+    drawdown = equity / np.maximum.accumulate(equity) - 1 if n_bars else np.empty(0)
+
+    gains, losses = returns[returns > 0].sum(), -returns[returns < 0].sum()
+    summary = {
+        "trades": int(len(returns)),
+        "hit_rate": float((returns > 0).mean()) if len(returns) else 0.0,
+        "total_return": float(equity[-1] - 1) if n_bars else 0.0,
+        "max_drawdown": float(drawdown.min()) if n_bars else 0.0,
+        "avg_trade_return": float(returns.mean()) if len(returns) else 0.0,
+        "profit_factor": float(gains / losses) if losses > 0 else None,
+    }
+    return summary, equity, drawdown
+
+
+def run_backtest(bars: Bars, params: BacktestParams, include_trades: bool = True) -> dict:
+    """Backtests 'params' over 'bars'. The result is JSON-serializable."""
+    params.validate()
+    trades = simulate_trades(bars, params)
+    summary, equity, drawdown = summarize(len(bars.close), trades)
+    result = {"params": params._asdict(), "summary": summary}
+    if include_trades:
+        result["trades"] = [
+            {
+                "entry_time": bars.time[entry], "exit_time": bars.time[exit_],
+                "side": "LONG" if side > 0 else "SHORT",
+                "entry_price": float(entry_price), "exit_price": float(exit_price),
+                "exit_reason": str(reason), "return": float(net_return),
+            }
+            for entry, exit_, side, entry_price, exit_price, reason, net_return in zip(
+                trades["entry_index"], trades["exit_index"], trades["side"], trades["entry_price"],
+                trades["exit_price"], trades["exit_reason"], trades["net_return"],
+            )
+        ]
+        result["equity_curve"] = {"time": bars.time, "equity": equity.tolist(), "drawdown": drawdown.tolist()}
+    return result
+
+
+# --- Parameter Sweeps ---
+_worker_bars: Bars | None = None
+
+def _init_sweep_worker(bars: Bars):
+    # Each worker receives the bars once, instead of with every task
+    global _worker_bars
+    _worker_bars = bars
+
+def _run_sweep_chunk(param_chunk: list[BacktestParams]) -> list[dict]:
+    results = []
+    for params in param_chunk:
+        summary, _, _ = summarize(len(_worker_bars.close), simulate_trades(_worker_bars, params))
+        results.append({**params._asdict(), **summary})
+    return results
+
+
+def expand_grid(grid: dict[str, list]) -> list[BacktestParams]:
+    """Every combination of the values in 'grid' ({param name: [values]}); unlisted params keep their defaults."""
+    unknown = [name for name in grid if name not in BacktestParams._fields]
+    if unknown:
+        raise ValueError(f"Unknown backtest parameters: {', '.join(unknown)}.")
+    combos = [BacktestParams(**dict(zip(grid, values))) for values in itertools.product(*grid.values())]
+    for params in combos:
+        params.validate()
+    return combos
+
+
+def run_sweep(bars: Bars, combos: list[BacktestParams], processes: int | None = None,
+              sort_by: str = "total_return", top: int = 20) -> dict:
+    """
+    Backtests every parameter combination and returns the 'top' ones by 'sort_by' (drawdown: least negative first).
+    Large sweeps are split into chunks across a process pool (one worker per core by default);
+    small ones run in this process, where starting workers would cost more than it saves.
+    """
+    if sort_by not in SWEEP_SORT_KEYS:
+        raise ValueError(f"sort_by must be one of {', '.join(SWEEP_SORT_KEYS)}.")
+    start_time = time.perf_counter()
+    chunks = [combos[i:i + SWEEP_CHUNK_SIZE] for i in range(0, len(combos), SWEEP_CHUNK_SIZE)]
+    processes = processes or os.cpu_count() or 1
+    results = []
+    if len(chunks) <= 1 or processes == 1:
+        _init_sweep_worker(bars)
+        for chunk in chunks:
+            results.extend(_run_sweep_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks)), initializer=_init_sweep_worker, initargs=(bars,)) as pool:
+            for chunk_results in pool.map(_run_sweep_chunk, chunks):
+                results.extend(chunk_results)
+
+    results.sort(key=lambda result: result[sort_by] if result[sort_by] is not None else float("-inf"), reverse=True)
+    elapsed = time.perf_counter() - start_time
+    return {
+        "combinations": len(combos),
+        "seconds": round(elapsed, 3),
+        "combinations_per_sec": round(len(combos) / elapsed, 1) if elapsed > 0 else None,
+        "sort_by": sort_by,
+        "results": results[:top],
+    }
+
+
+# --- Command Line Interface ---
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Sweep backtest parameters over the stored signals.")
+    arg_parser.add_argument("--hold-bars", type=int, nargs="+", default=[1, 2, 3, 5, 10, 20])
+    arg_parser.add_argument("--stop-loss", type=float, nargs="+", default=[1, 2, 3, 5, 8])
+    arg_parser.add_argument("--take-profit", type=float, nargs="+", default=[2, 4, 6, 10, 15])
+    arg_parser.add_argument("--fee", type=float, nargs="+", default=[0.05])
+    arg_parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: one per core)")
+    arg_parser.add_argument("--sort-by", choices=SWEEP_SORT_KEYS, default="total_return")
+    arg_parser.add_argument("--top", type=int, default=10)
+    cli_args = arg_parser.parse_args()
+
+    db = models.SessionLocal()
+    try:
+        sweep_bars = load_bars(db)
+    finally:
+        db.close()
+    sweep_combos = expand_grid({
+        "entry": list(ENTRY_MODES), "hold_bars": cli_args.hold_bars, "stop_loss_pct": cli_args.stop_loss,
+        "take_profit_pct": cli_args.take_profit, "fee_pct": cli_args.fee,
+        "allow_short": [True, False], "exit_on_opposite": [True, False],
+    })
+    sweep = run_sweep(sweep_bars, sweep_combos, processes=cli_args.processes, sort_by=cli_args.sort_by, top=cli_args.top)
+    print(f"{sweep['combinations']} combinations over {len(sweep_bars.close)} bars in {sweep['seconds']}s "
+          f"({sweep['combinations_per_sec']} combinations/sec)")
+    for result in sweep["results"]:
+        print(result)
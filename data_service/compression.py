@@ -0,0 +1,85 @@
+# data_service/compression.py
+
+import gzip
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder, IdentityResponder
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import brotli # Optional: without it responses are gzip-compressed only
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # Good ratio at roughly gzip speed; 11 is far slower for a few percent more
+
+
+def accepted_encodings(accept_encoding: str | None) -> set[str]:
+    """Codings listed in an Accept-Encoding header, minus any sent with q=0."""
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(coding.lower())
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str | None) -> str:
+    """Best content coding we can produce for the request: 'br', 'gzip' or 'identity'."""
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in encodings:
+        return "br"
+    if "gzip" in encodings:
+        return "gzip"
+    return "identity"
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    """Encodes a whole payload with a coding returned by negotiate_encoding()."""
+    if encoding == "br":
+        return brotli.compress(payload, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(payload, compresslevel=GZIP_LEVEL, mtime=0) # mtime=0 keeps the bytes stable across calls
+    return payload
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        # flush() after each chunk so streamed responses (e.g. /api/export) reach the client as they are produced
+        compressed = self.compressor.process(body) + self.compressor.flush()
+        if not more_body:
+            compressed += self.compressor.finish()
+        return compressed
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Starlette's GZipMiddleware plus brotli when the client accepts it and the brotli package is installed.
+    Responses that already carry a Content-Encoding (like the precompressed /api/stock_data payloads) and
+    event streams are passed through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=GZIP_LEVEL)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("Accept-Encoding"))
+        if encoding == "br":
+            responder = BrotliResponder(self.app, self.minimum_size)
+        elif encoding == "gzip":
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+        else:
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
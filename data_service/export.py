@@ -0,0 +1,109 @@
+# data_service/export.py
+
+import csv
+import hashlib
+import io
+import json
+from datetime import date, timedelta
+from typing import Iterator
+
+from sqlalchemy import select
+
+import models
+from models import IntradayBar, StockData
+from .stock_query import STOCK_FIELDS, FIELD_NAMES, _epoch_seconds
+
+# --- ETags ---
+
+def make_etag(version: int, key: tuple, encoding: str = "identity") -> str:
+    """
+    Strong ETag for a response built from 'key' (the request parameters) at data version 'version'.
+    It changes whenever anything is ingested, so clients revalidate with If-None-Match and get a 304
+    without the server reading a single bar. Each content coding gets its own tag, as strong ETags must.
+    """
+    digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).hexdigest()
+    suffix = "" if encoding == "identity" else f"-{encoding}"
+    return f'"{version}-{digest}{suffix}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so a W/ prefix added by a proxy still matches."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+
+# --- Streaming export ---
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_SOURCES = ["daily", "intraday"]
+INTRADAY_EXPORT_FIELDS = ["ts", "open", "high", "low", "close", "volume"]
+
+# Rows fetched from SQLite and encoded per chunk; memory use is bounded by this, not by the size of the range
+EXPORT_BATCH_ROWS = 5000
+
+
+def _export_statements(db, symbol: str, source: str, start: date | None, end: date | None) -> tuple[list[str], list]:
+    """Field names and the SELECTs that produce the export, in time order."""
+    if source == "intraday":
+        stmt = select(IntradayBar.ts, IntradayBar.open_price, IntradayBar.high_price, IntradayBar.low_price,
+                      IntradayBar.close_price, IntradayBar.volume).where(IntradayBar.symbol == symbol)
+        if start is not None:
+            stmt = stmt.where(IntradayBar.ts >= _epoch_seconds(start))
+        if end is not None:
+            stmt = stmt.where(IntradayBar.ts < _epoch_seconds(end + timedelta(days=1)))
+        return INTRADAY_EXPORT_FIELDS, [stmt.order_by(IntradayBar.ts)]
+
+    if symbol == models.DEFAULT_SYMBOL:
+        stmt = select(*[column for _, column in STOCK_FIELDS])
+        timestamp = StockData.timestamp
+        if start is not None:
+            stmt = stmt.where(timestamp >= start)
+        if end is not None:
+            stmt = stmt.where(timestamp <= end)
+        return FIELD_NAMES, [stmt.order_by(timestamp)]
+
+    statements = []
+    for year in models.get_symbol_years(db, symbol) or []:
+        if (start is not None and year < start.year) or (end is not None and year > end.year):
+            continue
+        table = models.partition_table(year)
+        stmt = select(*[table.c[column.key] for _, column in STOCK_FIELDS]).where(table.c.symbol == symbol)
+        if start is not None:
+            stmt = stmt.where(table.c.timestamp >= start)
+        if end is not None:
+            stmt = stmt.where(table.c.timestamp <= end)
+        statements.append(stmt.order_by(table.c.timestamp))
+    return FIELD_NAMES, statements
+
+
+def _encode_csv(rows, field_names: list[str] | None = None) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if field_names:
+        writer.writerow(field_names)
+    writer.writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def iter_export(symbol: str, source: str = "daily", start: date | None = None, end: date | None = None,
+                fmt: str = "csv") -> Iterator[bytes]:
+    """
+    Yields the bars of 'symbol' in [start, end] as CSV or NDJSON chunks of up to EXPORT_BATCH_ROWS rows.
+    Rows are streamed from a server-side cursor on a read-only session of its own (the request's session is
+    closed before a streaming body is sent), so the whole range is never held in memory. The export reads one
+    consistent snapshot even if an ingest commits halfway through.
+    """
+    with models.ReadOnlySessionLocal() as db:
+        field_names, statements = _export_statements(db, symbol, source, start, end)
+        if fmt == "csv":
+            yield _encode_csv([], field_names)
+        for stmt in statements:
+            for batch in db.execute(stmt.execution_options(yield_per=EXPORT_BATCH_ROWS)).partitions():
+                if source == "daily":
+                    batch = [(row[0].isoformat(),) + tuple(row[1:]) for row in batch]
+                if fmt == "csv":
+                    yield _encode_csv(batch)
+                else:
+                    yield "".join(json.dumps(dict(zip(field_names, row)), separators=(",", ":")) + "\n" for row in batch).encode("utf-8")
@@ -0,0 +1,102 @@
+# data_service/indicators.py
+
+import numpy as np
+import pandas as pd
+
+# --- Indicator Parameters ---
+SMA_WINDOWS = (20, 50, 200)
+EMA_SPANS = (12, 26)
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+BOLLINGER_WINDOW = 20
+BOLLINGER_STDDEVS = 2.0
+VWAP_WINDOW = 20 # Daily bars, so a rolling VWAP; a cumulative one would be dominated by 2022
+
+# Bars of history the rolling windows need in front of the first bar being (re)computed
+LOOKBACK_BARS = max(max(SMA_WINDOWS), BOLLINGER_WINDOW, VWAP_WINDOW) - 1
+
+# Columns of the indicators table, in output order
+INDICATOR_COLUMNS = (
+    [f"sma_{window}" for window in SMA_WINDOWS]
+    + [f"ema_{span}" for span in EMA_SPANS]
+    + [f"rsi_{RSI_PERIOD}", f"atr_{ATR_PERIOD}", "bb_middle", "bb_upper", "bb_lower", f"vwap_{VWAP_WINDOW}"]
+)
+
+# Running averages behind RSI. They are stored next to the indicators (but not served) so an append can continue them.
+RSI_STATE_COLUMNS = ["rsi_avg_gain", "rsi_avg_loss"]
+
+# Everything the recursive indicators need from the previous bar to continue the series
+STATE_COLUMNS = [f"ema_{span}" for span in EMA_SPANS] + RSI_STATE_COLUMNS + [f"atr_{ATR_PERIOD}"]
+
+
+def _ewm(values: pd.Series, alpha: float, seed: float | None = None) -> pd.Series:
+    """
+    y[t] = alpha * x[t] + (1 - alpha) * y[t-1], vectorized by pandas.
+    With a 'seed' (the previous bar's y), the recursion continues from it instead of starting at x[0].
+    """
+    if seed is None:
+        return values.ewm(alpha=alpha, adjust=False).mean()
+    seeded = pd.concat([pd.Series([seed], dtype=float), values.reset_index(drop=True)], ignore_index=True)
+    return pd.Series(seeded.ewm(alpha=alpha, adjust=False).mean().to_numpy()[1:], index=values.index)
+
+
+def compute_indicators(bars: pd.DataFrame, start: int = 0, state: dict | None = None) -> pd.DataFrame:
+    """
+    Computes every indicator for bars[start:] in one vectorized pass.
+
+    'bars' is ordered by timestamp and has high_price/low_price/close_price/volume columns.
+    bars[:start] is history for the rolling windows (at least LOOKBACK_BARS of it when appending)
+    and 'state' holds the STATE_COLUMNS of bars[start - 1], which the recursive indicators (EMA, Wilder RSI/ATR) continue from.
+    Without 'state' the series start at the first bar, and values are NULL (NaN) until their window is full.
+    Returns a frame with INDICATOR_COLUMNS + RSI_STATE_COLUMNS, indexed like bars[start:].
+    """
+    close = bars["close_price"].astype(float)
+    high = bars["high_price"].astype(float)
+    low = bars["low_price"].astype(float)
+    volume = bars["volume"].astype(float)
+    new = slice(start, None)
+    out = pd.DataFrame(index=bars.index[new])
+
+    # Rolling-window indicators over the whole frame, history included
+    for window in SMA_WINDOWS:
+        out[f"sma_{window}"] = close.rolling(window).mean().iloc[new]
+
+    middle = close.rolling(BOLLINGER_WINDOW).mean()
+    spread = BOLLINGER_STDDEVS * close.rolling(BOLLINGER_WINDOW).std(ddof=0)
+    out["bb_middle"] = middle.iloc[new]
+    out["bb_upper"] = (middle + spread).iloc[new]
+    out["bb_lower"] = (middle - spread).iloc[new]
+
+    typical_price = (high + low + close) / 3
+    vwap = (typical_price * volume).rolling(VWAP_WINDOW).sum() / volume.rolling(VWAP_WINDOW).sum()
+    out[f"vwap_{VWAP_WINDOW}"] = vwap.iloc[new]
+
+    # Recursive indicators, only over the new bars (seeded from 'state' when appending)
+    previous_close = close.shift(1)
+    true_range = np.fmax(high - low, np.fmax((high - previous_close).abs(), (low - previous_close).abs()))
+    change = (close - previous_close).iloc[new]
+    if state is None:
+        change = change.fillna(0.0) # The very first bar has no change
+    state = state or {}
+
+    for span in EMA_SPANS:
+        out[f"ema_{span}"] = _ewm(close.iloc[new], 2 / (span + 1), state.get(f"ema_{span}"))
+
+    avg_gain = _ewm(change.clip(lower=0), 1 / RSI_PERIOD, state.get("rsi_avg_gain"))
+    avg_loss = _ewm((-change).clip(lower=0), 1 / RSI_PERIOD, state.get("rsi_avg_loss"))
+    movement = avg_gain + avg_loss
+    out[f"rsi_{RSI_PERIOD}"] = np.where(movement > 0, 100 * avg_gain / movement.where(movement > 0, 1), 50.0)
+    out["rsi_avg_gain"] = avg_gain
+    out["rsi_avg_loss"] = avg_loss
+
+    out[f"atr_{ATR_PERIOD}"] = _ewm(true_range.iloc[new], 1 / ATR_PERIOD, state.get(f"atr_{ATR_PERIOD}"))
+
+    if not state:
+        # Warm-up: the first bars of a fresh series don't have enough history to mean anything yet
+        position = np.arange(len(out))
+        for span in EMA_SPANS:
+            out.loc[position < span - 1, f"ema_{span}"] = np.nan
+        out.loc[position < RSI_PERIOD, f"rsi_{RSI_PERIOD}"] = np.nan
+        out.loc[position < ATR_PERIOD - 1, f"atr_{ATR_PERIOD}"] = np.nan
+
+    return out[INDICATOR_COLUMNS + RSI_STATE_COLUMNS]
@@ -0,0 +1,260 @@
+# data_service/live_feed.py
+
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+import pandas as pd
+
+import models
+from shared_state import StateBackend
+from .stock_query import STOCK_FIELDS
+
+# Ingest row key -> field name in /api/stock_data, so live bars merge straight into the chart's data
+BAR_FIELD_KEYS = [(name, column.key) for name, column in STOCK_FIELDS]
+
+
+def encode_bars_message(symbol: str, bars: list[dict]) -> str:
+    """
+    One 'bars' message for a batch of ingested rows (dicts keyed like prepare_csv_chunk's bars),
+    columnar like /api/stock_data?format=columnar and ordered by time.
+    """
+    bars = sorted(bars, key=lambda bar: bar["timestamp"])
+    columns = {}
+    for name, key in BAR_FIELD_KEYS:
+        values = [bar.get(key) for bar in bars]
+        columns[name] = [value.isoformat() if isinstance(value, date) else value for value in values]
+    return json.dumps({"type": "bars", "symbol": symbol, "bars": columns}, separators=(",", ":"))
+
+
+# Sent instead of queued bars once a subscriber has fallen behind; the client reloads /api/stock_data
+RESYNC_MESSAGE = json.dumps({"type": "resync"}, separators=(",", ":"))
+
+
+class BarBroadcaster:
+    """
+    Fans new and updated bars out to live-chart subscribers.
+
+    Each ingest event is encoded to JSON once, on the publishing side, and the same string is queued for every
+    subscriber of that symbol, so the cost per event is one encode plus one queue put per client, with no
+    database reads at all. Queues are bounded: a subscriber that can't keep up has its backlog replaced by a
+    single 'resync' message rather than slowing down everybody else or growing without limit.
+
+    publish() may be called from any thread (ingestion runs in worker threads); delivery happens on the
+    event loop passed to bind().
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+        self.events_published = 0
+        self.messages_delivered = 0
+        self.resyncs = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    # --- Subscriptions (event loop only) ---
+    def subscribe(self, symbol: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[symbol].add(queue)
+        return queue
+
+    def unsubscribe(self, symbol: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(symbol)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[symbol]
+
+    # --- Publishing ---
+    def publish(self, symbol: str, bars: list[dict]):
+        """Thread-safe. Matches the models.add_ingest_listener callback signature."""
+        if not bars or symbol not in self._subscribers:
+            return
+        self.publish_message(symbol, encode_bars_message(symbol, bars))
+
+    def publish_message(self, symbol: str, message: str):
+        """Thread-safe. Delivers an already encoded message (e.g. one relayed from another worker)."""
+        if self._loop is None or self._loop.is_closed() or symbol not in self._subscribers:
+            return
+        with self._lock:
+            self.events_published += 1
+        self._loop.call_soon_threadsafe(self._fan_out, symbol, message)
+
+    def _fan_out(self, symbol: str, message: str):
+        delivered = 0
+        for queue in list(self._subscribers.get(symbol, ())):
+            if queue.full():
+                # Too far behind: drop the backlog and tell the client to reload instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_MESSAGE)
+                with self._lock:
+                    self.resyncs += 1
+                continue
+            queue.put_nowait(message)
+            delivered += 1
+        with self._lock:
+            self.messages_delivered += delivered
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+                "symbols": len(self._subscribers),
+                "events_published": self.events_published,
+                "messages_delivered": self.messages_delivered,
+                "resyncs": self.resyncs,
+            }
+
+
+class SharedFeedRelay:
+    """
+    Carries live feed events between uvicorn workers through a shared state backend (shared_state.py).
+
+    Only the worker holding the CSV sync lease ingests, but every worker has its own /ws/bars subscribers.
+    So ingest events go into a short log in the backend instead (one key: a sequence number plus the events of the
+    last 'retention_seconds', at most 'max_events'), and every worker polls it each 'poll_interval' seconds and hands
+    new events to its local broadcaster. A worker that falls further behind than the log reaches skips the lost
+    events (counted in stats()); its clients catch up on their next /api/stock_data load.
+    """
+
+    LOG_KEY = "live_feed:log"
+
+    def __init__(self, broadcaster: BarBroadcaster, backend: StateBackend, poll_interval: float = 0.5,
+                 retention_seconds: float = 60.0, max_events: int = 256):
+        self.broadcaster = broadcaster
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.max_events = max_events
+        self._last_seq = 0
+        self._task: asyncio.Task | None = None
+
+        self.events_appended = 0
+        self.events_relayed = 0
+        self.events_missed = 0
+
+    def publish(self, symbol: str, bars: list[dict]):
+        """Thread-safe. Matches the models.add_ingest_listener callback signature."""
+        if not bars:
+            return
+        message = encode_bars_message(symbol, bars)
+        published_at = time.time()
+
+        def append(value: bytes | None) -> bytes:
+            log = json.loads(value) if value is not None else {"seq": 0, "events": []}
+            log["seq"] += 1
+            cutoff = time.time() - self.retention_seconds
+            events = [event for event in log["events"] if event[3] >= cutoff]
+            events.append([log["seq"], symbol, message, published_at])
+            log["events"] = events[-self.max_events:]
+            return json.dumps(log, separators=(",", ":")).encode("utf-8")
+
+        self.backend.update(self.LOG_KEY, append)
+        self.events_appended += 1
+
+    def _read_log(self) -> dict | None:
+        value = self.backend.get(self.LOG_KEY)
+        return json.loads(value) if value is not None else None
+
+    async def run(self):
+        log = await asyncio.to_thread(self._read_log)
+        self._last_seq = log["seq"] if log else 0 # Only events from now on
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                log = await asyncio.to_thread(self._read_log)
+            except Exception as e:
+                print(f"Live feed relay: reading the shared log failed: {e}")
+                continue
+            if log is None:
+                continue
+            if log["seq"] < self._last_seq:
+                self._last_seq = 0 # The shared state was reset, start over from what is there now
+            events = [event for event in log["events"] if event[0] > self._last_seq]
+            if events:
+                self.events_missed += events[0][0] - self._last_seq - 1
+                for _, symbol, message, _ in events:
+                    self.broadcaster.publish_message(symbol, message)
+                self.events_relayed += len(events)
+            self._last_seq = log["seq"]
+
+    def start_background(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "events_appended": self.events_appended,
+            "events_relayed": self.events_relayed,
+            "events_missed": self.events_missed,
+            "last_seq": self._last_seq,
+        }
+
+
+class CSVReplaySource:
+    """
+    Offline stand-in for a live data source: streams the bars of a CSV (same format as models.CSV_FILE)
+    into a broadcaster at 'bars_per_second', as if each had just been ingested. Nothing is written to the database.
+    With 'start', bars dated before it are skipped (open the dashboard with ?to=<the day before> to watch
+    the chart grow from there). With 'loop', the replay starts over at the end of the file.
+    """
+
+    def __init__(self, broadcaster: BarBroadcaster, csv_file: str = models.CSV_FILE, symbol: str = models.DEFAULT_SYMBOL,
+                 bars_per_second: float = 1.0, start: date | None = None, loop: bool = False):
+        if not bars_per_second > 0:
+            raise ValueError(f"bars_per_second must be greater than 0 (LIVE_REPLAY_SPEED), got {bars_per_second}.")
+        self.broadcaster = broadcaster
+        self.csv_file = csv_file
+        self.symbol = symbol
+        self.bars_per_second = bars_per_second
+        self.start = start
+        self.loop = loop
+        self.bars_sent = 0
+        self._task: asyncio.Task | None = None
+
+    def _read_bars(self) -> list[dict]:
+        bars = []
+        for chunk in pd.read_csv(self.csv_file, chunksize=models.IMPORT_CHUNKSIZE):
+            bars.extend(models.prepare_csv_chunk(chunk, since=self.start).bars)
+        return bars
+
+    async def run(self):
+        bars = await asyncio.to_thread(self._read_bars)
+        if not bars:
+            print(f"Replay source: no bars to replay from '{self.csv_file}'.")
+            return
+        interval = 1.0 / self.bars_per_second
+        while True:
+            for bar in bars:
+                self.broadcaster.publish(self.symbol, [bar])
+                self.bars_sent += 1
+                await asyncio.sleep(interval)
+            if not self.loop:
+                return
+
+    def start_background(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
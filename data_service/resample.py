@@ -0,0 +1,41 @@
+# data_service/resample.py
+
+import numpy as np
+
+# Bar sizes served from the intraday store -> seconds. Buckets are aligned to UTC (a '1d' bar is a UTC calendar day).
+INTRADAY_INTERVALS = {
+    "1m": 60,
+    "5m": 5 * 60,
+    "15m": 15 * 60,
+    "30m": 30 * 60,
+    "1h": 60 * 60,
+    "4h": 4 * 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+# Columns of a resampled bar, in output order ('time' is the bucket start in epoch seconds)
+RESAMPLED_FIELDS = ["time", "open", "high", "low", "close", "volume", "bar_count"]
+
+
+def resample_ohlcv(ts: np.ndarray, open_: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                   volume: np.ndarray, seconds: int) -> dict[str, np.ndarray]:
+    """
+    Aggregates bars sorted by 'ts' (epoch seconds) into 'seconds'-wide buckets.
+    Because the input is sorted, each bucket is a contiguous run, so the whole group-by is a handful of
+    ufunc.reduceat calls over the run boundaries instead of a hash aggregation.
+    Empty buckets are skipped, like SQL's GROUP BY. Returns one array per RESAMPLED_FIELDS entry.
+    """
+    if len(ts) == 0:
+        return {name: np.empty(0) for name in RESAMPLED_FIELDS}
+    bucket = ts // seconds
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(bucket)) + 1])
+    ends = np.concatenate([starts[1:], [len(ts)]])
+    return {
+        "time": bucket[starts] * seconds,
+        "open": open_[starts],
+        "high": np.maximum.reduceat(high, starts),
+        "low": np.minimum.reduceat(low, starts),
+        "close": close[ends - 1],
+        "volume": np.add.reduceat(volume, starts),
+        "bar_count": ends - starts,
+    }
@@ -0,0 +1,434 @@
+# data_service/stock_query.py
+
+import json
+import struct
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+
+from sqlalchemy import select, func, or_
+from sqlalchemy.orm import Session
+
+import metrics
+import models
+from models import StockData, StockIndicators, StockLevel, StockSymbol, IntradayBar
+from .indicators import INDICATOR_COLUMNS
+from .compression import compress
+from .resample import INTRADAY_INTERVALS, RESAMPLED_FIELDS, resample_ohlcv
+
+# Output field name -> table column. Order here is the order of keys/arrays in the response.
+STOCK_FIELDS = [
+    ("time", StockData.timestamp),
+    ("open", StockData.open_price),
+    ("high", StockData.high_price),
+    ("low", StockData.low_price),
+    ("close", StockData.close_price),
+    ("volume", StockData.volume),
+    ("direction", StockData.direction),
+    ("support_lower", StockData.support_lower),
+    ("support_upper", StockData.support_upper),
+    ("resistance_lower", StockData.resistance_lower),
+    ("resistance_upper", StockData.resistance_upper),
+]
+
+FIELD_NAMES = [name for name, _ in STOCK_FIELDS]
+
+# Fields returned for resampled (weekly/monthly/yearly) bars, read from the rollup tables in models.py
+ROLLUP_FIELD_COLUMNS = [
+    ("time", "period_start"),
+    ("open", "open_price"),
+    ("high", "high_price"),
+    ("low", "low_price"),
+    ("close", "close_price"),
+    ("volume", "volume"),
+    ("bar_count", "bar_count"),
+    ("long_count", "long_count"),
+    ("short_count", "short_count"),
+]
+
+ROLLUP_FIELD_NAMES = [name for name, _ in ROLLUP_FIELD_COLUMNS]
+
+# Indicator fields that can be added to daily bars, read from the precomputed indicators table
+INDICATOR_FIELDS = list(INDICATOR_COLUMNS)
+
+# Full level lists added to daily bars with levels=true, read from the levels table
+LEVEL_SET_FIELDS = ["support_levels", "resistance_levels"]
+
+# Supported values for the 'interval' query parameter. '1d' is the raw daily table, the coarser ones are rollups
+# and the finer ones are aggregated on request from the intraday table.
+INTRADAY_ONLY_INTERVALS = [interval for interval in INTRADAY_INTERVALS if interval != "1d"]
+INTERVALS = ["1d"] + list(models.ROLLUP_INTERVALS) + INTRADAY_ONLY_INTERVALS
+
+
+class UnknownSymbolError(LookupError):
+    """The requested symbol has no stored bars."""
+
+
+def fetch_stock_rows(db: Session, start: date | None = None, end: date | None = None, limit: int | None = None,
+                     indicators: tuple[str, ...] = (), symbol: str = models.DEFAULT_SYMBOL) -> list[tuple]:
+    """
+    Fetches plain row tuples (no ORM objects) ordered by timestamp.
+    The date range is applied on the indexed 'timestamp' column; 'limit' keeps the most recent N bars.
+    'indicators' (names from INDICATOR_FIELDS) are appended to each row from the indicators table.
+    Symbols other than models.DEFAULT_SYMBOL are read from the partitioned store (without indicators).
+    """
+    if symbol != models.DEFAULT_SYMBOL:
+        return fetch_symbol_rows(db, symbol, start=start, end=end, limit=limit)
+    stmt = select(*[column for _, column in STOCK_FIELDS], *[getattr(StockIndicators, name) for name in indicators])
+    if indicators:
+        stmt = stmt.outerjoin(StockIndicators, StockIndicators.timestamp == StockData.timestamp)
+    if start is not None:
+        stmt = stmt.where(StockData.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(StockData.timestamp <= end)
+
+    if limit is not None:
+        # Walk the index backwards to grab the latest bars, then flip them back into chronological order
+        rows = db.execute(stmt.order_by(StockData.timestamp.desc()).limit(limit)).all()
+        rows.reverse()
+    else:
+        rows = db.execute(stmt.order_by(StockData.timestamp)).all()
+
+    # Dates are not JSON serializable, convert them once here
+    return [(row[0].isoformat(),) + tuple(row[1:]) for row in rows]
+
+
+def fetch_symbol_rows(db: Session, symbol: str, start: date | None = None, end: date | None = None,
+                      limit: int | None = None) -> list[tuple]:
+    """
+    Same rows as fetch_stock_rows, from the per-year partitions of the multi-symbol store.
+    Only the partitions between the symbol's first and last bar that overlap [start, end] are read,
+    and with 'limit' they are read newest first until enough bars are found.
+    Raises UnknownSymbolError if the symbol has no bars.
+    """
+    years = models.get_symbol_years(db, symbol)
+    if years is None:
+        raise UnknownSymbolError(f"Unknown symbol '{symbol}'.")
+    years = [year for year in years if (start is None or year >= start.year) and (end is None or year <= end.year)]
+
+    rows = []
+    for year in (reversed(years) if limit is not None else years):
+        table = models.partition_table(year)
+        stmt = select(*[table.c[column.key] for _, column in STOCK_FIELDS]).where(table.c.symbol == symbol)
+        if start is not None:
+            stmt = stmt.where(table.c.timestamp >= start)
+        if end is not None:
+            stmt = stmt.where(table.c.timestamp <= end)
+        if limit is not None:
+            rows.extend(db.execute(stmt.order_by(table.c.timestamp.desc()).limit(limit - len(rows))).all())
+            if len(rows) >= limit:
+                break
+        else:
+            rows.extend(db.execute(stmt.order_by(table.c.timestamp)).all())
+    if limit is not None:
+        rows.reverse()
+
+    return [(row[0].isoformat(),) + tuple(row[1:]) for row in rows]
+
+
+def _epoch_seconds(day: date) -> int:
+    return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+
+
+def fetch_intraday_rows(db: Session, symbol: str, interval: str, start: date | None = None, end: date | None = None,
+                        limit: int | None = None) -> list[tuple]:
+    """
+    Bars of 'interval' (a key of INTRADAY_INTERVALS) aggregated from the intraday table, rows of RESAMPLED_FIELDS
+    with 'time' as the bucket start in epoch seconds. [start, end] are whole UTC days.
+    The range is a primary-key seek on (symbol, ts); with 'limit' and no 'start' only the source bars of the
+    last 'limit' buckets are read. The group-by itself is vectorized in data_service/resample.py.
+    """
+    seconds = INTRADAY_INTERVALS[interval]
+    stmt = select(IntradayBar.ts, IntradayBar.open_price, IntradayBar.high_price, IntradayBar.low_price,
+                  IntradayBar.close_price, IntradayBar.volume).where(IntradayBar.symbol == symbol)
+    if end is not None:
+        stmt = stmt.where(IntradayBar.ts < _epoch_seconds(end + timedelta(days=1)))
+    if start is not None:
+        stmt = stmt.where(IntradayBar.ts >= _epoch_seconds(start))
+    elif limit is not None:
+        last_stmt = select(IntradayBar.ts).where(IntradayBar.symbol == symbol)
+        if end is not None:
+            last_stmt = last_stmt.where(IntradayBar.ts < _epoch_seconds(end + timedelta(days=1)))
+        last_ts = db.execute(last_stmt.order_by(IntradayBar.ts.desc()).limit(1)).scalar()
+        if last_ts is not None:
+            stmt = stmt.where(IntradayBar.ts >= (last_ts // seconds - limit + 1) * seconds)
+
+    rows = db.execute(stmt.order_by(IntradayBar.ts)).all()
+    if not rows:
+        return []
+    # Transposing the rows first is much faster than np.array() over SQLAlchemy Row objects
+    ts, *values = zip(*rows)
+    bars = resample_ohlcv(np.asarray(ts, dtype=np.int64), *[np.asarray(column, dtype=float) for column in values], seconds=seconds)
+    if limit is not None:
+        bars = {name: column[-limit:] for name, column in bars.items()}
+    return list(zip(*[bars[name].tolist() for name in RESAMPLED_FIELDS]))
+
+
+def list_symbols(db: Session) -> list[dict]:
+    """Every stored symbol with its date range and bar count, the default symbol first."""
+    first_day, last_day, bar_count = db.execute(
+        select(func.min(StockData.timestamp), func.max(StockData.timestamp), func.count(StockData.id))
+    ).one()
+    symbols = [{"symbol": models.DEFAULT_SYMBOL, "first": first_day, "last": last_day, "bars": bar_count}]
+    symbols += [
+        {"symbol": row.symbol, "first": row.first_timestamp, "last": row.last_timestamp, "bars": row.bar_count}
+        for row in db.execute(select(StockSymbol).order_by(StockSymbol.symbol)).scalars()
+    ]
+    for entry in symbols:
+        for key in ("first", "last"):
+            entry[key] = entry[key].isoformat() if entry[key] else None
+    return symbols
+
+
+def fetch_rollup_rows(db: Session, interval: str, start: date | None = None, end: date | None = None, limit: int | None = None) -> list[tuple]:
+    """
+    Same as fetch_stock_rows, but reads pre-aggregated bars from the rollup table for 'interval' ('1w', '1mo', '1y').
+    A period is included if it starts inside [start, end].
+    """
+    rollup_model = models.ROLLUP_INTERVALS[interval][0]
+    period_start = rollup_model.period_start
+    stmt = select(*[getattr(rollup_model, column) for _, column in ROLLUP_FIELD_COLUMNS])
+    if start is not None:
+        stmt = stmt.where(period_start >= start)
+    if end is not None:
+        stmt = stmt.where(period_start <= end)
+
+    if limit is not None:
+        rows = db.execute(stmt.order_by(period_start.desc()).limit(limit)).all()
+        rows.reverse()
+    else:
+        rows = db.execute(stmt.order_by(period_start)).all()
+
+    return [(row[0].isoformat(),) + tuple(row[1:]) for row in rows]
+
+
+def fetch_level_sets(db: Session, start: str, end: str) -> dict[str, dict[str, list[float]]]:
+    """
+    Full support/resistance level lists for the days in [start, end] (ISO dates), read in one primary-key range scan:
+    {"2024-01-02": {"support": [...], "resistance": [...]}, ...}. Lists keep the CSV order.
+    """
+    stmt = (
+        select(StockLevel.timestamp, StockLevel.kind, StockLevel.price)
+        .where(StockLevel.timestamp >= date.fromisoformat(start), StockLevel.timestamp <= date.fromisoformat(end))
+        .order_by(StockLevel.timestamp, StockLevel.kind, StockLevel.position)
+    )
+    level_sets = {}
+    for day, kind, price in db.execute(stmt):
+        level_sets.setdefault(day.isoformat(), {"support": [], "resistance": []})[kind].append(price)
+    return level_sets
+
+
+def add_level_sets(db: Session, rows: list[tuple]) -> list[tuple]:
+    """Appends the day's support and resistance level lists to each daily row (as returned by fetch_stock_rows)."""
+    if not rows:
+        return rows
+    level_sets = fetch_level_sets(db, rows[0][0], rows[-1][0])
+    empty = {"support": [], "resistance": []}
+    return [row + (level_sets.get(row[0], empty)["support"], level_sets.get(row[0], empty)["resistance"]) for row in rows]
+
+
+def find_levels_in_band(db: Session, price: float, within_pct: float, kind: str | None = None,
+                        start: date | None = None, end: date | None = None, limit: int = 500) -> list[dict]:
+    """
+    Days with a level within 'within_pct' percent of 'price', closest first.
+    This is a range seek on ix_tesla_stock_levels_kind_price per kind, not a scan.
+    """
+    low, high = price * (1 - within_pct / 100), price * (1 + within_pct / 100)
+    kinds = [kind] if kind else list(models.LEVEL_KINDS.values())
+    stmt = select(StockLevel.timestamp, StockLevel.kind, StockLevel.price).where(
+        or_(*[(StockLevel.kind == k) & StockLevel.price.between(low, high) for k in kinds])
+    )
+    if start is not None:
+        stmt = stmt.where(StockLevel.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(StockLevel.timestamp <= end)
+    rows = db.execute(stmt).all()
+    rows.sort(key=lambda row: (abs(row[2] - price), row[0]))
+    return [{"time": day.isoformat(), "kind": level_kind, "price": level_price} for day, level_kind, level_price in rows[:limit]]
+
+
+def find_nearest_levels(db: Session, price: float, kind: str | None = None) -> list[dict]:
+    """
+    The closest stored level at or below and strictly above 'price' for each kind:
+    two index seeks (ORDER BY price ... LIMIT 1) per kind. A level exactly at the price counts as "below".
+    """
+    nearest = []
+    for level_kind in ([kind] if kind else list(models.LEVEL_KINDS.values())):
+        for side, condition, order in (("below", StockLevel.price <= price, StockLevel.price.desc()),
+                                       ("above", StockLevel.price > price, StockLevel.price.asc())):
+            row = db.execute(
+                select(StockLevel.timestamp, StockLevel.price)
+                .where(StockLevel.kind == level_kind, condition)
+                .order_by(order, StockLevel.timestamp.desc())
+                .limit(1)
+            ).first()
+            if row is not None:
+                nearest.append({
+                    "kind": level_kind, "side": side,
+                    "price": row[1], "time": row[0].isoformat(), "distance_pct": abs(row[1] - price) / price * 100,
+                })
+    return nearest
+
+
+def rows_to_records(rows: list[tuple], field_names: list[str] = FIELD_NAMES) -> list[dict]:
+    """One dict per bar, e.g. [{"time": ..., "open": ...}, ...]. This is the original response shape."""
+    return [dict(zip(field_names, row)) for row in rows]
+
+
+def rows_to_columns(rows: list[tuple], field_names: list[str] = FIELD_NAMES) -> dict[str, list]:
+    """One array per field, e.g. {"time": [...], "open": [...]}. Much smaller and maps directly onto chart series."""
+    if not rows:
+        return {name: [] for name in field_names}
+    return {name: list(values) for name, values in zip(field_names, zip(*rows))}
+
+
+# --- Packed binary format ---
+# b"BARS", uint32 LE header length, a JSON header padded with spaces to an 8-byte boundary, then one little-endian
+# float64 array of header["rows"] values per field, in header["fields"] order. A browser decodes each column with
+# new Float64Array(buffer, offset, rows) and no parsing at all. Missing values are NaN, 'time' is epoch seconds
+# (UTC midnight for daily bars) and 'direction' is 1 for LONG, -1 for SHORT.
+PACKED_MEDIA_TYPE = "application/vnd.stock-bars.packed"
+PACKED_MAGIC = b"BARS"
+DIRECTION_CODES = {"LONG": 1.0, "SHORT": -1.0}
+
+
+def _time_column(values: tuple) -> np.ndarray:
+    if values and isinstance(values[0], str):
+        return np.array(values, dtype="datetime64[D]").astype("datetime64[s]").astype(np.int64).astype(np.float64)
+    return np.array(values, dtype=np.float64)
+
+
+def encode_packed(rows: list[tuple], field_names: list[str]) -> bytes:
+    """
+    Encodes rows (as built for /api/stock_data) in the packed binary format.
+    Raises ValueError for fields that aren't scalars, such as the level lists.
+    """
+    columns = list(zip(*rows)) if rows else [() for _ in field_names]
+    arrays = []
+    for name, values in zip(field_names, columns):
+        if name == "time":
+            arrays.append(_time_column(values))
+        elif name == "direction":
+            arrays.append(np.array([DIRECTION_CODES.get(value, np.nan) for value in values], dtype=np.float64))
+        else:
+            try:
+                array = np.array(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                array = None
+            if array is None or array.ndim != 1:
+                raise ValueError(f"Field '{name}' can't be packed as numbers.")
+            arrays.append(array)
+
+    header = json.dumps({"rows": len(rows), "fields": field_names, "direction": DIRECTION_CODES}, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-(len(PACKED_MAGIC) + 4 + len(header)) % 8)
+    return b"".join([PACKED_MAGIC, struct.pack("<I", len(header)), header, *[array.astype("<f8").tobytes() for array in arrays]])
+
+
+class StockDataCache:
+    """
+    Small in-process LRU cache of encoded /api/stock_data responses.
+    Entries are tied to the data version from models.get_data_version(); when it changes the cache is emptied.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version: int):
+        with self._lock:
+            if version != self._version:
+                # The table changed since these entries were built
+                self._entries.clear()
+                self._version = version
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key, version: int, payload: bytes):
+        with self._lock:
+            if version != self._version:
+                return # Data moved on while we were building this payload, don't cache it
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+# Response formats of get_stock_data_payload -> media type
+OUTPUT_FORMATS = {"rows": "application/json", "columnar": "application/json", "packed": PACKED_MEDIA_TYPE}
+
+
+def stock_data_key(symbol: str, start: date | None, end: date | None, limit: int | None, output_format: str,
+                   interval: str, indicators: tuple[str, ...], levels: bool) -> tuple:
+    """Identifies one /api/stock_data response, for the cache and for its ETag."""
+    return (symbol, start, end, limit, output_format, interval, indicators, levels)
+
+
+def get_stock_data_payload(db: Session, cache: StockDataCache, start: date | None = None, end: date | None = None,
+                           limit: int | None = None, output_format: str = "rows", interval: str = "1d",
+                           indicators: tuple[str, ...] = (), levels: bool = False,
+                           symbol: str = models.DEFAULT_SYMBOL, encoding: str = "identity",
+                           version: int | None = None) -> bytes:
+    """
+    Returns the stock data for the given range in 'output_format' (a key of OUTPUT_FORMATS), served from the cache
+    when the data has not changed. With 'encoding' ('gzip' or 'br', see data_service/compression.py) the payload is
+    compressed once and the compressed bytes are cached next to the plain ones.
+    Coarser intervals than '1d' are served from the rollup tables and finer ones are resampled from the intraday table;
+    'indicators' and 'levels' only apply to '1d'. Other symbols than models.DEFAULT_SYMBOL have no rollups.
+    Raises ValueError if the fields can't be packed (the level lists).
+    """
+    if version is None:
+        version = models.get_data_version(db)
+    key = stock_data_key(symbol, start, end, limit, output_format, interval, indicators, levels) + (encoding,)
+
+    payload = cache.get(key, version)
+    if payload is not None:
+        return payload
+
+    if encoding != "identity":
+        plain = get_stock_data_payload(db, cache, start=start, end=end, limit=limit, output_format=output_format,
+                                       interval=interval, indicators=indicators, levels=levels, symbol=symbol,
+                                       version=version)
+        with metrics.stage("compress", encoding=encoding):
+            payload = compress(plain, encoding)
+        cache.put(key, version, payload)
+        return payload
+
+    with metrics.stage("bars_fetch", interval=interval):
+        if interval in INTRADAY_ONLY_INTERVALS or (
+                interval == "1d" and symbol != models.DEFAULT_SYMBOL and models.get_symbol_years(db, symbol) is None):
+            # Symbols with only intraday data get their daily bars aggregated from it as well
+            rows = fetch_intraday_rows(db, symbol, interval, start=start, end=end, limit=limit)
+            field_names = RESAMPLED_FIELDS
+        elif interval == "1d":
+            rows = fetch_stock_rows(db, start=start, end=end, limit=limit, indicators=indicators, symbol=symbol)
+            field_names = FIELD_NAMES + list(indicators)
+            if levels:
+                rows = add_level_sets(db, rows)
+                field_names += LEVEL_SET_FIELDS
+        else:
+            rows = fetch_rollup_rows(db, interval, start=start, end=end, limit=limit)
+            field_names = ROLLUP_FIELD_NAMES
+    with metrics.stage("bars_encode", format=output_format):
+        if output_format == "packed":
+            payload = encode_packed(rows, field_names)
+        else:
+            body = rows_to_columns(rows, field_names) if output_format == "columnar" else rows_to_records(rows, field_names)
+            payload = json.dumps(body, separators=(",", ":")).encode("utf-8")
+    cache.put(key, version, payload)
+    return payload
@@ -1,5 +1,5 @@
-from fastapi import FastAPI, Depends, Request, HTTPException, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Depends, Request, HTTPException, File, UploadFile, Form, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
@@ -8,9 +8,14 @@ from typing import List, Dict, Union
 from pydantic import BaseModel
 import io
 import base64
+import json
+import uuid
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from PIL import Image # Import Pillow
 import os # For environment variables
-from datetime import datetime # For date handling
+from datetime import datetime, date # For date handling
 
 # --- IMPORTANT: For loading environment variables ---
 from dotenv import load_dotenv
@@ -19,15 +24,90 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import models
+import metrics
+from shared_state import create_state_backend, MemoryStateBackend, WORKER_ID
 
 # Import our chatbot service modules
 from chatbot_service.parser import QueryParser
-from chatbot_service.chatbot import GeminiChatbot
-
-# Initialize the database on startup
+from chatbot_service.chatbot import AsyncGeminiChatbot, KeyModels
+from chatbot_service.fake_gemini import FakeGeminiBackend
+from chatbot_service.key_pool import APIKeyPool
+from chatbot_service.conversation import ConversationStore
+from chatbot_service.response_cache import LLMResponseCache
+from chatbot_service.sql_cache import SQLTranslationCache, SQL_CACHE_FILE
+from chatbot_service.sql_sandbox import SQLSandbox
+from chatbot_service.intent_router import IntentRouter
+from chatbot_service.image_store import SessionImageStore, StoredImage
+from chatbot_service.image_upload import receive_image_upload, UploadTooLargeError
+from data_service.stock_query import StockDataCache, get_stock_data_payload, stock_data_key, find_levels_in_band, find_nearest_levels, list_symbols, UnknownSymbolError, INTERVALS, INDICATOR_FIELDS, OUTPUT_FORMATS, PACKED_MEDIA_TYPE
+from data_service.compression import CompressionMiddleware, negotiate_encoding
+from data_service.export import make_etag, etag_matches, iter_export, EXPORT_FORMATS
+from data_service.live_feed import BarBroadcaster, CSVReplaySource, SharedFeedRelay
+from data_service.backtest import BacktestParams, load_bars, run_backtest, expand_grid, run_sweep
+
+# Initialize the database on startup (serialized across workers by a file lock, see models.initialize_database)
 models.initialize_database()
 
-app = FastAPI()
+# --- Shared State (multi-worker deployments) ---
+# Chat sessions, uploaded charts, API key cooldowns and live feed events have to be visible to every uvicorn worker
+# once there is more than one (uvicorn main:app --workers N). SHARED_STATE_URL picks where they live:
+# memory:// (default, single worker), sqlite:///shared_state.db (all workers of one host) or redis://host:6379/0.
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "memory://")
+shared_state = create_state_backend(SHARED_STATE_URL)
+# With memory:// the stores keep their own in-process structures (with their LRU size caps) instead
+store_backend = None if isinstance(shared_state, MemoryStateBackend) else shared_state
+
+# --- Live Bar Feed ---
+# Ingest events from models.py are fanned out to /ws/bars subscribers; nobody polls the database per client.
+# With a shared backend they go through the SharedFeedRelay, so subscribers of every worker get them.
+bar_broadcaster = BarBroadcaster(queue_size=int(os.getenv("LIVE_FEED_QUEUE_SIZE", "256")))
+feed_relay = SharedFeedRelay(bar_broadcaster, store_backend) if store_backend is not None else None
+models.add_ingest_listener(feed_relay.publish if feed_relay is not None else bar_broadcaster.publish)
+
+# How often the CSV is checked for appended rows (0 disables). A check with nothing new is a few file reads.
+LIVE_SYNC_INTERVAL_SECONDS = float(os.getenv("LIVE_SYNC_INTERVAL_SECONDS", "5"))
+
+async def sync_csv_periodically():
+    while True:
+        await asyncio.sleep(LIVE_SYNC_INTERVAL_SECONDS)
+        try:
+            # One worker syncs at a time: whoever holds (and keeps renewing) the lease
+            if not await asyncio.to_thread(shared_state.acquire_lease, "csv_sync", WORKER_ID, LIVE_SYNC_INTERVAL_SECONDS * 3):
+                continue
+            await asyncio.to_thread(models.sync_data_from_csv)
+        except Exception as e:
+            print(f"Periodic CSV sync failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    bar_broadcaster.bind(asyncio.get_running_loop())
+    if feed_relay is not None:
+        feed_relay.start_background()
+    background_tasks = []
+    if LIVE_SYNC_INTERVAL_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(sync_csv_periodically()))
+
+    # Offline testing: replay a CSV into the live feed, e.g. LIVE_REPLAY_CSV=cleaneddata.csv LIVE_REPLAY_START=2025-01-02
+    replay_source = None
+    if os.getenv("LIVE_REPLAY_CSV"):
+        replay_start = os.getenv("LIVE_REPLAY_START")
+        replay_source = CSVReplaySource(
+            bar_broadcaster, csv_file=os.getenv("LIVE_REPLAY_CSV"),
+            bars_per_second=float(os.getenv("LIVE_REPLAY_SPEED", "1")),
+            start=date.fromisoformat(replay_start) if replay_start else None,
+            loop=os.getenv("LIVE_REPLAY_LOOP", "false").lower() == "true",
+        )
+        replay_source.start_background()
+    yield
+    if replay_source is not None:
+        await replay_source.stop()
+    if feed_relay is not None:
+        await feed_relay.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.to_thread(sql_translation_cache.flush) # Hit times are only written in batches
+
+app = FastAPI(lifespan=lifespan)
 
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -41,9 +121,71 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --- Global variable to store last image (for chat context) ---
-# Stores PIL Image object for subsequent analysis requests
-last_uploaded_image_pil = None 
+# gzip/brotli for responses above COMPRESSION_MIN_BYTES. /api/stock_data sends precompressed cached payloads instead.
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")))
+
+# --- Per-session image store (for chat context) ---
+# Keeps each session's last uploaded chart as compressed bytes, plus cached analyses by image content hash
+image_store = SessionImageStore(
+    max_bytes=int(os.getenv("IMAGE_STORE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("IMAGE_STORE_TTL_SECONDS", str(30 * 60))),
+    backend=store_backend,
+)
+
+# Largest chart upload accepted by /api/analyze_chart/upload
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+# --- Session identification ---
+# Browsers get a session cookie on their first request; API clients can send an X-Session-ID header instead.
+SESSION_COOKIE_NAME = "session_id"
+
+@app.middleware("http")
+async def assign_session_id(request: Request, call_next):
+    session_id = request.headers.get("X-Session-ID") or request.cookies.get(SESSION_COOKIE_NAME)
+    is_new_session = session_id is None
+    if is_new_session:
+        session_id = uuid.uuid4().hex
+    request.state.session_id = session_id
+
+    response = await call_next(request)
+    if is_new_session:
+        response.set_cookie(SESSION_COOKIE_NAME, session_id, httponly=True, samesite="lax")
+    return response
+
+# --- Metrics and per-request profiling ---
+# Stage timings (Gemini calls per key, key waits, SQL plan/exec/fetch, formatting, image decode, ingest, ...) are
+# aggregated into the histograms served at /metrics. A request sent with "X-Profile: 1" also gets its own stage
+# breakdown back as a Server-Timing header; for streamed responses that only covers the stages before the first byte.
+PROFILE_HEADER = "X-Profile"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    profile = metrics.start_profile() if request.headers.get(PROFILE_HEADER, "0") not in ("", "0") else None
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start_time
+
+    # Label by route template (/api/export, not the full URL), so the series count stays bounded
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=getattr(route, "path", "other"),
+                                         status=response.status_code)
+    if profile is not None:
+        response.headers["Server-Timing"] = metrics.server_timing(profile + [("total", elapsed, {})])
+    return response
+
+# --- Gemini Backend ---
+# GEMINI_BACKEND=fake answers every Gemini call from the local stand-in in chatbot_service/fake_gemini.py
+# (benchmarks, offline development); no API keys are needed then.
+fake_gemini_backend = None
+if os.getenv("GEMINI_BACKEND", "gemini") == "fake":
+    fake_gemini_backend = FakeGeminiBackend(
+        latency=float(os.getenv("FAKE_GEMINI_LATENCY_MS", "500")) / 1000,
+        jitter=float(os.getenv("FAKE_GEMINI_JITTER_MS", "0")) / 1000,
+        rate_limit_rate=float(os.getenv("FAKE_GEMINI_RATE_LIMIT_RATE", "0")),
+        stream_chunks=int(os.getenv("FAKE_GEMINI_STREAM_CHUNKS", "8")),
+        chunk_delay=float(os.getenv("FAKE_GEMINI_CHUNK_DELAY_MS", "50")) / 1000,
+    )
+    print("Using the fake Gemini backend.")
 
 # --- Gemini API Keys (Using environment variables is best practice) ---
 # Collect all API keys from environment variables
@@ -52,25 +194,99 @@ for i in range(1, 6): # Assuming you have GOOGLE_API_KEY_1 to GOOGLE_API_KEY_5
     key = os.getenv(f"GOOGLE_API_KEY_{i}")
     if key:
         GEMINI_API_KEYS.append(key)
-    else:
+    elif fake_gemini_backend is None:
         print(f"WARNING: GOOGLE_API_KEY_{i} environment variable not set.")
 
+if not GEMINI_API_KEYS and fake_gemini_backend is not None:
+    GEMINI_API_KEYS = [f"fake-key-{i}" for i in range(1, int(os.getenv("FAKE_GEMINI_KEYS", "3")) + 1)]
 if not GEMINI_API_KEYS:
     raise ValueError("No Gemini API keys found in environment variables. Please set at least GOOGLE_API_KEY_1.")
 else:
     print(f"Successfully loaded {len(GEMINI_API_KEYS)} Gemini API keys.")
 
-# Initialize Gemini Chatbot once on app startup, passing the LIST of API keys
-gemini_chatbot = GeminiChatbot(api_keys=GEMINI_API_KEYS) 
+# Per-key usage and health tracking; each Gemini call goes to the least-loaded key that isn't cooling down.
+# Optional per-key budgets (requests / tokens per minute) keep a key out of rotation before it gets 429s.
+gemini_key_pool = APIKeyPool(
+    GEMINI_API_KEYS,
+    rate_limit_cooldown=float(os.getenv("GEMINI_RATE_LIMIT_COOLDOWN", "30")),
+    requests_per_minute=int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "0")) or None,
+    tokens_per_minute=int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "0")) or None,
+    shared_state=store_backend, # Cooldowns are seen by every worker
+)
+
+# Initialize Gemini Chatbot once on app startup, passing the LIST of API keys.
+# The async variant lets slow Gemini calls run concurrently instead of blocking the event loop.
+gemini_chatbot = AsyncGeminiChatbot(
+    api_keys=GEMINI_API_KEYS,
+    max_concurrent_per_key=int(os.getenv("GEMINI_MAX_CONCURRENT_PER_KEY", "4")),
+    request_timeout=float(os.getenv("GEMINI_REQUEST_TIMEOUT", "60")),
+    key_pool=gemini_key_pool,
+    # Identical concurrent prompts share one call; answers are reused until the TTL or the next ingest
+    response_cache=LLMResponseCache(
+        max_entries=int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", "512")),
+        ttl_seconds=float(os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", "600")),
+    ),
+    model_factory=fake_gemini_backend.models_for_key if fake_gemini_backend else KeyModels,
+    # Chat history per session cookie: a token-budgeted window of recent turns plus a rolling summary of older ones
+    conversations=ConversationStore(
+        max_history_tokens=int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "2000")),
+        summary_max_words=int(os.getenv("CHAT_SUMMARY_MAX_WORDS", "150")),
+        idle_seconds=float(os.getenv("CHAT_SESSION_IDLE_SECONDS", str(30 * 60))),
+        max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", "10000")),
+        backend=store_backend,
+    ),
+)
+
+# Persistent NL->SQL cache in front of the Text-to-SQL Gemini call
+sql_translation_cache = SQLTranslationCache(
+    db_file=os.getenv("SQL_CACHE_FILE", SQL_CACHE_FILE),
+    max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=float(os.getenv("SQL_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    similarity_threshold=float(os.getenv("SQL_CACHE_SIMILARITY", "0.9")),
+)
+
+# Plan check, row cap and wall-clock budget for the generated SQL, so one bad question can't pin a worker
+sql_sandbox = SQLSandbox(
+    max_rows=int(os.getenv("GENERATED_SQL_MAX_ROWS", "100")),
+    time_budget_seconds=float(os.getenv("GENERATED_SQL_TIME_BUDGET_SECONDS", "2")),
+)
+
+# Rule-based fast path for common questions (shared so its traffic stats cover every request)
+intent_router = IntentRouter()
 
 # Pydantic model for incoming chat messages
 class ChatMessage(BaseModel):
     message: str
+    symbol: str | None = None # Ticker the question is about (defaults to models.DEFAULT_SYMBOL)
 
 # Pydantic model for incoming chart analysis requests (for initial upload)
 class ChartUploadRequest(BaseModel):
     image_data: str # Base64 encoded image string
 
+# Pydantic model for /api/backtest requests. Without 'sweep' the given rules are backtested once;
+# with it, every combination of the listed values ({param name: [values]}) is backtested across a process pool.
+class BacktestRequest(BaseModel):
+    symbol: str = models.DEFAULT_SYMBOL
+    start: date | None = None
+    end: date | None = None
+    entry: str = "next_open"
+    hold_bars: int = 10
+    stop_loss_pct: float | None = None
+    take_profit_pct: float | None = None
+    fee_pct: float = 0.0
+    allow_short: bool = True
+    exit_on_opposite: bool = True
+    include_trades: bool = True
+    sweep: Dict[str, list] | None = None
+    sort_by: str = "total_return"
+    top: int = 20
+
+# Largest parameter grid /api/backtest will sweep in one request
+MAX_SWEEP_COMBINATIONS = 20000
+
+# In-process cache for /api/stock_data responses, invalidated through models.get_data_version()
+stock_data_cache = StockDataCache(max_entries=128)
+
 # Dependency to get DB session
 def get_db():
     db = models.SessionLocal()
@@ -79,46 +295,203 @@ def get_db():
     finally:
         db.close()
 
-# --- API Endpoint to Serve Stock Data for Visualization ---
-@app.get("/api/stock_data", response_model=List[Dict[str, Union[str, float, int, None]]])
-async def get_stock_data_api(db: Session = Depends(get_db)):
-    stock_records = db.query(models.StockData).order_by(models.StockData.timestamp).all()
-
-    formatted_data = []
-    for record in stock_records:
-        formatted_data.append({
-            "time": record.timestamp.isoformat(),
-            "open": record.open_price,
-            "high": record.high_price,
-            "low": record.low_price,
-            "close": record.close_price,
-            "volume": record.volume,
-            "direction": record.direction,
-            "support_lower": record.support_lower,
-            "support_upper": record.support_upper,
-            "resistance_lower": record.resistance_lower,
-            "resistance_upper": record.resistance_upper,
-        })
-    return formatted_data
+# Read-only session for running LLM-generated SQL
+def get_read_only_db():
+    db = models.ReadOnlySessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-# --- Combined API Endpoint for Chatbot Text and Contextual Image Analysis ---
-@app.post("/api/chat")
-async def chat_with_gemini_combined(message: ChatMessage, db: Session = Depends(get_db)):
-    global last_uploaded_image_pil # Declare intent to modify global variable
+# Validates a requested ticker: 400 if it isn't a plain symbol, 404 if nothing is stored for it
+def resolve_symbol(db: Session, symbol: str | None) -> str:
+    if symbol is None:
+        return models.DEFAULT_SYMBOL
+    try:
+        symbol = models.normalize_symbol(symbol)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not models.symbol_exists(db, symbol):
+        raise HTTPException(status_code=404, detail=f"Unknown symbol '{symbol}'.")
+    return symbol
 
-    user_query = message.message
-    user_query_lower = user_query.lower().strip()
+# --- API Endpoint to Serve Stock Data for Visualization ---
+# Plain `def` so FastAPI runs the (blocking) SQLite query in its threadpool instead of on the event loop.
+@app.get("/api/stock_data")
+def get_stock_data_api(
+    request: Request,
+    start: date | None = Query(None, alias="from", description="First date to include (YYYY-MM-DD)"),
+    end: date | None = Query(None, alias="to", description="Last date to include (YYYY-MM-DD)"),
+    limit: int | None = Query(None, ge=1, description="Only return the most recent N bars of the range"),
+    format: str | None = Query(None, pattern="^(rows|columnar|packed)$", description=f"'rows' (one object per bar), 'columnar' (one array per field) or 'packed' (binary float64 columns). Default: 'packed' if the Accept header asks for {PACKED_MEDIA_TYPE}, else 'rows'."),
+    interval: str = Query("1d", description=f"Bar size: one of {', '.join(INTERVALS)}. Anything above 1d is served from the rollup tables, anything below from the intraday bars (epoch-second 'time')."),
+    indicators: str | None = Query(None, description=f"Comma-separated indicators to add to daily bars ({', '.join(INDICATOR_FIELDS)}), or 'all'"),
+    levels: bool = Query(False, description="Add the full support_levels/resistance_levels lists to daily bars"),
+    symbol: str | None = Query(None, description="Ticker to return (default: TSLA). See /api/symbols."),
+    db: Session = Depends(get_db),
+):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'.")
+    symbol = resolve_symbol(db, symbol)
+    if symbol != models.DEFAULT_SYMBOL and (interval in models.ROLLUP_INTERVALS or indicators or levels):
+        raise HTTPException(status_code=400, detail=f"Only plain '1d' and intraday bars are available for {symbol}.")
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Unsupported interval '{interval}'. Use one of: {', '.join(INTERVALS)}.")
+
+    indicator_names = ()
+    if indicators:
+        indicator_names = tuple(INDICATOR_FIELDS) if indicators == "all" else tuple(name.strip() for name in indicators.split(",") if name.strip())
+        unknown = [name for name in indicator_names if name not in INDICATOR_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown indicators: {', '.join(unknown)}. Use any of: {', '.join(INDICATOR_FIELDS)}.")
+    if (indicator_names or levels) and interval != "1d":
+        raise HTTPException(status_code=400, detail="Indicators and levels are only available for the '1d' interval.")
+    output_format = format or ("packed" if PACKED_MEDIA_TYPE in request.headers.get("accept", "") else "rows")
+    if output_format == "packed" and levels:
+        raise HTTPException(status_code=400, detail="The level lists can't be packed; use 'rows' or 'columnar' with levels=true.")
+
+    # Unchanged data costs one data-version lookup and a 304
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    version = models.get_data_version(db)
+    etag = make_etag(version, stock_data_key(symbol, start, end, limit, output_format, interval, indicator_names, levels), encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    payload = get_stock_data_payload(
+        db, stock_data_cache,
+        start=start, end=end, limit=limit,
+        output_format=output_format, interval=interval, indicators=indicator_names, levels=levels, symbol=symbol,
+        encoding=encoding, version=version,
+    )
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    # The payload is already encoded (and possibly cached and compressed), so skip re-serialization
+    return Response(content=payload, media_type=OUTPUT_FORMATS[output_format], headers=headers)
+
+# --- Bulk Export ---
+# Streams a whole range as CSV or NDJSON without building it in memory first; compressed by the middleware.
+@app.get("/api/export")
+def export_api(
+    request: Request,
+    start: date | None = Query(None, alias="from", description="First date to include (YYYY-MM-DD)"),
+    end: date | None = Query(None, alias="to", description="Last date to include (YYYY-MM-DD)"),
+    symbol: str | None = Query(None, description="Ticker to export (default: TSLA). See /api/symbols."),
+    source: str = Query("daily", pattern="^(daily|intraday)$", description="'daily' bars or the stored 'intraday' bars (epoch-second 'ts')"),
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="'csv' or 'ndjson' (one JSON object per line)"),
+    db: Session = Depends(get_db),
+):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'.")
+    symbol = resolve_symbol(db, symbol)
+
+    version = models.get_data_version(db)
+    etag = make_etag(version, ("export", symbol, source, start, end, format), negotiate_encoding(request.headers.get("accept-encoding")))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "Content-Disposition": f'attachment; filename="{symbol.lower()}_{source}.{format}"',
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(iter_export(symbol, source=source, start=start, end=end, fmt=format),
+                             media_type=EXPORT_FORMATS[format], headers=headers)
+
+# --- Live Bars (WebSocket) ---
+# Messages are {"type": "bars", "symbol": ..., "bars": {<columnar /api/stock_data fields>}} with only new or
+# updated bars, or {"type": "resync"} when this client fell behind and should reload /api/stock_data.
+@app.websocket("/ws/bars")
+async def bars_websocket(websocket: WebSocket, symbol: str | None = None):
+    try:
+        symbol = models.normalize_symbol(symbol) if symbol else models.DEFAULT_SYMBOL
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    queue = bar_broadcaster.subscribe(symbol)
+
+    async def wait_for_disconnect():
+        # Clients don't send anything; reading is only how a closed connection is noticed
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    disconnected = asyncio.create_task(wait_for_disconnect())
+    try:
+        while True:
+            next_message = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({next_message, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if next_message not in done:
+                next_message.cancel()
+                break
+            await websocket.send_text(next_message.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        bar_broadcaster.unsubscribe(symbol, queue)
+        disconnected.cancel()
+
+# --- Stored Symbols ---
+@app.get("/api/symbols")
+def get_symbols_api(db: Session = Depends(get_db)):
+    return {"default": models.DEFAULT_SYMBOL, "symbols": list_symbols(db)}
+
+# --- Support / Resistance Level Lookup ---
+@app.get("/api/levels")
+def get_levels_api(
+    price: float = Query(..., gt=0, description="Price to look up levels around"),
+    within_pct: float | None = Query(None, gt=0, le=50, description="Return every day with a level within this percentage of 'price'. Without it, only the nearest levels above and below are returned."),
+    kind: str | None = Query(None, pattern="^(support|resistance)$", description="Only 'support' or 'resistance' levels"),
+    start: date | None = Query(None, alias="from", description="First date to include (YYYY-MM-DD)"),
+    end: date | None = Query(None, alias="to", description="Last date to include (YYYY-MM-DD)"),
+    limit: int = Query(500, ge=1, le=5000, description="Maximum number of matches"),
+    db: Session = Depends(get_db),
+):
+    if within_pct is None:
+        return {"price": price, "nearest": find_nearest_levels(db, price, kind=kind)}
+    matches = find_levels_in_band(db, price, within_pct, kind=kind, start=start, end=end, limit=limit)
+    return {"price": price, "within_pct": within_pct, "matches": matches}
+
+# --- Signal Backtesting ---
+# Plain `def`: the simulation is CPU-bound and sweeps block on their process pool, so keep both off the event loop.
+@app.post("/api/backtest")
+def backtest_api(request_body: BacktestRequest, db: Session = Depends(get_db)):
+    if request_body.start and request_body.end and request_body.start > request_body.end:
+        raise HTTPException(status_code=400, detail="'start' must not be after 'end'.")
+    symbol = resolve_symbol(db, request_body.symbol)
+    try:
+        bars = load_bars(db, start=request_body.start, end=request_body.end, symbol=symbol)
+    except UnknownSymbolError:
+        raise HTTPException(status_code=404, detail=f"No daily bars are stored for {symbol}.")
+    if not len(bars.close):
+        raise HTTPException(status_code=404, detail="No bars in the requested range.")
 
-    # Instantiate parser with the db session and the shared gemini_chatbot instance
-    parser = QueryParser(db=db, gemini_chatbot=gemini_chatbot)
-    
-    response_content = "I'm not sure how to respond to that."
-    
-    # --- Check for explicit image analysis command ---
-    # This is for when the user types "analyze chart" *after* an image has been uploaded
-    if "analyze chart" in user_query_lower or "analyze image" in user_query_lower:
-        if last_uploaded_image_pil:
-            detailed_analysis_prompt = """
+    params = BacktestParams(**request_body.model_dump(include=set(BacktestParams._fields)))
+    try:
+        if request_body.sweep is None:
+            return run_backtest(bars, params, include_trades=request_body.include_trades)
+
+        # Unswept parameters keep the values given in the request rather than the defaults
+        grid = {name: [value] for name, value in params._asdict().items() if name not in request_body.sweep}
+        grid.update(request_body.sweep)
+        combination_count = 1
+        for values in grid.values():
+            combination_count *= len(values)
+        if not 1 <= combination_count <= MAX_SWEEP_COMBINATIONS:
+            raise HTTPException(status_code=400, detail=f"A sweep must have between 1 and {MAX_SWEEP_COMBINATIONS} combinations (got {combination_count}).")
+        combos = expand_grid(grid)
+        return run_sweep(bars, combos, sort_by=request_body.sort_by, top=max(request_body.top, 1))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Chart analysis prompts ---
+# Quick overview sent right after an upload
+INITIAL_ANALYSIS_PROMPT = "Analyze this stock chart image for major trends and any obvious immediate patterns. Provide a brief overview."
+
+# Full technical analysis for an "analyze chart" chat command
+DETAILED_ANALYSIS_PROMPT = """
             Based on the provided stock chart image, conduct a technical analysis focusing on aspects relevant to traders:
 
             1.  **Overall Trend:** Describe the predominant trend (uptrend, downtrend, sideways/ranging) and its strength.
@@ -130,12 +503,56 @@ async def chat_with_gemini_combined(message: ChatMessage, db: Session = Depends(
 
             Synthesize these observations into a concise summary suitable for a trader or investment banker, highlighting potential trading implications or key observations.
             """
+
+async def analyze_stored_image(stored: StoredImage, prompt: str, timings: dict | None = None) -> str:
+    """
+    Runs a vision analysis of a stored upload, reusing the cached answer if this exact image
+    was already analyzed with this prompt. If 'timings' is given, per-stage seconds are recorded in it.
+    """
+    cached_analysis = image_store.get_analysis(stored.content_hash, prompt)
+    if cached_analysis is not None:
+        if timings is not None:
+            timings["analysis_cache_hit"] = True
+        return cached_analysis
+
+    # Decoding is CPU-bound, keep it off the event loop
+    stage_start = time.perf_counter()
+    image_pil = await asyncio.to_thread(image_store.load_image, stored)
+    decode_seconds = time.perf_counter() - stage_start
+    metrics.observe_stage("image_decode", decode_seconds)
+
+    stage_start = time.perf_counter()
+    analysis = await gemini_chatbot.analyze_chart_image_async(image=image_pil, user_query=prompt)
+    if timings is not None:
+        timings["decode_seconds"] = decode_seconds
+        timings["decoded_size"] = list(image_pil.size)
+        timings["analysis_seconds"] = time.perf_counter() - stage_start
+        timings["analysis_cache_hit"] = False
+    image_store.put_analysis(stored.content_hash, prompt, analysis)
+    return analysis
+
+# --- Combined API Endpoint for Chatbot Text and Contextual Image Analysis ---
+@app.post("/api/chat")
+async def chat_with_gemini_combined(message: ChatMessage, request: Request, db: Session = Depends(get_db),
+                                    read_only_db: Session = Depends(get_read_only_db)):
+    user_query = message.message
+    user_query_lower = user_query.lower().strip()
+
+    # Instantiate parser with the db session and the shared gemini_chatbot instance
+    symbol = await asyncio.to_thread(resolve_symbol, db, message.symbol) # Looks the symbol up in SQLite
+    parser = QueryParser(db=db, gemini_chatbot=gemini_chatbot, sql_cache=sql_translation_cache, intent_router=intent_router,
+                         read_only_db=read_only_db, sql_sandbox=sql_sandbox, symbol=symbol)
+    
+    response_content = "I'm not sure how to respond to that."
+    
+    # --- Check for explicit image analysis command ---
+    # This is for when the user types "analyze chart" *after* an image has been uploaded
+    if "analyze chart" in user_query_lower or "analyze image" in user_query_lower:
+        stored_image = image_store.get(request.state.session_id)
+        if stored_image:
             try:
-                # Call Gemini Vision with the stored PIL image
-                vision_response = gemini_chatbot.analyze_chart_image(
-                    image=last_uploaded_image_pil,
-                    user_query=detailed_analysis_prompt
-                )
+                # Call Gemini Vision with this session's stored image
+                vision_response = await analyze_stored_image(stored_image, DETAILED_ANALYSIS_PROMPT)
                 return JSONResponse(content={"response": vision_response}) # Changed to return vision_response directly
             except Exception as e:
                 print(f"Error during contextual image analysis: {e}")
@@ -145,13 +562,15 @@ async def chat_with_gemini_combined(message: ChatMessage, db: Session = Depends(
             return JSONResponse(content={"response": response_content})
     
     # --- Otherwise, attempt to handle as a database query or general text query ---
-    parsed_result = parser.parse_and_execute(user_query)
+    parsed_result = await parser.parse_and_execute(user_query)
 
     if parsed_result["type"] == "db_response":
         response_content = parsed_result["content"]
     else: # type == "gemini_response" (meaning Text-to-SQL failed or it's a general question)
         # If Text-to-SQL fails or it's a general question, ask Gemini directly for a conversational response
-        gemini_response_text = gemini_chatbot.send_text_query(user_query)
+        data_version = await asyncio.to_thread(models.get_data_version, db)
+        gemini_response_text = await gemini_chatbot.send_text_query_async(user_query, data_version=data_version,
+                                                                          session_id=request.state.session_id)
         response_content = gemini_response_text
     
     return JSONResponse(content={"response": response_content})
@@ -159,26 +578,18 @@ async def chat_with_gemini_combined(message: ChatMessage, db: Session = Depends(
 # --- REVERTED: Original API Endpoint for Chart Image Upload & Analysis ---
 # THIS IS THE ENDPOINT YOUR FRONTEND IS LIKELY HITTING for initial image upload
 @app.post("/api/analyze_chart") # REVERTED back to original name
-async def analyze_chart(request_body: ChartUploadRequest):
-    global last_uploaded_image_pil # Declare intent to modify global variable
-
+async def analyze_chart(request_body: ChartUploadRequest, request: Request):
     try:
         # Decode the Base64 string to bytes
         image_bytes = base64.b64decode(request_body.image_data)
-        # Open the image bytes using PIL (Pillow)
-        image_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        
-        # Store the PIL image globally for later contextual analysis
-        last_uploaded_image_pil = image_pil
-
-        # Initial prompt for immediate feedback
-        initial_analysis_prompt = "Analyze this stock chart image for major trends and any obvious immediate patterns. Provide a brief overview."
-        
-        # Perform initial image analysis with a general prompt
-        initial_analysis_response = gemini_chatbot.analyze_chart_image(
-            image=image_pil,
-            user_query=initial_analysis_prompt,
-        )
+
+        # Store the compressed bytes for this session's later contextual analysis (only the header is parsed here)
+        with metrics.stage("image_store"):
+            image_store.put(request.state.session_id, image_bytes)
+        stored_image = image_store.get(request.state.session_id)
+
+        # Perform initial image analysis with a general prompt (cached if this exact chart was analyzed before)
+        initial_analysis_response = await analyze_stored_image(stored_image, INITIAL_ANALYSIS_PROMPT)
         return JSONResponse(content={"response": f"Image received and here's a quick initial analysis:\n\n{initial_analysis_response}"})
 
     except ValueError as e:
@@ -188,6 +599,167 @@ async def analyze_chart(request_body: ChartUploadRequest):
         raise HTTPException(status_code=500, detail=f"Chart analysis failed: {e}")
 
 
+# --- Streaming Chart Upload (multipart or raw image body) ---
+# Avoids the Base64/JSON round trip of /api/analyze_chart: the body is streamed with a size cap,
+# hashed on the fly, stored compressed, and only decoded at the vision model's resolution.
+@app.post("/api/analyze_chart/upload")
+async def analyze_chart_upload(request: Request):
+    try:
+        upload = await receive_image_upload(request, max_bytes=MAX_UPLOAD_BYTES)
+        timings = {"upload_bytes": upload.size, "receive_seconds": upload.seconds}
+        metrics.observe_stage("upload_receive", upload.seconds)
+
+        stage_start = time.perf_counter()
+        image_store.put(request.state.session_id, upload.data, content_hash=upload.content_hash)
+        stored_image = image_store.get(request.state.session_id)
+        timings["store_seconds"] = time.perf_counter() - stage_start
+        metrics.observe_stage("image_store", timings["store_seconds"])
+
+        initial_analysis_response = await analyze_stored_image(stored_image, INITIAL_ANALYSIS_PROMPT, timings)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image data: {e}")
+    except Exception as e:
+        print(f"Error during chart upload and analysis: {e}")
+        raise HTTPException(status_code=500, detail=f"Chart analysis failed: {e}")
+
+    # Per-stage breakdown, also as a Server-Timing header so it shows up in the browser's network panel
+    server_timing = ", ".join(
+        f"{name.replace('_seconds', '')};dur={value * 1000:.1f}"
+        for name, value in timings.items() if name.endswith("_seconds")
+    )
+    return JSONResponse(
+        content={
+            "response": f"Image received and here's a quick initial analysis:\n\n{initial_analysis_response}",
+            "upload_stats": timings,
+        },
+        headers={"Server-Timing": server_timing},
+    )
+
+
+# --- Streaming (Server-Sent Events) Endpoints ---
+# Same answers as /api/chat and /api/analyze_chart/upload, but Gemini's text is forwarded as it is generated,
+# so the first words show up after the model's first-token latency instead of after the whole answer.
+# Events: 'message' with {"text": chunk} (repeated), then 'done' or 'error' with {"error": ...}.
+# When the client disconnects, Starlette cancels the response task, which closes the Gemini stream.
+def format_sse(payload: dict, event: str = "message") -> bytes:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+
+
+async def sse_text_stream(text_chunks, on_complete=None):
+    """
+    Wraps an async iterator of text chunks as SSE events.
+    'on_complete' is called with the full text only if the stream finished, so partial answers are never cached.
+    """
+    parts = []
+    try:
+        async for text in text_chunks:
+            parts.append(text)
+            yield format_sse({"text": text})
+    except asyncio.CancelledError:
+        print("Client disconnected, streaming response cancelled.")
+        raise
+    except Exception as e:
+        print(f"Error during streaming response: {e}")
+        yield format_sse({"error": str(e)}, "error")
+        return
+    if on_complete is not None:
+        on_complete("".join(parts))
+    yield format_sse({}, "done")
+
+
+def sse_response(events) -> StreamingResponse:
+    # X-Accel-Buffering stops nginx-style proxies from holding the events back
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def single_text(text: str):
+    yield text
+
+
+async def stream_stored_image_analysis(stored: StoredImage, prompt: str):
+    """Streaming version of analyze_stored_image. A cached analysis is sent as a single chunk."""
+    cached_analysis = image_store.get_analysis(stored.content_hash, prompt)
+    if cached_analysis is not None:
+        return sse_text_stream(single_text(cached_analysis))
+
+    image_pil = await asyncio.to_thread(image_store.load_image, stored)
+    return sse_text_stream(
+        gemini_chatbot.stream_chart_analysis_async(image=image_pil, user_query=prompt),
+        on_complete=lambda analysis: image_store.put_analysis(stored.content_hash, prompt, analysis),
+    )
+
+
+@app.post("/api/chat/stream")
+async def chat_with_gemini_stream(message: ChatMessage, request: Request, db: Session = Depends(get_db),
+                                  read_only_db: Session = Depends(get_read_only_db)):
+    user_query = message.message
+    user_query_lower = user_query.lower().strip()
+
+    if "analyze chart" in user_query_lower or "analyze image" in user_query_lower:
+        stored_image = image_store.get(request.state.session_id)
+        if not stored_image:
+            return sse_response(sse_text_stream(single_text("Please upload an image first for me to analyze.")))
+        try:
+            return sse_response(await stream_stored_image_analysis(stored_image, DETAILED_ANALYSIS_PROMPT))
+        except Exception as e:
+            print(f"Error during contextual image analysis: {e}")
+            return sse_response(sse_text_stream(single_text(f"Sorry, I had trouble analyzing the chart image: {e}")))
+
+    # Database answers are complete before the response starts (the session is closed once we return),
+    # only the conversational Gemini fallback is streamed
+    symbol = await asyncio.to_thread(resolve_symbol, db, message.symbol) # Looks the symbol up in SQLite
+    parser = QueryParser(db=db, gemini_chatbot=gemini_chatbot, sql_cache=sql_translation_cache, intent_router=intent_router,
+                         read_only_db=read_only_db, sql_sandbox=sql_sandbox, symbol=symbol)
+    parsed_result = await parser.parse_and_execute(user_query)
+    if parsed_result["type"] == "db_response":
+        return sse_response(sse_text_stream(single_text(parsed_result["content"])))
+    data_version = await asyncio.to_thread(models.get_data_version, db)
+    return sse_response(sse_text_stream(gemini_chatbot.stream_text_query_async(user_query, data_version=data_version,
+                                                                               session_id=request.state.session_id)))
+
+
+@app.post("/api/analyze_chart/stream")
+async def analyze_chart_stream(request: Request):
+    """Upload like /api/analyze_chart/upload, then stream the initial analysis."""
+    try:
+        upload = await receive_image_upload(request, max_bytes=MAX_UPLOAD_BYTES)
+        image_store.put(request.state.session_id, upload.data, content_hash=upload.content_hash)
+        stored_image = image_store.get(request.state.session_id)
+        return sse_response(await stream_stored_image_analysis(stored_image, INITIAL_ANALYSIS_PROMPT))
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image data: {e}")
+
+
+# --- Cache / Performance Statistics ---
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "stock_data_cache": {"hits": stock_data_cache.hits, "misses": stock_data_cache.misses},
+        "sql_translation_cache": sql_translation_cache.stats(),
+        "intent_router": intent_router.stats(),
+        "sql_sandbox": sql_sandbox.stats(),
+        "image_store": image_store.stats(),
+        "gemini_key_pool": gemini_chatbot.key_pool.stats(),
+        "llm_response_cache": gemini_chatbot.response_cache.stats(),
+        "conversations": gemini_chatbot.conversations.stats(),
+        "live_feed": bar_broadcaster.stats(),
+        "live_feed_relay": feed_relay.stats() if feed_relay else None,
+        "shared_state": {**shared_state.stats(), "worker": WORKER_ID},
+        "fake_gemini": fake_gemini_backend.stats() if fake_gemini_backend else None,
+    }
+
+
+# Prometheus scrape target: the stage and request latency histograms from metrics.py
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # --- Frontend Routes ---
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -0,0 +1,163 @@
+# metrics.py
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency buckets: sub-millisecond SQLite reads up to slow LLM calls and big imports
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key: tuple, extra: tuple = ()) -> str:
+    pairs = label_key + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """A Prometheus-style histogram per label set. observe() is a bisect and three additions under a lock."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {} # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = [(key, list(series)) for key, series in sorted(self._series.items())]
+        for key, series in series_items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]!r}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """A Prometheus-style counter per label set."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value!r}" for key, value in values)
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Histogram | Counter] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("stage_duration_seconds", "Time spent in one processing stage of a request or job.")
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "Time from request to response start, per route.")
+LLM_FAILED_ATTEMPTS = registry.counter("llm_failed_attempts_total", "Gemini call attempts that failed and moved on to another key (or gave up).")
+
+# --- Stage spans ---
+# The stages of the current request, when it asked for a profile (see start_profile). Worker threads started
+# with asyncio.to_thread or FastAPI's threadpool copy the context, so their stages land in the same list.
+_current_profile: contextvars.ContextVar[list | None] = contextvars.ContextVar("current_profile", default=None)
+
+
+def start_profile() -> list:
+    """Starts collecting (stage, seconds, labels) entries for the current request and returns the list."""
+    entries = []
+    _current_profile.set(entries)
+    return entries
+
+
+def observe_stage(stage: str, seconds: float, **labels):
+    STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.append((stage, seconds, labels))
+
+
+@contextmanager
+def stage(name: str, **labels):
+    """
+    Times the block as stage 'name'. Yields the labels dict, so the block can add labels it only knows at the end
+    (e.g. an outcome); a block that raises gets outcome="error" unless it set one.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield labels
+    except BaseException:
+        labels.setdefault("outcome", "error")
+        raise
+    finally:
+        observe_stage(name, time.perf_counter() - start_time, **labels)
+
+
+def timed(name: str, **labels):
+    """Decorator form of stage() for whole functions."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(entries: list) -> str:
+    """A Server-Timing header value for profile entries, so the breakdown shows up in the browser's network panel."""
+    parts = []
+    for stage_name, seconds, labels in entries:
+        description = " ".join(f"{name}={value}" for name, value in labels.items())
+        parts.append(f'{stage_name};dur={seconds * 1000:.2f}' + (f';desc="{description}"' if description else ""))
+    return ", ".join(parts)
@@ -1,24 +1,110 @@
 import os
+import io
+import re
+import json
+import time
+import argparse
+import random
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, Date, Float
+from sqlalchemy import create_engine, event, Column, Integer, String, Date, Float, Index, MetaData, Table, text, select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from typing import Callable, NamedTuple
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+import metrics
+from data_service.indicators import compute_indicators, STATE_COLUMNS, LOOKBACK_BARS
 
 # --- Database Configuration ---
-DATABASE_FILE = "tesla_stock.db"
+# All three paths can be overridden from the environment, e.g. to point a server at a benchmark database
+DATABASE_FILE = os.getenv("DATABASE_FILE", "tesla_stock.db")
 DATABASE_URL = f"sqlite:///{DATABASE_FILE}"
 # IMPORTANT: Make sure your CSV file is named "TSLA stock data.csv" or update this path
-CSV_FILE = "cleaneddata.csv"
+CSV_FILE = os.getenv("CSV_FILE", "cleaneddata.csv")
+# Rows per pandas chunk when streaming large CSV files
+IMPORT_CHUNKSIZE = 100_000
+# Remembers how far into the CSV the incremental sync has read, so restarts don't rescan the whole file
+INGEST_CHECKPOINT_FILE = os.getenv("INGEST_CHECKPOINT_FILE", "ingest_checkpoint.json")
+# Bytes read per block by the incremental sync
+SYNC_BLOCK_SIZE = 16 * 1024 * 1024
+# Held while the database is initialized, so N uvicorn workers starting at once take turns instead of racing
+INIT_LOCK_FILE = os.getenv("INIT_LOCK_FILE", f"{DATABASE_FILE}.init.lock")
+
+# --- Storage Mode / Engine Configuration ---
+# "production" (default): WAL journal, memory-mapped reads and a larger page cache on every pooled connection,
+# so dashboard reads keep going while ingestion writes. "default": SQLite's stock settings.
+DB_STORAGE_MODE = os.getenv("DB_STORAGE_MODE", "production")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+
+# Applied to each new connection in production mode. journal_mode=WAL is stored in the database file itself.
+PRODUCTION_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL", # Durable with WAL except for the last commits on power loss; no fsync per commit
+    "mmap_size": str(256 * 1024 * 1024), # Read pages straight from the OS page cache
+    "cache_size": "-65536", # ~64 MB page cache per connection
+    "temp_store": "MEMORY",
+    "busy_timeout": "5000", # Wait up to 5s for a writer instead of failing with "database is locked"
+}
+
+def create_db_engine(database_file: str = DATABASE_FILE, storage_mode: str = DB_STORAGE_MODE, read_only: bool = False):
+    """
+    Creates an engine for 'database_file'.
+    Connections come from a QueuePool sized for the threadpool workers (sessions are handed to worker threads,
+    hence check_same_thread=False). With read_only=True the file is opened with mode=ro and query_only,
+    so nothing executed through it can modify the database.
+    """
+    if read_only:
+        url = f"sqlite:///file:{database_file}?mode=ro&uri=true"
+    else:
+        url = f"sqlite:///{database_file}"
+    db_engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        # Pooled connections live long, so a bigger per-connection prepared statement cache keeps
+        # repeated (cached) generated SQL from being recompiled
+        connect_args={"check_same_thread": False, "timeout": 5, "cached_statements": 256},
+    )
+
+    pragmas = dict(PRODUCTION_PRAGMAS) if storage_mode == "production" else {}
+    if read_only:
+        pragmas.pop("journal_mode", None) # Can't be changed on a read-only connection
+        pragmas["query_only"] = "ON"
+
+    @event.listens_for(db_engine, "connect")
+    def _apply_connection_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return db_engine
 
 # Create a SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+engine = create_db_engine()
+# Separate read-only engine for SQL we didn't write ourselves (Text-to-SQL from the LLM)
+read_only_engine = create_db_engine(read_only=True)
 
 # Base class for declarative models
 Base = declarative_base()
 
 # Configure sessionmaker
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadOnlySessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_only_engine)
 
 # --- Define the StockData Model ---
 class StockData(Base):
@@ -39,105 +125,985 @@ class StockData(Base):
     resistance_lower = Column(Float, nullable=True)
     resistance_upper = Column(Float, nullable=True)
 
+    # Covering indexes for the common range queries: "close/volume over a period" and "signal counts over a period"
+    # are answered from the index alone, without touching the table rows.
+    __table_args__ = (
+        Index("ix_tesla_stock_timestamp_close", "timestamp", "close_price"),
+        Index("ix_tesla_stock_timestamp_volume", "timestamp", "volume"),
+        Index("ix_tesla_stock_direction_timestamp", "direction", "timestamp"), # Equality column first
+    )
+
     def __repr__(self):
         return f"<StockData(timestamp='{self.timestamp}', close={self.close_price})>"
 
+# --- Individual Support / Resistance Levels ---
+class StockLevel(Base):
+    """
+    Every level from the CSV 'Support'/'Resistance' lists, one row per (day, kind, position in the list).
+    tesla_stock only keeps the min/max of each list; this child table keeps the full sets.
+    """
+    __tablename__ = "tesla_stock_levels"
+
+    timestamp = Column(Date, primary_key=True) # Same day as the tesla_stock row
+    kind = Column(String, primary_key=True) # 'support' or 'resistance'
+    position = Column(Integer, primary_key=True) # Index in the original list, keeps the CSV order
+    price = Column(Float, nullable=False)
+
+    # Sorted by price within each kind, so "levels within X of a price" and "nearest level" are a range seek
+    # on the index (O(log n) plus the matches) instead of a scan; timestamp rides along so no table lookup is needed.
+    __table_args__ = (
+        Index("ix_tesla_stock_levels_kind_price", "kind", "price", "timestamp"),
+    )
+
+LEVEL_KINDS = {"Support": "support", "Resistance": "resistance"} # CSV column -> StockLevel.kind
+
+# --- Pre-aggregated Rollups (weekly / monthly / yearly) ---
+class RollupColumns:
+    """
+    Columns shared by every rollup table. One row per period, keyed by the first calendar day of the period.
+    These are maintained at ingest time (see refresh_rollups) so period statistics never need a full scan.
+    """
+    period_start = Column(Date, primary_key=True) # Monday of the week / 1st of the month / Jan 1st
+    period_end = Column(Date, nullable=False) # Date of the last bar in the period
+    bar_count = Column(Integer, nullable=False)
+
+    # OHLCV of the whole period
+    open_price = Column(Float, nullable=False) # Open of the first bar
+    high_price = Column(Float, nullable=False)
+    low_price = Column(Float, nullable=False)
+    close_price = Column(Float, nullable=False) # Close of the last bar
+    volume = Column(Float, nullable=False) # Total volume
+
+    # Per-bar statistics over the period
+    avg_close = Column(Float, nullable=False)
+    min_close = Column(Float, nullable=False)
+    max_close = Column(Float, nullable=False)
+    avg_volume = Column(Float, nullable=False)
+    min_volume = Column(Float, nullable=False)
+    max_volume = Column(Float, nullable=False)
+
+    # Signal counts
+    long_count = Column(Integer, nullable=False)
+    short_count = Column(Integer, nullable=False)
+
+class WeeklyRollup(RollupColumns, Base):
+    __tablename__ = "tesla_stock_weekly"
+
+class MonthlyRollup(RollupColumns, Base):
+    __tablename__ = "tesla_stock_monthly"
+
+class YearlyRollup(RollupColumns, Base):
+    __tablename__ = "tesla_stock_yearly"
+
+# interval -> (rollup model, SQLite expression for a bar's period start, same thing in Python)
+ROLLUP_INTERVALS = {
+    "1w": (WeeklyRollup, "date(timestamp, 'weekday 0', '-6 days')", lambda day: day - timedelta(days=day.weekday())),
+    "1mo": (MonthlyRollup, "strftime('%Y-%m-01', timestamp)", lambda day: day.replace(day=1)),
+    "1y": (YearlyRollup, "strftime('%Y-01-01', timestamp)", lambda day: day.replace(month=1, day=1)),
+}
+
+def refresh_rollups(conn, since: date | None = None):
+    """
+    Rebuilds the rollup rows for every period that contains a bar dated 'since' or later
+    (all periods if 'since' is None). Call it inside the ingest transaction, after the bars are written.
+    Only the touched periods are recomputed, and the source rows are found through the 'timestamp' index.
+    """
+    for model, period_expr, period_start_of in ROLLUP_INTERVALS.values():
+        table_name = model.__tablename__
+        params = {}
+        where_sql = ""
+        if since is not None:
+            params["cutoff"] = period_start_of(since).isoformat()
+            where_sql = "WHERE timestamp >= :cutoff"
+            conn.execute(text(f"DELETE FROM {table_name} WHERE period_start >= :cutoff"), params)
+        else:
+            conn.execute(text(f"DELETE FROM {table_name}"))
+
+        conn.execute(text(f"""
+            INSERT INTO {table_name} (
+                period_start, period_end, bar_count, open_price, high_price, low_price, close_price, volume,
+                avg_close, min_close, max_close, avg_volume, min_volume, max_volume, long_count, short_count
+            )
+            SELECT
+                period_start, MAX(timestamp), COUNT(*), MAX(period_open), MAX(high_price), MIN(low_price), MAX(period_close), SUM(volume),
+                AVG(close_price), MIN(close_price), MAX(close_price), AVG(volume), MIN(volume), MAX(volume),
+                SUM(CASE WHEN direction = 'LONG' THEN 1 ELSE 0 END), SUM(CASE WHEN direction = 'SHORT' THEN 1 ELSE 0 END)
+            FROM (
+                SELECT
+                    {period_expr} AS period_start, timestamp, high_price, low_price, close_price, volume, direction,
+                    FIRST_VALUE(open_price) OVER period_bars AS period_open,
+                    LAST_VALUE(close_price) OVER period_bars AS period_close
+                FROM tesla_stock
+                {where_sql}
+                WINDOW period_bars AS (
+                    PARTITION BY {period_expr} ORDER BY timestamp
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                )
+            )
+            GROUP BY period_start
+        """), params)
+
+def ensure_rollups():
+    """
+    Rebuilds the rollup tables if they don't cover every bar, e.g. for databases created before they existed.
+    """
+    with engine.begin() as conn:
+        bar_count = conn.execute(text("SELECT COUNT(*) FROM tesla_stock")).scalar()
+        rolled_up_count = conn.execute(text(f"SELECT COALESCE(SUM(bar_count), 0) FROM {YearlyRollup.__tablename__}")).scalar()
+        if bar_count != rolled_up_count:
+            print("Building weekly/monthly/yearly rollup tables...")
+            refresh_rollups(conn)
+            bump_data_version(conn)
+
+# --- Technical Indicators (SMA / EMA / RSI / ATR / Bollinger / VWAP) ---
+class StockIndicators(Base):
+    """
+    One row of precomputed indicators per bar in 'tesla_stock', joined on timestamp.
+    Maintained at ingest time by refresh_indicators(); the math lives in data_service/indicators.py.
+    """
+    __tablename__ = "tesla_stock_indicators"
+
+    timestamp = Column(Date, primary_key=True)
+    sma_20 = Column(Float, nullable=True)
+    sma_50 = Column(Float, nullable=True)
+    sma_200 = Column(Float, nullable=True)
+    ema_12 = Column(Float, nullable=True)
+    ema_26 = Column(Float, nullable=True)
+    rsi_14 = Column(Float, nullable=True)
+    atr_14 = Column(Float, nullable=True)
+    bb_middle = Column(Float, nullable=True)
+    bb_upper = Column(Float, nullable=True)
+    bb_lower = Column(Float, nullable=True)
+    vwap_20 = Column(Float, nullable=True)
+
+    # Wilder averages behind rsi_14, kept so appended bars can continue the series
+    rsi_avg_gain = Column(Float, nullable=True)
+    rsi_avg_loss = Column(Float, nullable=True)
+
+INDICATOR_BAR_COLUMNS = ["timestamp", "high_price", "low_price", "close_price", "volume"]
+
+def _read_bars(conn, where_sql: str = "", params: dict | None = None, order: str = "ASC", limit: int | None = None) -> pd.DataFrame:
+    limit_sql = f"LIMIT {int(limit)}" if limit is not None else ""
+    rows = conn.execute(text(
+        f"SELECT {', '.join(INDICATOR_BAR_COLUMNS)} FROM tesla_stock {where_sql} ORDER BY timestamp {order} {limit_sql}"
+    ), params or {}).all()
+    return pd.DataFrame(rows, columns=INDICATOR_BAR_COLUMNS)
+
+def refresh_indicators(conn, since: date | None = None) -> int:
+    """
+    Recomputes the indicator rows for every bar dated 'since' or later (all bars if 'since' is None).
+    Call it inside the ingest transaction, after the bars are written.
+
+    When appending, only the new bars are computed: the rolling windows read LOOKBACK_BARS of history
+    and the recursive indicators continue from the stored row of the previous bar. If that history
+    isn't there (a fresh table, or a correction near the start of the series) everything is recomputed.
+    Returns the number of indicator rows written.
+    """
+    table_name = StockIndicators.__tablename__
+    bars = None
+    start = 0
+    state = None
+    if since is not None:
+        params = {"since": since.isoformat()}
+        history = _read_bars(conn, "WHERE timestamp < :since", params, order="DESC", limit=LOOKBACK_BARS)
+        state_row = conn.execute(text(
+            f"SELECT timestamp, {', '.join(STATE_COLUMNS)} FROM {table_name} WHERE timestamp < :since ORDER BY timestamp DESC LIMIT 1"
+        ), params).first()
+        if (len(history) == LOOKBACK_BARS and state_row is not None
+                and str(state_row[0]) == str(history["timestamp"].iloc[0]) and None not in state_row[1:]):
+            new_bars = _read_bars(conn, "WHERE timestamp >= :since", params)
+            bars = pd.concat([history.iloc[::-1], new_bars], ignore_index=True)
+            start = len(history)
+            state = dict(zip(STATE_COLUMNS, state_row[1:]))
+            conn.execute(text(f"DELETE FROM {table_name} WHERE timestamp >= :since"), params)
+
+    if bars is None:
+        bars = _read_bars(conn)
+        conn.execute(text(f"DELETE FROM {table_name}"))
+
+    if len(bars) <= start:
+        return 0
+    indicators = compute_indicators(bars, start=start, state=state)
+    indicators.insert(0, "timestamp", [date.fromisoformat(str(day)) for day in bars["timestamp"].iloc[start:]])
+    # NaN -> NULL
+    records = indicators.astype(object).where(indicators.notna(), None).to_dict("records")
+    conn.execute(StockIndicators.__table__.insert(), records)
+    return len(records)
+
+def ensure_indicators():
+    """
+    Rebuilds the indicators table if it doesn't cover every bar, e.g. for databases created before it existed.
+    """
+    with engine.begin() as conn:
+        bar_count = conn.execute(text("SELECT COUNT(*) FROM tesla_stock")).scalar()
+        indicator_count = conn.execute(text(f"SELECT COUNT(*) FROM {StockIndicators.__tablename__}")).scalar()
+        if bar_count != indicator_count:
+            print("Building technical indicators table...")
+            refresh_indicators(conn)
+            bump_data_version(conn)
+
+def ensure_levels(csv_file: str = CSV_FILE):
+    """
+    Fills the levels table from the CSV if it is empty while bars exist, e.g. for databases created before it existed
+    (the bars only kept the min/max of each list, so the levels have to come from the source file).
+    """
+    with engine.begin() as conn:
+        if conn.execute(select(StockLevel.timestamp).limit(1)).first() is not None:
+            return
+        if conn.execute(select(StockData.id).limit(1)).first() is None or not os.path.exists(csv_file):
+            return
+        print("Building support/resistance levels table...")
+        stored_days = {row[0] for row in conn.execute(select(StockData.timestamp))}
+        for chunk in pd.read_csv(csv_file, usecols=["timestamp", *LEVEL_KINDS], chunksize=IMPORT_CHUNKSIZE):
+            timestamps = pd.to_datetime(chunk["timestamp"]).dt.date
+            timestamps = timestamps[timestamps.isin(stored_days)]
+            level_lists = {kind: parse_level_lists(chunk[column]) for column, kind in LEVEL_KINDS.items()}
+            replace_levels(conn, timestamps.tolist(), prepare_level_rows(timestamps, level_lists))
+        bump_data_version(conn)
+
+def ensure_indexes():
+    """
+    Creates indexes declared on the models that an existing database doesn't have yet
+    (create_all only creates indexes together with new tables), then refreshes the planner statistics.
+    """
+    created = False
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA index_list('{table.name}')")}
+            for index in table.indexes:
+                if index.name not in existing:
+                    print(f"Creating index {index.name}...")
+                    index.create(conn)
+                    created = True
+        if created:
+            conn.exec_driver_sql("ANALYZE")
+
+# --- Data Version Tracking ---
+class DataVersion(Base):
+    """
+    Single-row counter that is bumped every time the stock table changes.
+    Caches key their entries on this value, so a primary-key lookup is enough to know if they are stale.
+    """
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+def get_data_version(db) -> int:
+    """
+    Returns the current data version. Accepts a Session or a Connection.
+    """
+    row = db.execute(text("SELECT version FROM data_version WHERE id = 1")).first()
+    return row[0] if row else 0
+
+def bump_data_version(db):
+    """
+    Increments the data version. Call this inside the same transaction that modifies the stock table.
+    """
+    db.execute(text(
+        "INSERT INTO data_version (id, version) VALUES (1, 1) "
+        "ON CONFLICT(id) DO UPDATE SET version = version + 1"
+    ))
+
+# --- Ingest Events ---
+# Called with (symbol, bars) after an ingest commits, where 'bars' are the new or updated rows in the
+# shape of prepare_csv_chunk's bars. The live feed subscribes here instead of polling the database.
+_ingest_listeners: list[Callable[[str, list[dict]], None]] = []
+
+def add_ingest_listener(listener: Callable[[str, list[dict]], None]):
+    _ingest_listeners.append(listener)
+
+def remove_ingest_listener(listener: Callable[[str, list[dict]], None]):
+    if listener in _ingest_listeners:
+        _ingest_listeners.remove(listener)
+
+def notify_ingest(symbol: str, bars: list[dict]):
+    """Hands committed bars to every listener. A failing listener never fails the ingest."""
+    if not bars:
+        return
+    for listener in list(_ingest_listeners):
+        try:
+            listener(symbol, bars)
+        except Exception as e:
+            print(f"Warning: Ingest listener failed: {e}")
+
 # --- Database Initialization and Data Ingestion Logic ---
+@contextmanager
+def exclusive_file_lock(lock_file: str):
+    """Blocks until this process holds an exclusive lock on 'lock_file' (created if needed), across processes."""
+    with open(lock_file, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            return
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1) # Gives up with OSError after ~10 seconds
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
 def initialize_database():
     """
-    Creates tables if they don't exist and populates data from CSV if the table is empty.
+    Creates tables if they don't exist, bulk-imports the CSV if the table is empty,
+    and otherwise syncs any rows appended to the CSV since the last run.
+    Runs under INIT_LOCK_FILE: workers that start while another one initializes wait, then find the work done.
     """
-    Base.metadata.create_all(engine) # Create all tables defined in Base
+    with exclusive_file_lock(INIT_LOCK_FILE):
+        Base.metadata.create_all(engine) # Create all tables defined in Base
+        ensure_indexes()
+        with engine.begin() as conn:
+            refresh_symbol_bars_view(conn)
 
-    db = SessionLocal()
-    try:
-        # Check if the table is empty
-        if db.query(StockData).count() == 0:
-            print(f"Database table '{StockData.__tablename__}' is empty. Importing data from '{CSV_FILE}'...")
-            import_data_from_csv(db)
-            print("Data import complete.")
-        else:
-            print(f"Database table '{StockData.__tablename__}' already contains data. Skipping CSV import.")
-    except Exception as e:
-        print(f"Error initializing database: {e}")
-        # Rollback in case of error to leave the DB in a consistent state
-        db.rollback()
-    finally:
-        db.close()
+        db = SessionLocal()
+        try:
+            # Check if the table is empty (an indexed lookup, not a full COUNT)
+            if db.query(StockData.id).first() is None:
+                print(f"Database table '{StockData.__tablename__}' is empty. Importing data from '{CSV_FILE}'...")
+                rows_imported = import_data_from_csv()
+                save_ingest_checkpoint(CSV_FILE)
+                print(f"Data import complete. {rows_imported} rows imported.")
+            else:
+                ensure_rollups()
+                ensure_indicators()
+                ensure_levels()
+                rows_synced = sync_data_from_csv()
+                print(f"Database table '{StockData.__tablename__}' already contains data. Synced {rows_synced} new/updated rows from '{CSV_FILE}'.")
+        except Exception as e:
+            print(f"Error initializing database: {e}")
+            # Rollback in case of error to leave the DB in a consistent state
+            db.rollback()
+        finally:
+            db.close()
+
+# --- CSV Parsing Helpers ---
+EXPECTED_CSV_COLUMNS = ['timestamp', 'direction', 'Support', 'Resistance', 'open', 'high', 'low', 'close', 'volume']
 
-def import_data_from_csv(db):
+# SQLite settings used only while a bulk import is running (values are restored afterwards).
+# synchronous=OFF skips fsyncs; an application crash is still safe, a power loss mid-import may need a re-import.
+IMPORT_PRAGMAS = {
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-200000", # ~200 MB page cache
+}
+
+def parse_level_lists(list_strings: pd.Series) -> pd.Series:
     """
-    Reads data from the CSV file and populates the database.
+    Vectorized parsing of list strings such as "[835, 840, 845]" into one float per list entry,
+    indexed by the source row (so a row appears once per entry, in list order).
+    Empty or missing lists have no entries. A list with any unparseable entry is skipped entirely,
+    which matches how the old row-by-row parser behaved.
     """
-    if not os.path.exists(CSV_FILE):
-        raise FileNotFoundError(f"CSV file not found at: {CSV_FILE}. Please ensure it's in the same directory.")
+    # Drop brackets and whitespace in one pass, then give every list entry its own row (index = source row)
+    values = (
+        list_strings.astype(object).str.replace(r"[\[\]\s]", "", regex=True)
+        .str.split(",").explode()
+    )
+    values = values[values.notna() & (values != "")]
+    try:
+        numbers = values.astype("float64") # Fast path: every entry is a plain number
+    except ValueError:
+        numbers = pd.to_numeric(values, errors="coerce")
+
+    bad_rows = numbers.index[numbers.isna()].unique()
+    if len(bad_rows) > 0:
+        print(f"Warning: Could not parse {len(bad_rows)} list string(s) in column '{list_strings.name}'. Skipping support/resistance for those rows.")
+        numbers = numbers[~numbers.index.isin(bad_rows)]
+    return numbers
+
+def level_bounds(levels: pd.Series, index: pd.Index) -> tuple[pd.Series, pd.Series]:
+    """Min and max of each row's levels (from parse_level_lists), NaN for rows without any."""
+    bounds = levels.groupby(level=0).agg(["min", "max"]).reindex(index)
+    return bounds["min"], bounds["max"]
 
-    df = pd.read_csv(CSV_FILE)
+def parse_min_max_lists(list_strings: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """Vectorized parsing of list strings such as "[835, 840, 845]" into their min and max values."""
+    return level_bounds(parse_level_lists(list_strings), list_strings.index)
+
+class PreparedChunk(NamedTuple):
+    bars: list[dict] # Rows for tesla_stock
+    levels: list[dict] # Rows for tesla_stock_levels
+
+def prepare_level_rows(timestamps: pd.Series, level_lists: dict[str, pd.Series]) -> list[dict]:
+    """
+    Builds tesla_stock_levels rows from parsed level lists ({kind: parse_level_lists(...)}),
+    for the source rows in 'timestamps' (a Series of dates indexed by source row).
+    """
+    timestamps = timestamps[~timestamps.duplicated(keep="last")] # A repeated day: the last row wins, like the upsert
+    frames = []
+    for kind, levels in level_lists.items():
+        levels = levels[levels.index.isin(timestamps.index)]
+        frames.append(pd.DataFrame({
+            "timestamp": timestamps.loc[levels.index].to_numpy(),
+            "kind": kind,
+            "position": levels.groupby(level=0).cumcount().to_numpy(),
+            "price": levels.to_numpy(),
+        }))
+    level_rows = pd.concat(frames, ignore_index=True)
+    column_values = [level_rows[name].tolist() for name in level_rows.columns]
+    return [dict(zip(level_rows.columns, row)) for row in zip(*column_values)]
 
+def prepare_csv_chunk(df: pd.DataFrame, since: date | None = None) -> PreparedChunk:
+    """
+    Turns one raw CSV chunk into parameter dicts ready for Core executemany inserts:
+    the bars, and every individual support/resistance level.
+    If 'since' is given, rows dated before it are dropped.
+    """
     # Clean column names to remove leading/trailing spaces if any
     df.columns = df.columns.str.strip()
 
     # --- Crucial check: Verify expected columns are present ---
-    expected_columns = ['timestamp', 'direction', 'Support', 'Resistance', 'open', 'high', 'low', 'close', 'volume']
-    if not all(col in df.columns for col in expected_columns):
-        missing_cols = [col for col in expected_columns if col not in df.columns]
+    missing_cols = [col for col in EXPECTED_CSV_COLUMNS if col not in df.columns]
+    if missing_cols:
         raise ValueError(f"CSV is missing expected columns: {missing_cols}. Please check your CSV file header.")
 
-    # Data cleaning and type conversion
-    df['timestamp'] = pd.to_datetime(df['timestamp']).dt.date # Convert to date objects
-
-    # Rename columns to match model attributes for direct mapping
-    df.rename(columns={
-        'open': 'open_price',
-        'high': 'high_price',
-        'low': 'low_price',
-        'close': 'close_price'
-    }, inplace=True)
-
-    # Process Support and Resistance columns
-    stock_data_to_add = []
-    for index, row in df.iterrows():
-        # Function to parse list string and get min/max
-        def parse_min_max_list(list_str):
-            # Ensure it's treated as a string, handle NaN/None
-            if pd.isna(list_str) or not str(list_str).strip('[]').strip():
-                return None, None
+    level_lists = {kind: parse_level_lists(df[column]) for column, kind in LEVEL_KINDS.items()}
+    support_lower, support_upper = level_bounds(level_lists['support'], df.index)
+    resistance_lower, resistance_upper = level_bounds(level_lists['resistance'], df.index)
+
+    # Direction is None if NaN/empty, otherwise its (stripped) string value
+    direction = df['direction'].astype("string").str.strip()
+    direction = direction.mask(direction == "")
+
+    prepared = pd.DataFrame({
+        'timestamp': pd.to_datetime(df['timestamp']).dt.date, # Convert to date objects
+        'direction': direction,
+        'open_price': df['open'],
+        'high_price': df['high'],
+        'low_price': df['low'],
+        'close_price': df['close'],
+        'volume': df['volume'],
+        'support_lower': support_lower,
+        'support_upper': support_upper,
+        'resistance_lower': resistance_lower,
+        'resistance_upper': resistance_upper,
+    })
+
+    if since is not None:
+        prepared = prepared[prepared['timestamp'] >= since]
+
+    levels = prepare_level_rows(prepared['timestamp'], level_lists)
+
+    # NaN/NA -> None so SQLite stores NULL. Building the dicts from column lists is much cheaper than to_dict("records").
+    prepared = prepared.astype(object).where(prepared.notna(), None)
+    column_names = list(prepared.columns)
+    column_values = [prepared[name].tolist() for name in column_names]
+    return PreparedChunk([dict(zip(column_names, row)) for row in zip(*column_values)], levels)
+
+def iter_csv_chunks(csv_file: str, chunksize: int = IMPORT_CHUNKSIZE):
+    """Streams the CSV file in chunks of PreparedChunk so huge files never sit fully in memory."""
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+        yield prepare_csv_chunk(chunk)
+
+def _set_pragmas(conn, pragmas: dict) -> dict:
+    """Applies SQLite pragmas on a connection and returns the previous values so they can be restored."""
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+        conn.exec_driver_sql(f"PRAGMA {name} = {value}")
+    return previous
+
+@metrics.timed("ingest", source="csv_import")
+def import_data_from_csv(csv_file: str = CSV_FILE, chunksize: int = IMPORT_CHUNKSIZE) -> int:
+    """
+    Reads data from the CSV file and bulk-inserts it into the database.
+    All chunks go in through a single transaction with Core executemany, so either the whole file lands or nothing does.
+    Returns the number of rows inserted.
+    """
+    if not os.path.exists(csv_file):
+        raise FileNotFoundError(f"CSV file not found at: {csv_file}. Please ensure it's in the same directory.")
+
+    insert_stmt = StockData.__table__.insert()
+    level_insert_stmt = StockLevel.__table__.insert()
+    total_rows = 0
+
+    with engine.connect() as conn:
+        previous_pragmas = _set_pragmas(conn, IMPORT_PRAGMAS)
+        try:
+            for prepared in iter_csv_chunks(csv_file, chunksize):
+                if prepared.bars:
+                    conn.execute(insert_stmt, prepared.bars)
+                    total_rows += len(prepared.bars)
+                if prepared.levels:
+                    conn.execute(level_insert_stmt, prepared.levels)
+            refresh_rollups(conn)
+            refresh_indicators(conn)
+            bump_data_version(conn) # Invalidate any cached API responses
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _set_pragmas(conn, previous_pragmas)
+            conn.commit()
+
+    return total_rows
+
+# --- Incremental Sync (upsert of newly appended CSV rows) ---
+def _complete_lines_end(csv_file: str) -> int:
+    """Byte offset just past the last newline in the file, i.e. the end of the last complete line."""
+    with open(csv_file, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline_index = block.rfind(b"\n")
+            if newline_index != -1:
+                return position - step + newline_index + 1
+            position -= step
+    return 0
+
+def _line_before(f, offset: int) -> str:
+    """The (up to 256 byte) tail of the line that ends at 'offset'. Used to detect a rewritten CSV."""
+    start = max(0, offset - 256)
+    f.seek(start)
+    return f.read(offset - start).decode("utf-8", errors="replace")
+
+def save_ingest_checkpoint(csv_file: str = CSV_FILE, offset: int | None = None, checkpoint_file: str = INGEST_CHECKPOINT_FILE):
+    """
+    Records how far into 'csv_file' has been ingested. Defaults to the end of the last complete line.
+    Written atomically so a crash never leaves a half-written checkpoint behind.
+    """
+    if offset is None:
+        offset = _complete_lines_end(csv_file)
+    with open(csv_file, "rb") as f:
+        header = f.readline().decode("utf-8").strip()
+        line_tail = _line_before(f, offset)
+
+    checkpoint = {
+        "csv_file": os.path.abspath(csv_file),
+        "header": header,
+        "offset": offset,
+        "line_tail": line_tail,
+    }
+    temp_file = f"{checkpoint_file}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_file, checkpoint_file)
+
+def load_ingest_checkpoint(csv_file: str = CSV_FILE, checkpoint_file: str = INGEST_CHECKPOINT_FILE) -> int | None:
+    """
+    Returns the byte offset to resume reading 'csv_file' from, or None if there is no usable checkpoint
+    (missing, for another file, or the file was truncated/rewritten since it was taken).
+    """
+    if not os.path.exists(checkpoint_file):
+        return None
+    try:
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("csv_file") != os.path.abspath(csv_file):
+            return None
+
+        offset = checkpoint["offset"]
+        if offset > os.path.getsize(csv_file):
+            return None
+        with open(csv_file, "rb") as f:
+            if f.readline().decode("utf-8").strip() != checkpoint["header"]:
+                return None
+            if _line_before(f, offset) != checkpoint["line_tail"]:
+                return None
+        return offset
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: Ignoring unreadable ingest checkpoint '{checkpoint_file}': {e}")
+        return None
+
+def get_last_timestamp(conn) -> date | None:
+    """Latest stored bar date (an index lookup on the unique 'timestamp' column)."""
+    return conn.execute(select(func.max(StockData.timestamp))).scalar()
+
+def upsert_records(conn, records: list[dict]):
+    """INSERT ... ON CONFLICT(timestamp) DO UPDATE for a batch of prepared rows."""
+    stmt = sqlite_insert(StockData.__table__)
+    update_columns = {
+        column.name: stmt.excluded[column.name]
+        for column in StockData.__table__.columns
+        if column.name not in ("id", "timestamp")
+    }
+    conn.execute(stmt.on_conflict_do_update(index_elements=["timestamp"], set_=update_columns), records)
+
+def replace_levels(conn, timestamps: list[date], levels: list[dict]):
+    """Replaces the stored support/resistance levels of the given days with 'levels' (rows from prepare_csv_chunk)."""
+    if timestamps:
+        conn.execute(StockLevel.__table__.delete().where(StockLevel.timestamp.in_(timestamps)))
+    if levels:
+        conn.execute(StockLevel.__table__.insert(), levels)
+
+def drop_unchanged_records(conn, records: list[dict], levels: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Drops the prepared rows (and their levels) that are already stored with exactly these values,
+    e.g. the last stored day when sync re-reads it and it hasn't changed since.
+    """
+    stored_rows = conn.execute(
+        select(*[column for column in StockData.__table__.columns if column.name != "id"])
+        .where(StockData.timestamp.in_([record['timestamp'] for record in records]))
+    ).all()
+    if not stored_rows:
+        return records, levels
+    stored = {row.timestamp: dict(row._mapping) for row in stored_rows}
+
+    stored_levels = {timestamp: set() for timestamp in stored}
+    for row in conn.execute(select(StockLevel.timestamp, StockLevel.kind, StockLevel.position, StockLevel.price)
+                            .where(StockLevel.timestamp.in_(list(stored)))):
+        stored_levels[row.timestamp].add(tuple(row))
+    new_levels = {timestamp: set() for timestamp in stored}
+    for level in levels:
+        if level['timestamp'] in new_levels:
+            new_levels[level['timestamp']].add((level['timestamp'], level['kind'], level['position'], level['price']))
+
+    unchanged = {
+        record['timestamp'] for record in records
+        if stored.get(record['timestamp']) == record and stored_levels[record['timestamp']] == new_levels[record['timestamp']]
+    }
+    if not unchanged:
+        return records, levels
+    return ([record for record in records if record['timestamp'] not in unchanged],
+            [level for level in levels if level['timestamp'] not in unchanged])
+
+@metrics.timed("ingest", source="csv_sync")
+def sync_data_from_csv(csv_file: str = CSV_FILE, checkpoint_file: str = INGEST_CHECKPOINT_FILE,
+                       use_checkpoint: bool = True) -> int:
+    """
+    Incrementally brings the table up to date with rows appended to the CSV.
+
+    Reading resumes at the checkpointed byte offset (or right after the header if there is none),
+    rows older than the last stored timestamp are skipped, and the rest are upserted on 'timestamp'.
+    The last stored day is re-read on purpose so a bar that was still being updated gets its final values;
+    rows identical to what is stored are skipped, so only real changes bump the data version.
+    Assumes one CSV record per line (no quoted newlines), which holds for our exports.
+    Returns the number of rows added or changed.
+    """
+    if not os.path.exists(csv_file):
+        raise FileNotFoundError(f"CSV file not found at: {csv_file}. Please ensure it's in the same directory.")
+
+    with open(csv_file, "rb") as f:
+        header_line = f.readline()
+        header_end = f.tell()
+    column_names = pd.read_csv(io.BytesIO(header_line)).columns.tolist()
+
+    offset = load_ingest_checkpoint(csv_file, checkpoint_file) if use_checkpoint else None
+    if offset is None:
+        offset = header_end
+    end_offset = _complete_lines_end(csv_file)
+
+    total_rows = 0
+    earliest_synced = None # Oldest bar written, so only the rollup periods from there on are rebuilt
+    synced_records = [] # Only kept when someone is listening for ingest events
+    if offset < end_offset:
+        with engine.connect() as conn:
+            last_timestamp = get_last_timestamp(conn)
             try:
-                # Remove brackets, split by comma, convert to float, filter out empty strings
-                values = [float(val.strip()) for val in str(list_str).strip('[]').split(',') if val.strip()]
-                if values:
-                    return min(values), max(values)
-                return None, None
-            except ValueError:
-                print(f"Warning: Could not parse list string: '{list_str}' at timestamp {row['timestamp']}. Skipping support/resistance for this row.")
-                return None, None
-
-        min_support, max_support = parse_min_max_list(row.get('Support'))
-        min_resistance, max_resistance = parse_min_max_list(row.get('Resistance'))
-
-        stock_data_to_add.append(StockData(
-            timestamp=row['timestamp'],
-            # Ensure direction is None if NaN/empty, otherwise its string value
-            direction=row['direction'] if pd.notna(row['direction']) and str(row['direction']).strip() != '' else None,
-            open_price=row['open_price'],
-            high_price=row['high_price'],
-            low_price=row['low_price'],
-            close_price=row['close_price'],
-            volume=row['volume'],
-            support_lower=min_support,
-            support_upper=max_support,
-            resistance_lower=min_resistance,
-            resistance_upper=max_resistance,
-        ))
-    
-    # Debugging: Print a few rows to ensure data looks correct before bulk insert
-    # print("\n--- Sample data to be inserted ---")
-    # for i, item in enumerate(stock_data_to_add[:5]): # Print first 5 items
-    #     print(f"Row {i+1}: Timestamp={item.timestamp}, Direction={item.direction}, Close={item.close_price}, S_Lower={item.support_lower}, R_Upper={item.resistance_upper}")
-    # print("----------------------------------\n")
-
-    db.bulk_save_objects(stock_data_to_add) # More efficient for many objects
-    db.commit()
+                with open(csv_file, "rb") as f:
+                    f.seek(offset)
+                    position = offset
+                    carry = b""
+                    while position < end_offset:
+                        block = carry + f.read(min(SYNC_BLOCK_SIZE, end_offset - position))
+                        position = f.tell()
+                        # Only parse complete lines, keep the partial tail for the next block
+                        cut = block.rfind(b"\n") + 1
+                        block, carry = block[:cut], block[cut:]
+                        if not block.strip():
+                            continue
+                        chunk = pd.read_csv(io.BytesIO(block), header=None, names=column_names)
+                        records, levels = prepare_csv_chunk(chunk, since=last_timestamp)
+                        if records:
+                            records, levels = drop_unchanged_records(conn, records, levels)
+                        if records:
+                            upsert_records(conn, records)
+                            replace_levels(conn, [record['timestamp'] for record in records], levels)
+                            total_rows += len(records)
+                            if _ingest_listeners:
+                                synced_records.extend(records)
+                            chunk_earliest = min(record['timestamp'] for record in records)
+                            earliest_synced = chunk_earliest if earliest_synced is None else min(earliest_synced, chunk_earliest)
+                if total_rows:
+                    refresh_rollups(conn, since=earliest_synced)
+                    refresh_indicators(conn, since=earliest_synced)
+                    bump_data_version(conn) # Invalidate any cached API responses
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    # Only move the checkpoint once the rows are safely committed
+    save_ingest_checkpoint(csv_file, end_offset, checkpoint_file)
+    notify_ingest(DEFAULT_SYMBOL, synced_records)
+    return total_rows
+
+# --- Multi-Symbol Storage (per-year partitions keyed on (symbol, timestamp)) ---
+# The default symbol keeps living in tesla_stock with its rollup, indicator and level tables.
+# Every other symbol goes into one table per calendar year ('stock_bars_2024', ...), so the current year's
+# partition (where appends land) stays small, and range reads only open the partitions their dates fall in.
+DEFAULT_SYMBOL = "TSLA"
+PARTITION_TABLE_PREFIX = "stock_bars_"
+# View over tesla_stock and every partition, with a 'symbol' column. Used by the Text-to-SQL prompt.
+SYMBOL_BARS_VIEW = "stock_bars"
+SYMBOL_PATTERN = re.compile(r"^[A-Z0-9][A-Z0-9.\-]{0,14}$")
+
+# Bar columns shared by tesla_stock and the partitions (everything but tesla_stock's surrogate id)
+SYMBOL_BAR_COLUMNS = [column.name for column in StockData.__table__.columns if column.name != "id"]
+
+class StockSymbol(Base):
+    """Catalog of the symbols in the partitioned store, used to list symbols and to prune partitions by year."""
+    __tablename__ = "stock_symbols"
+
+    symbol = Column(String, primary_key=True)
+    first_timestamp = Column(Date, nullable=False)
+    last_timestamp = Column(Date, nullable=False)
+    bar_count = Column(Integer, nullable=False)
+    source_file = Column(String, nullable=True) # CSV the symbol was last imported from
+
+# Partition tables are created on demand, so they live outside Base.metadata (create_all never sees them)
+partition_metadata = MetaData()
+_partition_lock = threading.Lock()
+
+def partition_table(year: int) -> Table:
+    """
+    The Table for one year's partition. (symbol, timestamp) is the primary key of a WITHOUT ROWID table,
+    so a symbol's bars are stored contiguously in date order and a range read is a single b-tree seek.
+    """
+    name = f"{PARTITION_TABLE_PREFIX}{year}"
+    with _partition_lock:
+        table = partition_metadata.tables.get(name)
+        if table is None:
+            table = Table(
+                name, partition_metadata,
+                Column("symbol", String, primary_key=True),
+                Column("timestamp", Date, primary_key=True),
+                *[Column(column.name, column.type, nullable=column.nullable)
+                  for column in StockData.__table__.columns if column.name not in ("id", "timestamp")],
+                sqlite_with_rowid=False,
+            )
+        return table
+
+def list_partition_years(conn) -> list[int]:
+    """Years that have a partition table, oldest first."""
+    names = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB :pattern"
+    ), {"pattern": f"{PARTITION_TABLE_PREFIX}[0-9][0-9][0-9][0-9]"}).scalars()
+    return sorted(int(name[len(PARTITION_TABLE_PREFIX):]) for name in names)
+
+def refresh_symbol_bars_view(conn):
+    """
+    (Re)creates the stock_bars view: tesla_stock as DEFAULT_SYMBOL plus every partition, as one UNION ALL.
+    SQLite pushes 'symbol = ...' and timestamp filters down into each branch, so filtered reads still use
+    each partition's primary key. Call it after partitions are added.
+    """
+    column_sql = ", ".join(SYMBOL_BAR_COLUMNS)
+    branches = [f"SELECT '{DEFAULT_SYMBOL}' AS symbol, {column_sql} FROM {StockData.__tablename__}"]
+    branches += [f"SELECT symbol, {column_sql} FROM {PARTITION_TABLE_PREFIX}{year}" for year in list_partition_years(conn)]
+    conn.execute(text(f"DROP VIEW IF EXISTS {SYMBOL_BARS_VIEW}"))
+    conn.execute(text(f"CREATE VIEW {SYMBOL_BARS_VIEW} AS " + " UNION ALL ".join(branches)))
+
+def normalize_symbol(symbol: str) -> str:
+    """Upper-cases a ticker and checks it is a plain symbol (letters, digits, '.' and '-')."""
+    normalized = symbol.strip().upper()
+    if not SYMBOL_PATTERN.match(normalized):
+        raise ValueError(f"Invalid symbol '{symbol}'.")
+    return normalized
+
+def symbol_from_path(csv_file: str) -> str:
+    """'data/AAPL.csv' -> 'AAPL'."""
+    return normalize_symbol(os.path.splitext(os.path.basename(csv_file))[0])
+
+def upsert_partition_records(conn, records: list[dict]) -> dict[int, int]:
+    """
+    Upserts symbol bars (prepared rows plus a 'symbol' key) into their year partitions,
+    creating partitions as needed. Returns {year: rows written}.
+    """
+    by_year = {}
+    for record in records:
+        by_year.setdefault(record["timestamp"].year, []).append(record)
+    for year, year_records in by_year.items():
+        table = partition_table(year)
+        table.create(conn, checkfirst=True)
+        stmt = sqlite_insert(table)
+        update_columns = {name: stmt.excluded[name] for name in SYMBOL_BAR_COLUMNS if name != "timestamp"}
+        conn.execute(stmt.on_conflict_do_update(index_elements=["symbol", "timestamp"], set_=update_columns), year_records)
+    return {year: len(year_records) for year, year_records in by_year.items()}
+
+def refresh_symbol_catalog(conn, symbol: str, source_file: str | None = None):
+    """Recomputes a symbol's date range and bar count from the partitions it can be in."""
+    first_day = last_day = None
+    bar_count = 0
+    for year in list_partition_years(conn):
+        table = partition_table(year)
+        count, first, last = conn.execute(
+            select(func.count(), func.min(table.c.timestamp), func.max(table.c.timestamp)).where(table.c.symbol == symbol)
+        ).one()
+        if count:
+            bar_count += count
+            first_day = first if first_day is None else min(first_day, first)
+            last_day = last if last_day is None else max(last_day, last)
+    conn.execute(StockSymbol.__table__.delete().where(StockSymbol.symbol == symbol))
+    if bar_count:
+        conn.execute(StockSymbol.__table__.insert(), {
+            "symbol": symbol, "first_timestamp": first_day, "last_timestamp": last_day,
+            "bar_count": bar_count, "source_file": source_file,
+        })
+
+def _prepare_symbol_csv(symbol: str, csv_file: str, chunksize: int) -> tuple[str, list[dict]]:
+    """Worker process: parses one symbol's CSV into partition rows."""
+    records = []
+    for prepared in iter_csv_chunks(csv_file, chunksize):
+        for bar in prepared.bars:
+            bar["symbol"] = symbol
+        records.extend(prepared.bars)
+    return symbol, records
+
+@metrics.timed("ingest", source="symbol_csvs")
+def import_symbol_csvs(csv_files: dict[str, str], processes: int | None = None, chunksize: int = IMPORT_CHUNKSIZE) -> dict[str, int]:
+    """
+    Bulk-loads many CSVs ({symbol: path}, same format as CSV_FILE) into the partitioned store.
+    Parsing is CPU-bound and runs in a process pool, one file per task; rows are written by this process
+    as files finish (SQLite has a single writer), all in one transaction. Re-importing a symbol upserts,
+    so a CSV with appended rows can simply be loaded again. Returns {symbol: rows written}.
+    """
+    csv_files = {normalize_symbol(symbol): path for symbol, path in csv_files.items()}
+    if DEFAULT_SYMBOL in csv_files:
+        raise ValueError(f"{DEFAULT_SYMBOL} is stored in '{StockData.__tablename__}'; use the 'import' or 'sync' commands for it.")
+    for path in csv_files.values():
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"CSV file not found at: {path}.")
+
+    rows_by_symbol = {}
+    new_bars = {} # Bars from each symbol's previous last day on, for ingest listeners
+    processes = min(processes or os.cpu_count() or 1, len(csv_files)) or 1
+    with engine.connect() as conn:
+        previous_pragmas = _set_pragmas(conn, IMPORT_PRAGMAS)
+        try:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                futures = [pool.submit(_prepare_symbol_csv, symbol, path, chunksize) for symbol, path in csv_files.items()]
+                for future in as_completed(futures):
+                    symbol, records = future.result()
+                    rows_by_symbol[symbol] = sum(upsert_partition_records(conn, records).values()) if records else 0
+                    if _ingest_listeners:
+                        last_day = conn.execute(select(StockSymbol.last_timestamp).where(StockSymbol.symbol == symbol)).scalar()
+                        new_bars[symbol] = [record for record in records if last_day is None or record["timestamp"] >= last_day]
+            for symbol, path in csv_files.items():
+                refresh_symbol_catalog(conn, symbol, os.path.abspath(path))
+            refresh_symbol_bars_view(conn)
+            bump_data_version(conn) # Invalidate any cached API responses
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _set_pragmas(conn, previous_pragmas)
+            conn.commit()
+
+    for symbol, bars in new_bars.items():
+        notify_ingest(symbol, bars)
+    return rows_by_symbol
+
+def get_symbol_years(db, symbol: str) -> list[int] | None:
+    """
+    Partition years that can hold 'symbol', from the catalog. None if the symbol is unknown.
+    Accepts a Session or a Connection.
+    """
+    row = db.execute(select(StockSymbol.first_timestamp, StockSymbol.last_timestamp).where(StockSymbol.symbol == symbol)).first()
+    if row is None:
+        return None
+    return list(range(row[0].year, row[1].year + 1))
+
+
+# --- Intraday Bars (1m / 5m / 1h ...) ---
+class IntradayBar(Base):
+    """
+    Bars finer than a day, for any symbol. 'ts' is the bar's start as integer epoch seconds (UTC):
+    compact, compares as a plain integer, and the (symbol, ts) primary key of this WITHOUT ROWID table stores
+    each symbol's bars contiguously in time order, so a range read is one b-tree seek plus a sequential walk.
+    Coarser bars are aggregated from these on request (data_service/resample.py).
+    """
+    __tablename__ = "intraday_bars"
+
+    symbol = Column(String, primary_key=True)
+    ts = Column(Integer, primary_key=True)
+    open_price = Column(Float, nullable=False)
+    high_price = Column(Float, nullable=False)
+    low_price = Column(Float, nullable=False)
+    close_price = Column(Float, nullable=False)
+    volume = Column(Float, nullable=False)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+INTRADAY_CSV_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+def prepare_intraday_chunk(df: pd.DataFrame, symbol: str, timezone: str | None = None) -> list[dict]:
+    """
+    Turns one raw intraday CSV chunk into intraday_bars rows. Naive timestamps are read in 'timezone'
+    (UTC if None) and stored as UTC epoch seconds; local times a DST change skips or repeats are dropped.
+    Columns other than INTRADAY_CSV_COLUMNS are ignored.
+    """
+    df.columns = df.columns.str.strip()
+    missing_cols = [col for col in INTRADAY_CSV_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Intraday CSV is missing expected columns: {missing_cols}. Please check your CSV file header.")
+
+    timestamps = pd.to_datetime(df["timestamp"])
+    if timestamps.dt.tz is None:
+        timestamps = timestamps.dt.tz_localize(timezone or "UTC", ambiguous="NaT", nonexistent="NaT")
+    valid = timestamps.notna()
+    if not valid.all():
+        print(f"Warning: Skipping {int((~valid).sum())} intraday row(s) with times that don't exist or are ambiguous in {timezone}.")
+        timestamps, df = timestamps[valid], df[valid]
+    epoch_seconds = ((timestamps - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).tolist()
+    column_values = [epoch_seconds] + [df[name].astype(float).tolist() for name in ("open", "high", "low", "close", "volume")]
+    column_names = ["ts", "open_price", "high_price", "low_price", "close_price", "volume"]
+    return [{"symbol": symbol, **dict(zip(column_names, row))} for row in zip(*column_values)]
+
+@metrics.timed("ingest", source="intraday_csv")
+def import_intraday_csv(csv_file: str, symbol: str, timezone: str | None = None, chunksize: int = IMPORT_CHUNKSIZE) -> int:
+    """
+    Streams an intraday CSV (INTRADAY_CSV_COLUMNS, any bar size) into intraday_bars, upserting on (symbol, ts)
+    so re-importing a file with appended rows only changes what is new. Returns the number of rows written.
+    """
+    if not os.path.exists(csv_file):
+        raise FileNotFoundError(f"CSV file not found at: {csv_file}.")
+    symbol = normalize_symbol(symbol)
+
+    stmt = sqlite_insert(IntradayBar.__table__)
+    upsert_stmt = stmt.on_conflict_do_update(
+        index_elements=["symbol", "ts"],
+        set_={name: stmt.excluded[name] for name in ("open_price", "high_price", "low_price", "close_price", "volume")},
+    )
+    total_rows = 0
+    with engine.connect() as conn:
+        previous_pragmas = _set_pragmas(conn, IMPORT_PRAGMAS)
+        try:
+            for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+                records = prepare_intraday_chunk(chunk, symbol, timezone)
+                if records:
+                    conn.execute(upsert_stmt, records)
+                    total_rows += len(records)
+            bump_data_version(conn) # Invalidate any cached API responses
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _set_pragmas(conn, previous_pragmas)
+            conn.commit()
+    return total_rows
+
+def has_intraday_bars(db, symbol: str) -> bool:
+    """Primary-key probe for any intraday bar of 'symbol'. Accepts a Session or a Connection."""
+    return db.execute(select(IntradayBar.ts).where(IntradayBar.symbol == symbol).limit(1)).first() is not None
+
+def symbol_exists(db, symbol: str) -> bool:
+    """True if any daily or intraday bars are stored for 'symbol'."""
+    return symbol == DEFAULT_SYMBOL or get_symbol_years(db, symbol) is not None or has_intraday_bars(db, symbol)
 
 # Dependency for FastAPI to get a database session
 def get_db():
@@ -147,13 +1113,266 @@ def get_db():
     finally:
         db.close()
 
-# This block will run when models.py is imported or executed directly
-if __name__ == "__main__":
+# Same, but on the read-only engine (for executing generated SQL)
+def get_read_only_db():
+    db = ReadOnlySessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# --- Benchmark: concurrent reads during ingest ---
+# The read mix the dashboard and the chatbot's fast path issue most often
+BENCH_READ_QUERIES = [
+    "SELECT timestamp, open_price, high_price, low_price, close_price, volume FROM tesla_stock "
+    "WHERE timestamp BETWEEN :start AND :end ORDER BY timestamp",
+    "SELECT AVG(close_price) FROM tesla_stock WHERE timestamp BETWEEN :start AND :end",
+    "SELECT MAX(volume) FROM tesla_stock WHERE timestamp BETWEEN :start AND :end",
+    "SELECT COUNT(*) FROM tesla_stock WHERE direction = 'LONG' AND timestamp BETWEEN :start AND :end",
+]
+
+def _synthetic_bars(first_day: date, count: int, seed: int) -> list[dict]:
+    """Random-walk daily bars in the shape upsert_records expects."""
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, count)))
+    opens = closes * (1 + rng.normal(0, 0.01, count))
+    highs = np.maximum(opens, closes) * (1 + rng.random(count) * 0.02)
+    lows = np.minimum(opens, closes) * (1 - rng.random(count) * 0.02)
+    volumes = rng.integers(1_000_000, 50_000_000, count)
+    directions = rng.choice(["LONG", "SHORT", None], count)
+    return [
+        {
+            "timestamp": first_day + timedelta(days=i), "direction": directions[i],
+            "open_price": float(opens[i]), "high_price": float(highs[i]), "low_price": float(lows[i]),
+            "close_price": float(closes[i]), "volume": int(volumes[i]),
+            "support_lower": float(lows[i]), "support_upper": float(lows[i]) * 1.01,
+            "resistance_lower": float(highs[i]) * 0.99, "resistance_upper": float(highs[i]),
+        }
+        for i in range(count)
+    ]
+
+def _bench_reader(database_file: str, storage_mode: str, slot: int, rows: int, seconds: float) -> tuple[list[float], int]:
+    """Reader process: runs the read mix for 'seconds', returns (latencies in seconds, errors)."""
+    reader_engine = create_db_engine(database_file, storage_mode=storage_mode)
+    rng = random.Random(slot)
+    first_day = date(1900, 1, 1)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    with reader_engine.connect() as conn:
+        while time.perf_counter() < deadline:
+            start = first_day + timedelta(days=rng.randrange(max(1, rows - 365)))
+            params = {"start": start.isoformat(), "end": (start + timedelta(days=365)).isoformat()}
+            query_start = time.perf_counter()
+            try:
+                conn.execute(text(rng.choice(BENCH_READ_QUERIES)), params).fetchall()
+                conn.rollback() # End the read transaction so the next query sees new commits
+            except Exception:
+                conn.rollback()
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - query_start)
+    reader_engine.dispose()
+    return latencies, errors
+
+def _bench_writer(database_file: str, storage_mode: str, rows: int, seconds: float, write_batch: int) -> tuple[int, int]:
+    """Writer process: upserts batches of new bars for 'seconds', returns (rows written, errors)."""
+    writer_engine = create_db_engine(database_file, storage_mode=storage_mode)
+    next_day = date(1900, 1, 1) + timedelta(days=rows)
+    rows_written = 0
+    errors = 0
+    batch_number = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        batch = _synthetic_bars(next_day, write_batch, seed=batch_number + 1)
+        try:
+            with writer_engine.begin() as conn:
+                upsert_records(conn, batch)
+                bump_data_version(conn)
+        except Exception:
+            errors += 1
+            continue
+        next_day += timedelta(days=write_batch)
+        batch_number += 1
+        rows_written += write_batch
+    writer_engine.dispose()
+    return rows_written, errors
+
+def benchmark_concurrent_reads(storage_mode: str, rows: int = 200_000, readers: int = 8,
+                               seconds: float = 5.0, write_batch: int = 500) -> dict:
+    """
+    Measures read throughput and latency while a writer keeps upserting batches, on a scratch database
+    filled with 'rows' synthetic bars. Run it once per storage mode to compare them.
+    Readers and the writer are separate processes (like uvicorn workers next to an ingest job),
+    so the numbers reflect SQLite's locking rather than the GIL.
+    """
+    # Same filesystem as the real database, so fsync costs are representative (/tmp is often tmpfs)
+    scratch_dir = tempfile.mkdtemp(prefix="tsla_bench_", dir=os.path.dirname(os.path.abspath(DATABASE_FILE)))
+    database_file = os.path.join(scratch_dir, "bench.db")
+    setup_engine = create_db_engine(database_file, storage_mode=storage_mode)
+    try:
+        Base.metadata.create_all(setup_engine)
+        with setup_engine.begin() as conn:
+            conn.execute(StockData.__table__.insert(), _synthetic_bars(date(1900, 1, 1), rows, seed=0))
+            conn.exec_driver_sql("ANALYZE")
+        setup_engine.dispose()
+
+        with ProcessPoolExecutor(max_workers=readers + 1) as executor:
+            writer_future = executor.submit(_bench_writer, database_file, storage_mode, rows, seconds, write_batch)
+            reader_futures = [
+                executor.submit(_bench_reader, database_file, storage_mode, slot, rows, seconds)
+                for slot in range(readers)
+            ]
+            reader_results = [future.result() for future in reader_futures]
+            rows_written, write_errors = writer_future.result()
+
+        all_latencies = np.array([latency for latencies, _ in reader_results for latency in latencies]) * 1000
+        p50, p95, p99 = np.percentile(all_latencies, [50, 95, 99]) if len(all_latencies) else (0.0, 0.0, 0.0)
+        return {
+            "storage_mode": storage_mode,
+            "reads_per_sec": len(all_latencies) / seconds,
+            "read_p50_ms": p50, "read_p95_ms": p95, "read_p99_ms": p99,
+            "read_errors": sum(errors for _, errors in reader_results),
+            "rows_written_per_sec": rows_written / seconds,
+            "write_errors": write_errors,
+        }
+    finally:
+        setup_engine.dispose()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+# --- Command Line Interface ---
+def _run_import(args):
+    """Bulk-imports a CSV file and reports throughput."""
+    Base.metadata.create_all(engine)
+    if args.replace:
+        with engine.begin() as conn:
+            conn.execute(StockData.__table__.delete())
+            conn.execute(StockLevel.__table__.delete())
+        print(f"Cleared existing rows from '{StockData.__tablename__}'.")
+
+    print(f"Importing '{args.csv}' in chunks of {args.chunksize} rows...")
+    start_time = time.perf_counter()
+    rows_imported = import_data_from_csv(args.csv, chunksize=args.chunksize)
+    elapsed = time.perf_counter() - start_time
+    save_ingest_checkpoint(args.csv)
+
+    rows_per_sec = rows_imported / elapsed if elapsed > 0 else float("inf")
+    print(f"Imported {rows_imported} rows in {elapsed:.2f}s ({rows_per_sec:,.0f} rows/sec).")
+
+def _run_sync(args):
+    """Upserts rows appended to the CSV since the last sync and reports how long it took."""
+    Base.metadata.create_all(engine)
+    start_time = time.perf_counter()
+    rows_synced = sync_data_from_csv(args.csv, use_checkpoint=not args.full)
+    elapsed = time.perf_counter() - start_time
+    print(f"Synced {rows_synced} new/updated rows from '{args.csv}' in {elapsed * 1000:.1f} ms.")
+
+def _run_import_symbols(args):
+    """Bulk-loads one CSV per symbol into the partitioned store and reports throughput."""
+    Base.metadata.create_all(engine)
+    csv_files = {}
+    for entry in args.csv:
+        # 'SYMBOL=path' names the symbol explicitly, otherwise it comes from the file name
+        symbol, separator, path = entry.partition("=")
+        if not separator:
+            symbol, path = symbol_from_path(entry), entry
+        csv_files[symbol] = path
+
+    print(f"Importing {len(csv_files)} symbol file(s)...")
+    start_time = time.perf_counter()
+    rows_by_symbol = import_symbol_csvs(csv_files, processes=args.processes, chunksize=args.chunksize)
+    elapsed = time.perf_counter() - start_time
+
+    total_rows = sum(rows_by_symbol.values())
+    for symbol, rows in sorted(rows_by_symbol.items()):
+        print(f"  {symbol}: {rows} rows")
+    rows_per_sec = total_rows / elapsed if elapsed > 0 else float("inf")
+    print(f"Imported {total_rows} rows in {elapsed:.2f}s ({rows_per_sec:,.0f} rows/sec).")
+
+def _run_import_intraday(args):
+    """Bulk-loads an intraday CSV for one symbol and reports throughput."""
+    Base.metadata.create_all(engine)
+    symbol = args.symbol or symbol_from_path(args.csv)
+    print(f"Importing intraday bars for {symbol} from '{args.csv}'...")
+    start_time = time.perf_counter()
+    rows_imported = import_intraday_csv(args.csv, symbol, timezone=args.timezone, chunksize=args.chunksize)
+    elapsed = time.perf_counter() - start_time
+    rows_per_sec = rows_imported / elapsed if elapsed > 0 else float("inf")
+    print(f"Imported {rows_imported} rows in {elapsed:.2f}s ({rows_per_sec:,.0f} rows/sec).")
+
+def _run_bench(args):
+    """Compares concurrent read throughput during ingest across storage modes."""
+    modes = [args.mode] if args.mode else ["default", "production"]
+    print(f"{args.readers} reader processes + 1 writer ({args.write_batch} rows/commit), {args.rows:,} bars, {args.seconds:.0f}s per mode")
+    print(f"{'mode':<12}{'reads/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'read errs':>11}{'rows written/s':>16}")
+    for mode in modes:
+        result = benchmark_concurrent_reads(mode, rows=args.rows, readers=args.readers,
+                                            seconds=args.seconds, write_batch=args.write_batch)
+        print(f"{mode:<12}{result['reads_per_sec']:>10,.0f}{result['read_p50_ms']:>10.2f}{result['read_p95_ms']:>10.2f}"
+              f"{result['read_p99_ms']:>10.2f}{result['read_errors']:>11}{result['rows_written_per_sec']:>16,.0f}")
+
+def _run_init(args):
+    """Rebuilds the database from scratch (the original behaviour of running this file)."""
     print("Running models.py directly for database initialization...")
     # First, delete the old DB file to ensure a clean start if there was an error
     if os.path.exists(DATABASE_FILE):
+        engine.dispose() # Release pooled connections before removing the file
+        read_only_engine.dispose()
         os.remove(DATABASE_FILE)
         print(f"Removed existing database file: {DATABASE_FILE}")
-    
+    for wal_file in (f"{DATABASE_FILE}-wal", f"{DATABASE_FILE}-shm"):
+        if os.path.exists(wal_file):
+            os.remove(wal_file)
+    if os.path.exists(INGEST_CHECKPOINT_FILE):
+        os.remove(INGEST_CHECKPOINT_FILE)
+
     initialize_database()
-    print("Database initialization process finished.")
\ No newline at end of file
+    print("Database initialization process finished.")
+
+# This block will run when models.py is executed directly
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Database utilities for the TSLA stock app.")
+    subparsers = arg_parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("init", help="Delete the database file and rebuild it from the CSV (default).")
+
+    import_parser = subparsers.add_parser("import", help="Bulk-import a CSV file and report rows/sec.")
+    import_parser.add_argument("--csv", default=CSV_FILE, help=f"CSV file to import (default: {CSV_FILE})")
+    import_parser.add_argument("--chunksize", type=int, default=IMPORT_CHUNKSIZE, help="Rows per chunk")
+    import_parser.add_argument("--replace", action="store_true", help="Delete existing rows before importing")
+
+    sync_parser = subparsers.add_parser("sync", help="Upsert rows appended to the CSV since the last run.")
+    sync_parser.add_argument("--csv", default=CSV_FILE, help=f"CSV file to sync from (default: {CSV_FILE})")
+    sync_parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and rescan the whole file")
+
+    symbols_parser = subparsers.add_parser("import-symbols", help="Bulk-load one CSV per symbol into the partitioned store.")
+    symbols_parser.add_argument("csv", nargs="+", help="CSV files, named after their symbol (AAPL.csv) or given as SYMBOL=path")
+    symbols_parser.add_argument("--processes", type=int, default=None, help="Parser processes (default: one per core)")
+    symbols_parser.add_argument("--chunksize", type=int, default=IMPORT_CHUNKSIZE, help="Rows per chunk")
+
+    intraday_parser = subparsers.add_parser("import-intraday", help="Bulk-load intraday bars (1m, 5m, ...) for one symbol.")
+    intraday_parser.add_argument("csv", help=f"CSV file with columns {', '.join(INTRADAY_CSV_COLUMNS)}")
+    intraday_parser.add_argument("--symbol", help="Symbol of the bars (default: from the file name)")
+    intraday_parser.add_argument("--timezone", help="Timezone of naive timestamps, e.g. America/New_York (default: UTC)")
+    intraday_parser.add_argument("--chunksize", type=int, default=IMPORT_CHUNKSIZE, help="Rows per chunk")
+
+    bench_parser = subparsers.add_parser("bench", help="Benchmark concurrent reads while rows are being ingested.")
+    bench_parser.add_argument("--mode", choices=["default", "production"], help="Only run one storage mode (default: both)")
+    bench_parser.add_argument("--rows", type=int, default=200_000, help="Synthetic bars to start with")
+    bench_parser.add_argument("--readers", type=int, default=8, help="Concurrent reader processes")
+    bench_parser.add_argument("--seconds", type=float, default=5.0, help="Duration per mode")
+    bench_parser.add_argument("--write-batch", type=int, default=500, help="Rows upserted per write transaction")
+
+    cli_args = arg_parser.parse_args()
+    if cli_args.command == "import":
+        _run_import(cli_args)
+    elif cli_args.command == "sync":
+        _run_sync(cli_args)
+    elif cli_args.command == "import-symbols":
+        _run_import_symbols(cli_args)
+    elif cli_args.command == "import-intraday":
+        _run_import_intraday(cli_args)
+    elif cli_args.command == "bench":
+        _run_bench(cli_args)
+    else:
+        _run_init(cli_args)
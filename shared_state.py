@@ -0,0 +1,276 @@
+# shared_state.py
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+try:
+    import redis # Optional, only needed for SHARED_STATE_URL=redis://...
+except ImportError:
+    redis = None
+
+# Identifies this process in leases (e.g. which uvicorn worker runs the periodic CSV sync)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Expired entries are purged on every Nth write rather than by a background thread
+PURGE_EVERY_WRITES = 500
+
+
+class StateBackend:
+    """
+    Small key/value store for state that all uvicorn workers must see the same way: chat sessions, uploaded charts,
+    API key cooldowns, live feed events. Keys are strings, values bytes; 'ttl' (seconds) makes an entry expire.
+    update() is an atomic read-modify-write, the building block for counters, leases and session updates.
+    """
+
+    name = "base"
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def touch(self, key: str, ttl: float):
+        """Pushes an existing entry's expiry to 'ttl' seconds from now."""
+        raise NotImplementedError
+
+    def update(self, key: str, function: Callable[[bytes | None], bytes | None], ttl: float | None = None) -> bytes | None:
+        """
+        Atomically replaces the value with function(current value or None); returning None deletes the entry.
+        'function' may run more than once (optimistic backends retry on conflict), so it must not have side effects.
+        Returns the new value.
+        """
+        raise NotImplementedError
+
+    def incr(self, key: str, ttl: float | None = None) -> int:
+        return int(self.update(key, lambda value: str(int(value or b"0") + 1).encode(), ttl))
+
+    def acquire_lease(self, name: str, owner: str = WORKER_ID, ttl: float = 30.0) -> bool:
+        """Takes or renews the lease 'name' for 'owner' unless another owner holds it. Holders renew before 'ttl' runs out."""
+        holder = self.update(f"lease:{name}", lambda value: value if value not in (None, owner.encode()) else owner.encode(), ttl)
+        return holder == owner.encode()
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class MemoryStateBackend(StateBackend):
+    """In-process backend for development and single-worker runs. Nothing is shared between processes."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._entries: dict[str, tuple[bytes, float | None]] = {} # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _live(self, key: str, now: float) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry[0]
+
+    def _write(self, key: str, value: bytes | None, ttl: float | None, now: float):
+        if value is None:
+            self._entries.pop(key, None)
+        else:
+            self._entries[key] = (value, now + ttl if ttl is not None else None)
+        self._writes += 1
+        if self._writes % PURGE_EVERY_WRITES == 0:
+            for expired in [k for k, (_, expires_at) in self._entries.items() if expires_at is not None and expires_at <= now]:
+                del self._entries[expired]
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        with self._lock:
+            self._write(key, value, ttl, time.time())
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def touch(self, key: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            value = self._live(key, now)
+            if value is not None:
+                self._entries[key] = (value, now + ttl)
+
+    def update(self, key: str, function: Callable[[bytes | None], bytes | None], ttl: float | None = None) -> bytes | None:
+        now = time.time()
+        with self._lock:
+            value = function(self._live(key, now))
+            self._write(key, value, ttl, now)
+            return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "entries": len(self._entries)}
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Shares state between the worker processes of one host through a SQLite file (WAL mode, one connection per thread).
+    update() runs in a BEGIN IMMEDIATE transaction, so read-modify-writes from different workers never interleave.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, database_file: str, busy_timeout: float = 30.0):
+        self.database_file = database_file
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS shared_state (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_shared_state_expires_at ON shared_state (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are explicit where a read-modify-write needs one
+            conn = sqlite3.connect(self.database_file, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _after_write(self, conn: sqlite3.Connection):
+        with self._writes_lock:
+            self._writes += 1
+            purge = self._writes % PURGE_EVERY_WRITES == 0
+        if purge:
+            conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> bytes | None:
+        row = self._connection().execute(
+            "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, time.time() + ttl if ttl is not None else None),
+        )
+        self._after_write(conn)
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def touch(self, key: str, ttl: float):
+        now = time.time()
+        self._connection().execute(
+            "UPDATE shared_state SET expires_at = ? WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (now + ttl, key, now)
+        )
+
+    def update(self, key: str, function: Callable[[bytes | None], bytes | None], ttl: float | None = None) -> bytes | None:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, now)
+            ).fetchone()
+            value = function(row[0] if row else None)
+            if value is None:
+                conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                    (key, value, now + ttl if ttl is not None else None),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._after_write(conn)
+        return value
+
+    def stats(self) -> dict:
+        entries = self._connection().execute(
+            "SELECT COUNT(*) FROM shared_state WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+        return {"backend": self.name, "database_file": self.database_file, "entries": entries}
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Shares state between workers on any number of hosts through Redis (or any server speaking its protocol).
+    update() is optimistic: WATCH the key, compute, and retry the MULTI/EXEC if another client changed it meanwhile.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, key_prefix: str = "tsla:"):
+        if redis is None:
+            raise RuntimeError("SHARED_STATE_URL points at Redis, but the 'redis' package is not installed.")
+        self.url = url
+        self.key_prefix = key_prefix
+        self._client = redis.Redis.from_url(url)
+
+    def _key(self, key: str) -> str:
+        return self.key_prefix + key
+
+    def get(self, key: str) -> bytes | None:
+        return self._client.get(self._key(key))
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        self._client.set(self._key(key), value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key: str):
+        self._client.delete(self._key(key))
+
+    def touch(self, key: str, ttl: float):
+        self._client.pexpire(self._key(key), int(ttl * 1000))
+
+    def update(self, key: str, function: Callable[[bytes | None], bytes | None], ttl: float | None = None) -> bytes | None:
+        key = self._key(key)
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    value = function(pipe.get(key))
+                    pipe.multi()
+                    if value is None:
+                        pipe.delete(key)
+                    else:
+                        pipe.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+                    pipe.execute()
+                    return value
+                except redis.WatchError:
+                    continue
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "url": self.url.split("@")[-1]} # Without credentials
+
+
+def create_state_backend(url: str) -> StateBackend:
+    """
+    Backend for a SHARED_STATE_URL: 'memory://' (default, single worker), 'sqlite:///path/to/state.db'
+    (all workers of one host) or 'redis://host:6379/0' (any number of hosts).
+    """
+    if url == "memory://":
+        return MemoryStateBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteStateBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateBackend(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL '{url}'. Use memory://, sqlite:///<file> or redis://<host>.")
@@ -0,0 +1,96 @@
+# tests/test_backtest.py
+
+import numpy as np
+import pytest
+
+from data_service.backtest import Bars, BacktestParams, simulate_trades
+
+
+def make_bars(open_, close, signal, high=None, low=None) -> Bars:
+    open_, close = np.asarray(open_, dtype=float), np.asarray(close, dtype=float)
+    high = np.asarray(high, dtype=float) if high is not None else np.maximum(open_, close) + 0.5
+    low = np.asarray(low, dtype=float) if low is not None else np.minimum(open_, close) - 0.5
+    return Bars([f"2024-01-{day + 1:02d}" for day in range(len(close))], open_, high, low, close, np.asarray(signal, dtype=np.int8))
+
+
+@pytest.fixture
+def bars():
+    # LONG on bar 0, another LONG on bar 1 while that trade is open, SHORT on bar 4
+    return make_bars(
+        open_=[10, 10, 11, 12, 13, 12, 11, 10],
+        close=[10, 11, 12, 13, 12, 11, 10, 9],
+        signal=[1, 1, 0, 0, -1, 0, 0, 0],
+    )
+
+
+def test_time_exits_and_overlapping_signal_is_skipped(bars):
+    trades = simulate_trades(bars, BacktestParams(entry="next_open", hold_bars=3))
+
+    # Long: in at bar 1's open (10), out at the close of its 3rd bar (bar 3, 13).
+    # The bar 1 signal would enter at bar 2, inside that trade, so it is skipped.
+    # Short: in at bar 5's open (12), out at bar 7's close (9).
+    assert trades["entry_index"].tolist() == [1, 5]
+    assert trades["exit_index"].tolist() == [3, 7]
+    assert trades["side"].tolist() == [1, -1]
+    assert trades["entry_price"].tolist() == [10.0, 12.0]
+    assert trades["exit_price"].tolist() == [13.0, 9.0]
+    assert trades["exit_reason"].tolist() == ["time", "time"]
+    np.testing.assert_allclose(trades["net_return"], [0.3, 0.25])
+
+
+def test_opposite_signal_exits_at_its_close(bars):
+    trades = simulate_trades(bars, BacktestParams(entry="next_open", hold_bars=10))
+
+    # The long from bar 1 runs until the SHORT on bar 4 and exits at that close (12), then the short starts at bar 5
+    # and runs to the end of the data
+    assert trades["entry_index"].tolist() == [1, 5]
+    assert trades["exit_index"].tolist() == [4, 7]
+    assert trades["exit_reason"].tolist() == ["opposite_signal", "time"]
+    np.testing.assert_allclose(trades["net_return"], [0.2, 0.25])
+
+
+def test_close_entry_can_reverse_on_the_exit_bar(bars):
+    trades = simulate_trades(bars, BacktestParams(entry="close", hold_bars=10))
+
+    # In at bar 0's close (10); the SHORT on bar 4 closes the long and opens the short at the same close (12)
+    assert trades["entry_index"].tolist() == [0, 4]
+    assert trades["exit_index"].tolist() == [4, 7]
+    assert trades["entry_price"].tolist() == [10.0, 12.0]
+    assert trades["exit_price"].tolist() == [12.0, 9.0]
+
+
+def test_shorts_can_be_disabled(bars):
+    trades = simulate_trades(bars, BacktestParams(entry="next_open", hold_bars=3, allow_short=False))
+    assert trades["side"].tolist() == [1]
+
+
+def test_fees_are_charged_on_entry_and_exit(bars):
+    trades = simulate_trades(bars, BacktestParams(entry="next_open", hold_bars=3, fee_pct=1.0))
+    np.testing.assert_allclose(trades["net_return"], [1.3 * 0.99 ** 2 - 1, 1.25 * 0.99 ** 2 - 1])
+
+
+def test_stop_loss_gap_fills_at_the_open():
+    bars = make_bars(open_=[100, 100, 90, 91], close=[100, 101, 91, 92], signal=[1, 0, 0, 0],
+                     high=[101, 102, 92, 93], low=[99, 98, 89, 90])
+    trades = simulate_trades(bars, BacktestParams(entry="next_open", hold_bars=5, stop_loss_pct=5))
+
+    # Stop at 95; bar 1's low (98) stays above it, bar 2 gaps down and opens at 90, below the stop
+    assert trades["exit_index"].tolist() == [2]
+    assert trades["exit_reason"].tolist() == ["stop_loss"]
+    assert trades["exit_price"].tolist() == [90.0]
+    np.testing.assert_allclose(trades["net_return"], [-0.1])
+
+
+def test_stop_wins_when_stop_and_target_hit_on_the_same_bar():
+    bars = make_bars(open_=[100, 100, 100], close=[100, 100, 100], signal=[1, 0, 0],
+                     high=[100, 111, 100], low=[100, 89, 100])
+    trades = simulate_trades(bars, BacktestParams(entry="next_open", hold_bars=2, stop_loss_pct=10, take_profit_pct=10))
+
+    assert trades["exit_reason"].tolist() == ["stop_loss"]
+    assert trades["exit_price"].tolist() == [90.0]
+
+
+def test_signal_on_the_last_bar_is_not_traded():
+    bars = make_bars(open_=[10, 11], close=[11, 12], signal=[0, 1])
+    trades = simulate_trades(bars, BacktestParams(entry="next_open"))
+    assert len(trades["entry_index"]) == 0
@@ -0,0 +1,65 @@
+# tests/test_conversation.py
+
+import time
+
+import google.ai.generativelanguage as glm
+import pytest
+
+from chatbot_service.conversation import ConversationStore
+from shared_state import MemoryStateBackend, SQLiteStateBackend
+
+
+class CountingBackend(MemoryStateBackend):
+    """Counts read-modify-write cycles, which take the write lock on the shared backends."""
+
+    def __init__(self):
+        super().__init__()
+        self.updates = 0
+
+    def update(self, key, function, ttl=None):
+        self.updates += 1
+        return super().update(key, function, ttl)
+
+
+def exchange(question: str, answer: str) -> list:
+    return [glm.Content(role="user", parts=[glm.Part(text=question)]),
+            glm.Content(role="model", parts=[glm.Part(text=answer)])]
+
+
+def test_reading_an_unknown_session_does_not_create_it():
+    store = ConversationStore()
+    assert store.history("nobody") == []
+    assert store.stats()["sessions"] == 0
+
+
+@pytest.mark.parametrize("make_backend", [CountingBackend, lambda: None], ids=["backend", "process"])
+def test_history_returns_appended_turns(make_backend):
+    store = ConversationStore(backend=make_backend())
+    store.append("a", exchange("hello", "hi there"))
+    assert [(content.role, content.parts[0].text) for content in store.history("a")] == [("user", "hello"), ("model", "hi there")]
+    assert store.history("b") == []
+
+
+def test_backend_reads_do_not_write():
+    backend = CountingBackend()
+    store = ConversationStore(backend=backend)
+    store.append("a", exchange("hello", "hi there"))
+    updates = backend.updates
+
+    for _ in range(5):
+        store.history("a")
+        store.history("unknown")
+    assert backend.updates == updates
+    assert backend.get("conversation:unknown") is None
+
+
+def test_backend_reads_keep_the_session_alive(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+    store = ConversationStore(backend=backend, idle_seconds=60)
+    store.append("a", exchange("hello", "hi there"))
+    conn = backend._connection()
+    conn.execute("UPDATE shared_state SET expires_at = expires_at - 50")
+
+    store.history("a")
+    expires_at = conn.execute("SELECT expires_at FROM shared_state WHERE key = 'conversation:a'").fetchone()[0]
+    assert expires_at > time.time() + 55
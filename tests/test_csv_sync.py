@@ -0,0 +1,48 @@
+# tests/test_csv_sync.py
+
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+
+from models import StockData, StockLevel, drop_unchanged_records, replace_levels, upsert_records
+
+DAY = date(2025, 5, 2)
+
+
+def bar(day: date = DAY, close: float = 282.157) -> dict:
+    return {
+        'timestamp': day, 'direction': 'SHORT', 'open_price': 279.446, 'high_price': 284.397, 'low_price': 270.706,
+        'close_price': close, 'volume': 87.9228, 'support_lower': 260.0, 'support_upper': 260.0,
+        'resistance_lower': 290.0, 'resistance_upper': 295.0,
+    }
+
+
+def levels(day: date = DAY, prices: tuple = (290.0, 295.0)) -> list[dict]:
+    return [{'timestamp': day, 'kind': 'resistance', 'position': i, 'price': price} for i, price in enumerate(prices)]
+
+
+@pytest.fixture
+def conn():
+    engine = create_engine("sqlite://")
+    StockData.__table__.create(engine)
+    StockLevel.__table__.create(engine)
+    with engine.connect() as conn:
+        upsert_records(conn, [bar()])
+        replace_levels(conn, [DAY], levels())
+        yield conn
+
+
+def test_rereading_the_stored_day_changes_nothing(conn):
+    assert drop_unchanged_records(conn, [bar()], levels()) == ([], [])
+
+
+def test_changed_and_new_days_are_kept(conn):
+    next_day = date(2025, 5, 5)
+    records = [bar(close=290.0), bar(next_day)]
+    assert drop_unchanged_records(conn, records, levels() + levels(next_day)) == (records, levels() + levels(next_day))
+
+
+def test_changed_levels_keep_the_day(conn):
+    changed = levels(prices=(290.0, 293.0))
+    assert drop_unchanged_records(conn, [bar()], changed) == ([bar()], changed)
@@ -0,0 +1,52 @@
+# tests/test_indicators.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_service.indicators import INDICATOR_COLUMNS, LOOKBACK_BARS, RSI_STATE_COLUMNS, STATE_COLUMNS, compute_indicators
+
+
+@pytest.fixture
+def bars():
+    rng = np.random.default_rng(7)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 400)))
+    spread = close * rng.uniform(0.005, 0.03, 400)
+    return pd.DataFrame({
+        "high_price": close + spread,
+        "low_price": close - spread,
+        "close_price": close,
+        "volume": rng.uniform(1e6, 5e6, 400),
+    })
+
+
+@pytest.mark.parametrize("split", [LOOKBACK_BARS + 1, 250, 399])
+def test_appending_matches_a_full_rebuild(bars, split):
+    full = compute_indicators(bars)
+
+    # What an append does: the earlier bars' stored state, plus LOOKBACK_BARS of history for the rolling windows
+    earlier = compute_indicators(bars.iloc[:split])
+    state = earlier.iloc[-1][STATE_COLUMNS].to_dict()
+    history_start = split - LOOKBACK_BARS
+    appended = compute_indicators(bars.iloc[history_start:], start=LOOKBACK_BARS, state=state)
+
+    assert list(appended.index) == list(range(split, len(bars)))
+    columns = INDICATOR_COLUMNS + RSI_STATE_COLUMNS
+    np.testing.assert_allclose(appended[columns].to_numpy(), full.iloc[split:][columns].to_numpy(), rtol=1e-9, equal_nan=True)
+
+
+def test_appending_bar_by_bar_matches_a_full_rebuild(bars):
+    full = compute_indicators(bars)
+    computed = compute_indicators(bars.iloc[:300])
+    for end in range(301, len(bars) + 1):
+        state = computed.iloc[-1][STATE_COLUMNS].to_dict()
+        step = compute_indicators(bars.iloc[end - 1 - LOOKBACK_BARS:end], start=LOOKBACK_BARS, state=state)
+        computed = pd.concat([computed, step])
+
+    np.testing.assert_allclose(computed.to_numpy(), full.to_numpy(), rtol=1e-9, equal_nan=True)
+
+
+def test_warm_up_values_are_missing(bars):
+    full = compute_indicators(bars)
+    assert full["sma_200"].iloc[:199].isna().all() and full["sma_200"].iloc[199:].notna().all()
+    assert full["rsi_14"].iloc[:14].isna().all() and full["rsi_14"].iloc[14:].between(0, 100).all()
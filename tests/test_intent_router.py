@@ -0,0 +1,63 @@
+# tests/test_intent_router.py
+
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import StockData
+from chatbot_service.intent_router import IntentRouter
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    StockData.__table__.create(engine)
+    with Session(engine) as session:
+        session.add_all([
+            StockData(timestamp=date(2024, 3, 4), open_price=10.0, high_price=12.0, low_price=9.0, close_price=11.0, volume=100.0),
+            StockData(timestamp=date(2024, 3, 5), open_price=11.0, high_price=13.0, low_price=10.0, close_price=12.5, volume=200.0),
+        ])
+        session.commit()
+    return engine
+
+
+def test_answers_and_counts_template_questions(engine):
+    router = IntentRouter()
+    with Session(engine) as db:
+        assert router.answer(db, "close on 2024-03-05") == "The closing price on 2024-03-05 was $12.50."
+        assert router.answer(db, "compare the close of tsla with the s&p 500") is None
+
+    stats = router.stats()
+    assert (stats["total_queries"], stats["fast_path_queries"], stats["fast_path_failures"]) == (2, 1, 0)
+    assert stats["by_intent"] == {"value_on_date": 1}
+    assert 0 < stats["avg_fast_path_ms"] < 1000
+
+
+def test_failed_sql_is_counted_as_a_fallback_not_a_match():
+    router = IntentRouter()
+    with Session(create_engine("sqlite://")) as db: # No tesla_stock table
+        assert router.answer(db, "highest price in 2023") is None
+
+    stats = router.stats()
+    assert (stats["total_queries"], stats["fast_path_queries"], stats["fast_path_failures"]) == (1, 0, 1)
+    assert stats["by_intent"] == {}
+    assert stats["avg_fast_path_ms"] == 0.0
+
+
+@pytest.mark.parametrize("question", [
+    "average close until 2024-06-01",
+    "highest close from 2023-01-01",
+    "lowest close to 2022-12-31",
+    "average volume through 2023",
+])
+def test_open_ended_ranges_go_to_the_llm(question):
+    assert IntentRouter().route(question) is None
+
+
+def test_full_date_range_is_routed():
+    routed = IntentRouter().route("average close between 2023-01-01 and 2023-03-31")
+    assert routed.params == {"start": "2023-01-01", "end": "2023-03-31"}
+    routed = IntentRouter().route("highest close from 2023-01-01 to 2023-06-30")
+    assert routed.params == {"start": "2023-01-01", "end": "2023-06-30"}
@@ -0,0 +1,11 @@
+# tests/test_live_feed.py
+
+import pytest
+
+from data_service.live_feed import BarBroadcaster, CSVReplaySource
+
+
+@pytest.mark.parametrize("bars_per_second", [0, -1.0, float("nan")])
+def test_replay_speed_must_be_positive(bars_per_second):
+    with pytest.raises(ValueError, match="bars_per_second"):
+        CSVReplaySource(BarBroadcaster(), bars_per_second=bars_per_second)
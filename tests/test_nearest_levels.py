@@ -0,0 +1,39 @@
+# tests/test_nearest_levels.py
+
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import StockLevel
+from data_service.stock_query import find_nearest_levels
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    StockLevel.__table__.create(engine)
+    with Session(engine) as session:
+        session.add_all([
+            StockLevel(timestamp=date(2024, 1, 2), kind="support", position=0, price=90.0),
+            StockLevel(timestamp=date(2024, 1, 3), kind="support", position=0, price=100.0),
+            StockLevel(timestamp=date(2024, 1, 4), kind="support", position=0, price=110.0),
+        ])
+        session.commit()
+        yield session
+
+
+def test_level_at_the_price_is_returned_once_as_below(db):
+    levels = find_nearest_levels(db, 100.0, "support")
+    assert [(level["side"], level["price"]) for level in levels] == [("below", 100.0), ("above", 110.0)]
+
+
+def test_levels_on_both_sides(db):
+    levels = find_nearest_levels(db, 95.0, "support")
+    assert [(level["side"], level["price"]) for level in levels] == [("below", 90.0), ("above", 100.0)]
+
+
+def test_only_the_side_that_has_levels(db):
+    levels = find_nearest_levels(db, 120.0, "support")
+    assert [(level["side"], level["price"]) for level in levels] == [("below", 110.0)]
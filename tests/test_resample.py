@@ -0,0 +1,51 @@
+# tests/test_resample.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_service.resample import INTRADAY_INTERVALS, RESAMPLED_FIELDS, resample_ohlcv
+
+
+@pytest.fixture
+def minute_bars():
+    """Three days of 1-minute bars with random gaps (missing minutes, and a whole missing hour)."""
+    rng = np.random.default_rng(11)
+    start = 1_704_153_600 # 2024-01-02 00:00 UTC
+    ts = start + 60 * np.arange(3 * 24 * 60)
+    keep = rng.random(len(ts)) > 0.3
+    keep[(ts >= start + 5 * 3600) & (ts < start + 6 * 3600)] = False
+    ts = ts[keep]
+    close = 200 + np.cumsum(rng.normal(0, 0.2, len(ts)))
+    open_ = close + rng.normal(0, 0.1, len(ts))
+    return {
+        "ts": ts, "open": open_, "close": close,
+        "high": np.maximum(open_, close) + rng.uniform(0, 0.3, len(ts)),
+        "low": np.minimum(open_, close) - rng.uniform(0, 0.3, len(ts)),
+        "volume": rng.integers(100, 10_000, len(ts)).astype(float),
+    }
+
+
+@pytest.mark.parametrize("interval", list(INTRADAY_INTERVALS))
+def test_matches_pandas_resample(minute_bars, interval):
+    seconds = INTRADAY_INTERVALS[interval]
+    bars = resample_ohlcv(minute_bars["ts"], minute_bars["open"], minute_bars["high"], minute_bars["low"],
+                          minute_bars["close"], minute_bars["volume"], seconds=seconds)
+
+    frame = pd.DataFrame({name: minute_bars[name] for name in ("open", "high", "low", "close", "volume")},
+                         index=pd.to_datetime(minute_bars["ts"], unit="s"))
+    expected = frame.resample(f"{seconds}s", origin="epoch").agg(
+        {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+    expected["bar_count"] = frame["close"].resample(f"{seconds}s", origin="epoch").count()
+    expected = expected[expected["bar_count"] > 0] # resample_ohlcv skips empty buckets, like GROUP BY
+
+    assert list(bars) == RESAMPLED_FIELDS
+    np.testing.assert_array_equal(bars["time"], (expected.index - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+    for name in ("open", "high", "low", "close", "volume", "bar_count"):
+        np.testing.assert_allclose(bars[name], expected[name].to_numpy(), err_msg=name)
+
+
+def test_empty_input():
+    empty = np.empty(0)
+    bars = resample_ohlcv(empty.astype(np.int64), empty, empty, empty, empty, empty, seconds=60)
+    assert all(len(bars[name]) == 0 for name in RESAMPLED_FIELDS)
@@ -0,0 +1,81 @@
+# tests/test_sql_cache.py
+
+import pytest
+
+from chatbot_service.sql_cache import SQLTranslationCache, normalize_query
+
+SCHEMA = "schema-v1"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLTranslationCache(db_file=str(tmp_path / "sql_cache.db"))
+
+
+def test_exact_and_similar_hits(cache):
+    cache.store("What was the average closing price in 2023?", "SELECT 1", SCHEMA)
+    assert cache.lookup("what was the average closing price in 2023", SCHEMA) == "SELECT 1"
+    assert cache.lookup("Show me the mean close price for 2023", SCHEMA) == "SELECT 1"
+
+
+def test_iso_dates_are_single_tokens():
+    assert normalize_query("open and close on 2024-05-01") == ["open", "close", "2024-05-01"]
+
+
+def test_swapped_day_and_month_is_a_miss(cache):
+    cache.store("open and close on 2024-05-01", "SELECT may_first", SCHEMA)
+    assert cache.lookup("open and close on 2024-01-05", SCHEMA) is None
+
+
+@pytest.mark.parametrize("question", [
+    "average close between 2023-03-01 and 2023-03-01",
+    "average close between 2023-01-01 and 2023-01-03",
+    "average close between 2023-03-01 and 2023-01-01",
+])
+def test_different_date_range_is_a_miss(cache, question):
+    cache.store("average close between 2023-01-01 and 2023-03-01", "SELECT q1", SCHEMA)
+    assert cache.lookup(question, SCHEMA) is None
+
+
+def test_negated_condition_is_a_miss(cache):
+    cache.store("days where close above 200", "SELECT above", SCHEMA)
+    assert cache.lookup("close not above 200", SCHEMA) is None
+    assert cache.lookup("days where close below 200", SCHEMA) is None
+
+
+def test_other_schema_is_a_miss(cache):
+    cache.store("highest close ever", "SELECT MAX(close_price)", SCHEMA)
+    assert cache.lookup("highest close ever", "schema-v2") is None
+
+
+@pytest.mark.parametrize("stored, question", [
+    ("what was the highest close in 2023", "what was the lowest close in 2023"),
+    ("what was the highest close in 2023", "what was the highest open in 2023"),
+    ("what was the highest close in 2023", "what was the highest close in 2022"),
+    ("average volume in march 2023", "average volume in april 2023"),
+    ("days where close above 200", "days where close above 250"),
+    ("how many long signals before 2023-06-01", "how many long signals after 2023-06-01"),
+    ("days where close above 200 and volume above 1000000", "days where close above 1000000 and volume above 200"),
+])
+def test_questions_that_differ_in_a_critical_word_are_a_miss(cache, stored, question):
+    cache.store(stored, "SELECT stored", SCHEMA)
+    assert cache.lookup(question, SCHEMA) is None
+    assert cache.lookup(stored, SCHEMA) == "SELECT stored"
+
+
+def test_hits_do_not_write_until_flushed(tmp_path):
+    db_file = str(tmp_path / "sql_cache.db")
+    cache = SQLTranslationCache(db_file=db_file, max_entries=2)
+    cache.store("highest close ever", "SELECT high", SCHEMA)
+    cache.store("lowest close ever", "SELECT low", SCHEMA)
+
+    changes = cache._conn.total_changes
+    assert cache.lookup("highest close ever", SCHEMA) == "SELECT high"
+    assert cache._conn.total_changes == changes
+
+    cache.flush()
+    # The hit made "highest" the most recently used entry, so a fresh cache evicts "lowest" first
+    reloaded = SQLTranslationCache(db_file=db_file, max_entries=2)
+    reloaded.store("average close ever", "SELECT avg", SCHEMA)
+    assert reloaded.lookup("highest close ever", SCHEMA) == "SELECT high"
+    assert reloaded.lookup("lowest close ever", SCHEMA) is None